@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+'''Benchmark for the spatial aggregation of child object features by the
+"Aggregation" tool (see :class:`tmlib.tools.aggregation.Aggregation`).
+
+Creates synthetic "mapobject_segmentations" and "feature_values" tables in a
+scratch schema of a local PostGIS database, where each partition (site) holds
+a grid of square parent objects with point-like child objects inside, and
+compares a single query over all partitions with per-partition queries
+executed in parallel threads
+(see :meth:`tmlib.tools.aggregation.Aggregation.aggregate_partition_by_location`).
+
+The database requires the "postgis" and "hstore" extensions.
+'''
+import time
+import argparse
+import threading
+import collections
+import psycopg2
+from psycopg2.extras import NamedTupleCursor
+
+from tmlib.tools.aggregation import Aggregation
+
+SCHEMA = 'benchmark_aggregation'
+
+FeatureRecord = collections.namedtuple(
+    'FeatureRecord', ['feature_id', 'column_index']
+)
+
+
+def connect(dsn):
+    connection = psycopg2.connect(dsn)
+    connection.autocommit = True
+    cursor = connection.cursor(cursor_factory=NamedTupleCursor)
+    cursor.execute('SET search_path TO %s, public' % SCHEMA)
+    return connection, cursor
+
+
+def create_tables(dsn, n_partitions, n_parents, n_children, n_features):
+    connection, cursor = connect(dsn)
+    cursor.execute('''
+        DROP SCHEMA IF EXISTS {schema} CASCADE;
+        CREATE SCHEMA {schema};
+        CREATE TABLE mapobject_segmentations (
+            partition_key integer NOT NULL,
+            mapobject_id bigint NOT NULL,
+            segmentation_layer_id integer NOT NULL,
+            geom_polygon geometry(POLYGON),
+            geom_centroid geometry(POINT) NOT NULL,
+            PRIMARY KEY (mapobject_id, partition_key, segmentation_layer_id)
+        );
+        CREATE TABLE feature_values (
+            partition_key integer NOT NULL,
+            mapobject_id bigint NOT NULL,
+            tpoint integer NOT NULL,
+            values hstore,
+            value_array real[],
+            PRIMARY KEY (partition_key, mapobject_id, tpoint)
+        );
+    '''.format(schema=SCHEMA))
+    # Parents (layer 1) are squares of 100 x 100 pixels arranged in a row
+    # per partition. Children (layer 2) are points within these squares.
+    cursor.execute('''
+        INSERT INTO mapobject_segmentations
+        SELECT
+            k, k * %(n_parents)s + p, 1,
+            ST_MakeEnvelope(p * 100, k * 100, p * 100 + 99, k * 100 + 99),
+            ST_MakePoint(p * 100 + 50, k * 100 + 50)
+        FROM generate_series(0, %(n_partitions)s - 1) AS k,
+        generate_series(0, %(n_parents)s - 1) AS p;
+
+        INSERT INTO mapobject_segmentations
+        SELECT
+            k, %(offset)s + (k * %(n_parents)s + p) * %(n_children)s + c, 2,
+            NULL,
+            ST_MakePoint(p * 100 + 1 + random() * 97, k * 100 + 1 + random() * 97)
+        FROM generate_series(0, %(n_partitions)s - 1) AS k,
+        generate_series(0, %(n_parents)s - 1) AS p,
+        generate_series(0, %(n_children)s - 1) AS c;
+
+        INSERT INTO feature_values (partition_key, mapobject_id, tpoint, values)
+        SELECT
+            s.partition_key, s.mapobject_id, 0,
+            hstore(
+                ARRAY(SELECT f::text FROM generate_series(1, %(n_features)s) AS f),
+                ARRAY(
+                    SELECT (random() * f)::text
+                    FROM generate_series(1, %(n_features)s) AS f
+                )
+            )
+        FROM mapobject_segmentations AS s
+        WHERE s.segmentation_layer_id = 2;
+
+        CREATE INDEX ON mapobject_segmentations USING gist (geom_polygon);
+        CREATE INDEX ON mapobject_segmentations USING gist (geom_centroid);
+        CREATE INDEX ON mapobject_segmentations (partition_key);
+        ANALYZE;
+    ''', {
+        'n_partitions': n_partitions, 'n_parents': n_parents,
+        'n_children': n_children, 'n_features': n_features,
+        'offset': n_partitions * n_parents
+    })
+    cursor.close()
+    connection.close()
+
+
+def get_value_expressions(n_features):
+    return Aggregation._get_feature_value_expressions([
+        FeatureRecord(i, None) for i in range(1, n_features + 1)
+    ])
+
+
+def aggregate_all(dsn, n_features):
+    connection, cursor = connect(dsn)
+    cursor.execute('''
+        SELECT
+            p.partition_key, p.mapobject_id, 0 AS tpoint,
+            count(c.mapobject_id) AS count, {aggregates}
+        FROM mapobject_segmentations AS p
+        LEFT OUTER JOIN (
+            mapobject_segmentations AS c
+            JOIN feature_values AS v
+            ON v.mapobject_id = c.mapobject_id
+            AND v.partition_key = c.partition_key
+            AND v.tpoint = 0
+        )
+        ON c.segmentation_layer_id = 2
+        AND ST_Contains(p.geom_polygon, c.geom_centroid)
+        WHERE p.segmentation_layer_id = 1
+        GROUP BY p.partition_key, p.mapobject_id
+    '''.format(
+        aggregates=Aggregation._build_aggregates(
+            get_value_expressions(n_features)
+        )
+    ))
+    partials = cursor.fetchall()
+    cursor.close()
+    connection.close()
+    return partials
+
+
+def aggregate_per_partition(dsn, n_partitions, n_features, n_threads):
+    partition_keys = range(n_partitions)
+    value_expressions = get_value_expressions(n_features)
+    partials = [list() for i in range(n_threads)]
+
+    def aggregate(index):
+        connection, cursor = connect(dsn)
+        for partition_key in partition_keys[index::n_threads]:
+            partials[index].extend(
+                Aggregation.aggregate_partition_by_location(
+                    cursor, partition_key, [(1, 2, 0)], value_expressions
+                )
+            )
+        cursor.close()
+        connection.close()
+
+    threads = [
+        threading.Thread(target=aggregate, args=(i, ))
+        for i in range(n_threads)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return [p for thread_partials in partials for p in thread_partials]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--dsn', default='dbname=postgres',
+        help='libpq connection string of the benchmark database'
+    )
+    parser.add_argument(
+        '--partitions', type=int, default=100,
+        help='number of partitions (sites)'
+    )
+    parser.add_argument(
+        '--parents', type=int, default=100,
+        help='number of parent objects per partition'
+    )
+    parser.add_argument(
+        '--children', type=int, default=50,
+        help='number of child objects per parent object'
+    )
+    parser.add_argument(
+        '--features', type=int, default=10,
+        help='number of aggregated child features'
+    )
+    parser.add_argument(
+        '--threads', type=int, default=4,
+        help='number of parallel connections for per-partition queries'
+    )
+    args = parser.parse_args()
+
+    n = args.partitions * args.parents * args.children
+    print('synthetic tables with %d child objects' % n)
+    create_tables(
+        args.dsn, args.partitions, args.parents, args.children, args.features
+    )
+
+    start = time.time()
+    partials = aggregate_all(args.dsn, args.features)
+    duration = time.time() - start
+    print(
+        'single query:                 %d parents in %.2f s'
+        % (len(partials), duration)
+    )
+
+    for n_threads in sorted({1, args.threads}):
+        start = time.time()
+        partials = aggregate_per_partition(
+            args.dsn, args.partitions, args.features, n_threads
+        )
+        duration = time.time() - start
+        print(
+            'per partition (%2d threads):   %d parents in %.2f s'
+            % (n_threads, len(partials), duration)
+        )
+
+    start = time.time()
+    stats = Aggregation._combine_partial_statistics(partials, args.features)
+    duration = time.time() - start
+    print(
+        'combine partial statistics:   %d parents in %.2f s'
+        % (len(stats['mapobject_id']), duration)
+    )
+
+    connection, cursor = connect(args.dsn)
+    cursor.execute('DROP SCHEMA %s CASCADE' % SCHEMA)
+    cursor.close()
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+'''Benchmark for parallel model selection and pipelined prediction of
+classification tools (see :class:`tmlib.tools.base.Classifier`).
+
+Trains a classifier on a synthetic feature matrix with different numbers of
+CPU cores and compares serial with pipelined prediction of batches
+(see :meth:`tmlib.tools.base.Classifier.predict_and_save`), where loading and
+saving of batches is simulated by a fixed delay per batch, which corresponds
+to the time spent waiting for the database.
+'''
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from sklearn.datasets import make_classification
+
+from tmlib.tools.classification import Classification
+
+
+class _Classification(Classification):
+
+    '''Classification tool with a simulated database.'''
+
+    def __init__(self, n_cores, delay):
+        super(_Classification, self).__init__(0, n_cores)
+        self.delay = delay
+
+    def save_result_values(self, mapobject_type_name, result_id, data):
+        time.sleep(self.delay)
+
+
+def create_feature_data(n_objects, n_features, offset=0):
+    X, y = make_classification(
+        n_samples=n_objects, n_features=n_features, n_informative=n_features,
+        n_redundant=0, n_classes=3, random_state=offset
+    )
+    index = pd.MultiIndex.from_arrays(
+        [np.arange(offset, offset + n_objects), np.zeros(n_objects)],
+        names=['mapobject_id', 'tpoint']
+    )
+    df = pd.DataFrame(X.astype(np.float32), index=index)
+    labels = dict(zip(index.get_level_values('mapobject_id'), y))
+    return (df, labels)
+
+
+def load_batches(n_batches, batch_size, n_features, delay):
+    for i in range(n_batches):
+        time.sleep(delay)
+        df, labels = create_feature_data(
+            batch_size, n_features, offset=i * batch_size
+        )
+        yield df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--method', default='randomforest',
+        choices={'randomforest', 'svm', 'logisticregression'},
+        help='classification method'
+    )
+    parser.add_argument(
+        '--training', type=int, default=2000,
+        help='number of mapobjects used for training'
+    )
+    parser.add_argument(
+        '--features', type=int, default=20,
+        help='number of features'
+    )
+    parser.add_argument(
+        '--batches', type=int, default=10,
+        help='number of batches used for prediction'
+    )
+    parser.add_argument(
+        '--batch-size', type=int, default=100000,
+        help='number of mapobjects per batch'
+    )
+    parser.add_argument(
+        '--delay', type=float, default=1.0,
+        help='simulated time in seconds for loading or saving a batch'
+    )
+    parser.add_argument(
+        '--cores', type=int, default=4,
+        help='number of CPU cores'
+    )
+    args = parser.parse_args()
+
+    training_set, labels = create_feature_data(args.training, args.features)
+    for n_cores in sorted({1, args.cores}):
+        tool = _Classification(n_cores, args.delay)
+        start = time.time()
+        model, scaler = tool.train_supervised(
+            training_set, labels, args.method, n_fold_cv=5
+        )
+        duration = time.time() - start
+        print(
+            'train "%s" with %2d cores:   %.2f s'
+            % (args.method, n_cores, duration)
+        )
+
+    batches = load_batches(
+        args.batches, args.batch_size, args.features, args.delay
+    )
+    start = time.time()
+    for batch in batches:
+        labels = tool.predict(batch, model, scaler)
+        tool.save_result_values('objects', 1, labels)
+    duration = time.time() - start
+    print('serial prediction:              %.2f s' % duration)
+
+    batches = load_batches(
+        args.batches, args.batch_size, args.features, args.delay
+    )
+    start = time.time()
+    tool.predict_and_save('objects', 1, batches, model, scaler)
+    duration = time.time() - start
+    print('pipelined prediction:           %.2f s' % duration)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+'''Benchmark for the clean-up of invalid mapobjects in the "collect" phase of
+the *jterator* step.
+
+Creates synthetic "mapobjects", "mapobject_segmentations" and
+"feature_values" tables in a scratch schema of a local PostGIS database and
+compares deletion based on a client-side list of mapobject IDs with the
+server-side anti-join deletes per partition key
+(see :meth:`tmlib.models.mapobject.Mapobject.delete_invalid_objects_per_partition`).
+
+The database requires the "postgis" and "hstore" extensions.
+'''
+import time
+import argparse
+import threading
+import psycopg2
+from psycopg2.extras import NamedTupleCursor
+
+from tmlib.models.mapobject import Mapobject
+
+SCHEMA = 'benchmark_cleanup'
+
+
+def connect(dsn):
+    connection = psycopg2.connect(dsn)
+    connection.autocommit = True
+    cursor = connection.cursor(cursor_factory=NamedTupleCursor)
+    cursor.execute('SET search_path TO %s, public' % SCHEMA)
+    return connection, cursor
+
+
+def create_tables(dsn, n_partitions, n_objects, k):
+    connection, cursor = connect(dsn)
+    cursor.execute('''
+        DROP SCHEMA IF EXISTS {schema} CASCADE;
+        CREATE SCHEMA {schema};
+        CREATE TABLE mapobjects (
+            partition_key integer NOT NULL,
+            id bigint NOT NULL,
+            mapobject_type_id integer NOT NULL,
+            ref_id bigint,
+            PRIMARY KEY (id, partition_key)
+        );
+        CREATE TABLE mapobject_segmentations (
+            partition_key integer NOT NULL,
+            mapobject_id bigint NOT NULL,
+            segmentation_layer_id integer NOT NULL,
+            label integer,
+            geom_polygon geometry(POLYGON),
+            geom_centroid geometry(POINT) NOT NULL,
+            PRIMARY KEY (mapobject_id, partition_key, segmentation_layer_id),
+            FOREIGN KEY (mapobject_id, partition_key)
+            REFERENCES mapobjects (id, partition_key) ON DELETE CASCADE
+        );
+        CREATE TABLE feature_values (
+            partition_key integer NOT NULL,
+            mapobject_id bigint NOT NULL,
+            tpoint integer NOT NULL,
+            values hstore,
+            PRIMARY KEY (partition_key, mapobject_id, tpoint),
+            FOREIGN KEY (mapobject_id, partition_key)
+            REFERENCES mapobjects (id, partition_key) ON DELETE CASCADE
+        );
+        -- Shards of distributed tables only contain rows of a subset of
+        -- partitions. We mimic this with an index on the partition key.
+        CREATE INDEX ON mapobjects (partition_key);
+        -- Deletes per partition target shards by name, which we mimic with
+        -- (automatically updatable) views.
+        CREATE VIEW mapobjects_0 AS SELECT * FROM mapobjects;
+        CREATE VIEW mapobject_segmentations_0 AS
+            SELECT * FROM mapobject_segmentations;
+        CREATE VIEW feature_values_0 AS SELECT * FROM feature_values;
+    '''.format(schema=SCHEMA))
+    # Every k-th object lacks a segmentation, every k-th + 1 object has an
+    # invalid (self-intersecting) polygon and every k-th + 2 object lacks
+    # feature values.
+    cursor.execute('''
+        INSERT INTO mapobjects (partition_key, id, mapobject_type_id)
+        SELECT (i - 1) / %(n_objects)s + 1, i, 1
+        FROM generate_series(1, %(n)s) AS i;
+
+        INSERT INTO mapobject_segmentations (
+            partition_key, mapobject_id, segmentation_layer_id, label,
+            geom_polygon, geom_centroid
+        )
+        SELECT
+            m.partition_key, m.id, 1, m.id,
+            CASE WHEN m.id %% %(k)s = 1
+                THEN ST_GeomFromText('POLYGON((0 0, 10 10, 10 0, 0 10, 0 0))')
+                ELSE ST_MakeEnvelope(m.id, 0, m.id + 10, 10)
+            END,
+            ST_MakePoint(m.id + 5, 5)
+        FROM mapobjects AS m
+        WHERE m.id %% %(k)s != 0;
+
+        INSERT INTO feature_values (partition_key, mapobject_id, tpoint, values)
+        SELECT m.partition_key, m.id, 0, hstore('1', m.id::text)
+        FROM mapobjects AS m
+        WHERE m.id %% %(k)s != 2;
+
+        ANALYZE;
+    ''', {'n_objects': n_objects, 'n': n_partitions * n_objects, 'k': k})
+    cursor.close()
+    connection.close()
+
+
+def delete_by_id_list(dsn, n_partitions):
+    connection, cursor = connect(dsn)
+    cursor.execute('''
+        SELECT m.id FROM mapobjects AS m
+        LEFT OUTER JOIN mapobject_segmentations AS s
+        ON m.id = s.mapobject_id AND m.partition_key = s.partition_key
+        WHERE s.mapobject_id IS NULL AND m.mapobject_type_id = 1
+    ''')
+    mapobject_ids = [r.id for r in cursor.fetchall()]
+    cursor.execute('''
+        SELECT m.id FROM mapobjects AS m
+        JOIN mapobject_segmentations AS s
+        ON m.id = s.mapobject_id AND m.partition_key = s.partition_key
+        WHERE NOT ST_IsValid(s.geom_polygon) AND m.mapobject_type_id = 1
+    ''')
+    mapobject_ids += [r.id for r in cursor.fetchall()]
+    cursor.execute('''
+        SELECT m.id FROM mapobjects AS m
+        LEFT OUTER JOIN feature_values AS v
+        ON m.id = v.mapobject_id AND m.partition_key = v.partition_key
+        WHERE v.mapobject_id IS NULL AND m.mapobject_type_id = 1
+    ''')
+    mapobject_ids += [r.id for r in cursor.fetchall()]
+    cursor.execute(
+        'DELETE FROM mapobjects WHERE id = ANY(%(ids)s)', {'ids': mapobject_ids}
+    )
+    count = cursor.rowcount
+    cursor.close()
+    connection.close()
+    return count
+
+
+def delete_per_partition(dsn, n_partitions, n_threads):
+    partition_keys = range(1, n_partitions + 1)
+    counts = [0] * n_threads
+    shard_ids = {
+        'mapobjects': 0, 'mapobject_segmentations': 0, 'feature_values': 0
+    }
+
+    def delete(index):
+        connection, cursor = connect(dsn)
+        for partition_key in partition_keys[index::n_threads]:
+            counts[index] += Mapobject.delete_invalid_objects_per_partition(
+                cursor, shard_ids, partition_key, 1
+            )
+        cursor.close()
+        connection.close()
+
+    threads = [
+        threading.Thread(target=delete, args=(i, )) for i in range(n_threads)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--dsn', default='dbname=postgres',
+        help='libpq connection string of the benchmark database'
+    )
+    parser.add_argument(
+        '--partitions', type=int, default=1000,
+        help='number of partitions (sites)'
+    )
+    parser.add_argument(
+        '--objects', type=int, default=1000,
+        help='number of mapobjects per partition'
+    )
+    parser.add_argument(
+        '--invalid', type=int, default=100,
+        help='every n-th mapobject lacks a segmentation, etc.'
+    )
+    parser.add_argument(
+        '--threads', type=int, default=4,
+        help='number of parallel connections for per-partition deletes'
+    )
+    args = parser.parse_args()
+
+    n = args.partitions * args.objects
+    print('synthetic table with %d mapobjects' % n)
+
+    create_tables(args.dsn, args.partitions, args.objects, args.invalid)
+    start = time.time()
+    count = delete_by_id_list(args.dsn, args.partitions)
+    duration = time.time() - start
+    print(
+        'ID list:                     deleted %d objects in %.2f s'
+        % (count, duration)
+    )
+
+    for n_threads in sorted({1, args.threads}):
+        create_tables(args.dsn, args.partitions, args.objects, args.invalid)
+        start = time.time()
+        count = delete_per_partition(args.dsn, args.partitions, n_threads)
+        duration = time.time() - start
+        print(
+            'per partition (%2d threads):  deleted %d objects in %.2f s'
+            % (n_threads, count, duration)
+        )
+
+    connection, cursor = connect(args.dsn)
+    cursor.execute('DROP SCHEMA %s CASCADE' % SCHEMA)
+    cursor.close()
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
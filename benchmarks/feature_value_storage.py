@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+'''Benchmark for loading feature values stored as "hstore" in comparison to
+the columnar "real[]" format
+(see :attr:`tmlib.models.feature.FeatureValues.value_array`).
+
+Creates a synthetic "feature_values" table in a scratch schema of a local
+PostgreSQL database and loads a subset of features into a
+:class:`pandas.DataFrame` of floating point values, once by slicing the
+"hstore" column and casting the text values in Python (as done by
+:meth:`tmlib.tools.base.Tool.load_feature_values` for features without
+:attr:`column_index <tmlib.models.feature.Feature.column_index>`) and once by
+slicing the array column, which is transferred as numbers.
+
+The database requires the "hstore" extension.
+'''
+import time
+import argparse
+import psycopg2
+import numpy as np
+import pandas as pd
+from psycopg2.extras import NamedTupleCursor, register_hstore
+
+SCHEMA = 'benchmark_feature_values'
+
+
+def connect(dsn):
+    connection = psycopg2.connect(dsn)
+    connection.autocommit = True
+    cursor = connection.cursor(cursor_factory=NamedTupleCursor)
+    cursor.execute('SET search_path TO %s, public' % SCHEMA)
+    return connection, cursor
+
+
+def create_table(dsn, n_objects, n_features):
+    connection, cursor = connect(dsn)
+    cursor.execute('''
+        DROP SCHEMA IF EXISTS {schema} CASCADE;
+        CREATE SCHEMA {schema};
+        CREATE TABLE feature_values (
+            partition_key integer NOT NULL,
+            mapobject_id bigint NOT NULL,
+            tpoint integer NOT NULL,
+            values hstore,
+            value_array real[],
+            PRIMARY KEY (partition_key, mapobject_id, tpoint)
+        );
+    '''.format(schema=SCHEMA))
+    cursor.execute('''
+        INSERT INTO feature_values (
+            partition_key, mapobject_id, tpoint, values, value_array
+        )
+        SELECT i / 1000, i, 0, hstore(keys, vals::text[]), vals::real[]
+        FROM generate_series(1, %(n)s) AS i,
+        LATERAL (
+            SELECT
+                array_agg(f::text ORDER BY f) AS keys,
+                array_agg(random() + i * 0 ORDER BY f) AS vals
+            FROM generate_series(1, %(k)s) AS f
+        ) AS features;
+        ANALYZE;
+    ''', {'n': n_objects, 'k': n_features})
+    cursor.close()
+    connection.close()
+
+
+def load_hstore(dsn, feature_ids):
+    connection, cursor = connect(dsn)
+    register_hstore(connection)
+    cursor.execute('''
+        SELECT v.mapobject_id, slice(v.values, %(feature_ids)s) AS values
+        FROM feature_values AS v
+    ''', {'feature_ids': [str(i) for i in feature_ids]})
+    records = cursor.fetchall()
+    values = [r.values for r in records]
+    index = [r.mapobject_id for r in records]
+    df = pd.DataFrame(values, index=index).astype(float)
+    cursor.close()
+    connection.close()
+    return df
+
+
+def load_array(dsn, feature_ids):
+    connection, cursor = connect(dsn)
+    elements = ', '.join(['v.value_array[%d]' % i for i in feature_ids])
+    cursor.execute('''
+        SELECT v.mapobject_id, ARRAY[{elements}] AS value_array
+        FROM feature_values AS v
+    '''.format(elements=elements))
+    records = cursor.fetchall()
+    n = len(records)
+    index = np.fromiter(
+        (r.mapobject_id for r in records), dtype=np.int64, count=n
+    )
+    values = np.array(
+        [r.value_array for r in records], dtype=np.float32
+    ).reshape(n, len(feature_ids))
+    df = pd.DataFrame(values, index=index, columns=feature_ids, copy=False)
+    cursor.close()
+    connection.close()
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--dsn', default='dbname=postgres',
+        help='libpq connection string of the benchmark database'
+    )
+    parser.add_argument(
+        '--objects', type=int, default=10000000,
+        help='number of mapobjects'
+    )
+    parser.add_argument(
+        '--features', type=int, default=100,
+        help='number of features stored per mapobject'
+    )
+    parser.add_argument(
+        '--select', type=int, default=100,
+        help='number of features that should be loaded'
+    )
+    args = parser.parse_args()
+
+    print(
+        'synthetic table with %d mapobjects and %d features'
+        % (args.objects, args.features)
+    )
+    create_table(args.dsn, args.objects, args.features)
+    feature_ids = range(1, min(args.select, args.features) + 1)
+
+    for name, func in [('hstore', load_hstore), ('real[]', load_array)]:
+        start = time.time()
+        df = func(args.dsn, feature_ids)
+        duration = time.time() - start
+        print(
+            '%-8s loaded %d x %d values in %.2f s (%.1f MB in memory)'
+            % (name, df.shape[0], df.shape[1], duration,
+               df.values.nbytes / 1024.0 ** 2)
+        )
+        del df
+
+    connection, cursor = connect(args.dsn)
+    cursor.execute('DROP SCHEMA %s CASCADE' % SCHEMA)
+    cursor.close()
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
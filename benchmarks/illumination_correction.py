@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+'''Benchmark for the correction of images for illumination artifacts in
+single precision on blocks of rows (see
+:meth:`tmlib.image.ChannelImage.correct`) in comparison to the correction of
+entire images in double precision.
+
+Creates synthetic 16-bit images with a vignetting artifact together with
+corresponding illumination statistics and reports the throughput of both
+implementations as well as the maximal absolute difference between the
+corrected pixel values.
+'''
+import time
+import argparse
+import numpy as np
+import cv2
+
+from tmlib.image import ChannelImage
+
+
+def correct_double_precision(img, mean, std):
+    img_type = img.dtype
+    img = img.astype(np.float64)
+    img[img == 0] = 10**-10
+    img = np.log10(img)
+    img[img == 0] = 0
+    img = (img - mean) / std
+    img = (img * np.mean(std)) + np.mean(mean)
+    img = 10 ** img
+    return img.astype(img_type)
+
+
+def create_statistics(height, width):
+    y, x = np.mgrid[0:height, 0:width]
+    r = np.sqrt(
+        (y - height / 2.0) ** 2 + (x - width / 2.0) ** 2
+    ) / np.sqrt((height / 2.0) ** 2 + (width / 2.0) ** 2)
+    mean = 2.5 - 0.3 * r ** 2
+    std = 0.2 - 0.05 * r ** 2
+    return (mean, std)
+
+
+def create_images(n_images, mean, std):
+    images = list()
+    for i in range(n_images):
+        img = np.random.normal(0, 1, mean.shape)
+        img = cv2.GaussianBlur(img, (0, 0), 8)
+        img = (img - img.mean()) / img.std() * std + mean
+        images.append(np.clip(10 ** img, 0, 2**16 - 1).astype(np.uint16))
+    return images
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--images', type=int, default=20,
+        help='number of images'
+    )
+    parser.add_argument(
+        '--height', type=int, default=2160,
+        help='number of pixels along the vertical axis of an image'
+    )
+    parser.add_argument(
+        '--width', type=int, default=2560,
+        help='number of pixels along the horizontal axis of an image'
+    )
+    parser.add_argument(
+        '--threads', type=int, default=4,
+        help='maximal number of threads'
+    )
+    args = parser.parse_args()
+
+    mean, std = create_statistics(args.height, args.width)
+    images = create_images(args.images, mean, std)
+    print(
+        '%d images of %d x %d pixels'
+        % (args.images, args.height, args.width)
+    )
+
+    start = time.time()
+    reference = [correct_double_precision(img, mean, std) for img in images]
+    reference_duration = time.time() - start
+    print(
+        'double precision:            %6.1f images/s'
+        % (args.images / reference_duration)
+    )
+
+    n_threads = 1
+    while n_threads <= args.threads:
+        start = time.time()
+        corrected = [
+            ChannelImage._correct_illumination(
+                img, mean, std, n_threads=n_threads
+            )
+            for img in images
+        ]
+        duration = time.time() - start
+        diff = max([
+            np.max(np.abs(c.astype(np.int32) - r))
+            for c, r in zip(corrected, reference)
+        ])
+        print(
+            'single precision, %d threads: %6.1f images/s '
+            '(speedup %.1fx, max. difference %d)'
+            % (n_threads, args.images / duration,
+               reference_duration / duration, diff)
+        )
+        n_threads *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+'''Benchmark for loading regions of channel images from HDF5 files, which
+are stored in chunks of the size of pyramid tiles (see
+:meth:`tmlib.models.file.ChannelImageFile.put` and
+:meth:`tmlib.models.file.ChannelImageFile.load`), in comparison to loading
+entire images and extracting the region in memory.
+
+Creates a synthetic 16-bit image, stores it once with automatically chosen
+and once with tile-sized chunks and reports the throughput for loading strips
+along the bottom margin of the image (as required by the "illuminati" step
+for tiles that overlap neighbouring images).
+'''
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+from tmlib.image import PyramidTile
+from tmlib.metadata import ChannelImageMetadata
+from tmlib.models.file import ChannelImageFile
+from tmlib.writers import DatasetWriter
+
+TILE_SIZE = PyramidTile.TILE_SIZE
+
+
+def create_metadata():
+    return ChannelImageMetadata(
+        channel_id=1, site_id=1, cycle_id=1, tpoint=0, zplane=0
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--height', type=int, default=2160,
+        help='number of pixels along the vertical axis of the image'
+    )
+    parser.add_argument(
+        '--width', type=int, default=2560,
+        help='number of pixels along the horizontal axis of the image'
+    )
+    parser.add_argument(
+        '--strip-height', type=int, default=100,
+        help='number of pixels along the vertical axis of a strip'
+    )
+    parser.add_argument(
+        '--reads', type=int, default=100,
+        help='number of reads'
+    )
+    args = parser.parse_args()
+
+    array = np.random.randint(
+        100, 4000, (args.height, args.width)
+    ).astype(np.uint16)
+    y = args.height - args.strip_height
+    regions = [
+        (y, args.strip_height, x, TILE_SIZE)
+        for x in np.random.randint(0, args.width - TILE_SIZE, args.reads)
+    ]
+    print(
+        'image of %d x %d pixels, strips of %d x %d pixels'
+        % (args.height, args.width, args.strip_height, TILE_SIZE)
+    )
+
+    location = tempfile.mkdtemp()
+    try:
+        auto_filename = os.path.join(location, 'auto.h5')
+        with DatasetWriter(auto_filename, truncate=True) as f:
+            f.write('array', array, compression=True)
+        tile_filename = os.path.join(location, 'tile.h5')
+        chunks = (min(TILE_SIZE, args.height), min(TILE_SIZE, args.width))
+        with DatasetWriter(tile_filename, truncate=True) as f:
+            f.write('array', array, compression=True, chunks=chunks)
+
+        for name, filename, region in [
+                ('entire image, automatic chunks', auto_filename, False),
+                ('region, automatic chunks', auto_filename, True),
+                ('entire image, tile chunks', tile_filename, False),
+                ('region, tile chunks', tile_filename, True)]:
+            start = time.time()
+            for r in regions:
+                if region:
+                    strip = ChannelImageFile.load(
+                        filename, create_metadata(), region=r
+                    )
+                else:
+                    image = ChannelImageFile.load(filename, create_metadata())
+                    strip = image.extract(*r)
+                assert np.all(
+                    strip.array == array[r[0]:r[0] + r[1], r[2]:r[2] + r[3]]
+                )
+            duration = time.time() - start
+            print(
+                '%-32s %8.1f reads/s' % (name + ':', args.reads / duration)
+            )
+    finally:
+        shutil.rmtree(location)
+
+
+if __name__ == '__main__':
+    main()
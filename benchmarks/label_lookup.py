@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+'''Benchmark for looking up label values of tool results
+(see :meth:`tmlib.models.result.ToolResult.get_labels`).
+
+Creates a synthetic "label_values" table in a scratch schema of a local
+PostgreSQL database and retrieves labels for a random subset of mapobjects,
+once via an ``IN (...)`` query per request (as done previously for each
+viewport request of the client) and once from sorted in-memory arrays, which
+are loaded from the database only for the first request and afterwards
+searched via :func:`numpy.searchsorted`.
+
+The database requires the "hstore" extension.
+'''
+import time
+import argparse
+import psycopg2
+import numpy as np
+from psycopg2.extras import NamedTupleCursor
+
+from tmlib.models.result import _lookup_labels
+
+SCHEMA = 'benchmark_label_values'
+
+
+def connect(dsn):
+    connection = psycopg2.connect(dsn)
+    connection.autocommit = True
+    cursor = connection.cursor(cursor_factory=NamedTupleCursor)
+    cursor.execute('SET search_path TO %s, public' % SCHEMA)
+    return connection, cursor
+
+
+def create_table(dsn, n_objects):
+    connection, cursor = connect(dsn)
+    cursor.execute('''
+        DROP SCHEMA IF EXISTS {schema} CASCADE;
+        CREATE SCHEMA {schema};
+        CREATE TABLE label_values (
+            partition_key integer NOT NULL,
+            mapobject_id bigint NOT NULL,
+            tpoint integer NOT NULL,
+            values hstore,
+            PRIMARY KEY (mapobject_id, partition_key, tpoint)
+        );
+    '''.format(schema=SCHEMA))
+    cursor.execute('''
+        INSERT INTO label_values
+        SELECT i / 1000, i, 0, hstore('1', (random() * 10)::int::text)
+        FROM generate_series(1, %(n)s) AS i;
+        CREATE INDEX ON label_values (mapobject_id);
+        ANALYZE;
+    ''', {'n': n_objects})
+    cursor.close()
+    connection.close()
+
+
+def query_labels(cursor, mapobject_ids):
+    cursor.execute('''
+        SELECT mapobject_id, values -> '1' AS value FROM label_values
+        WHERE mapobject_id IN %(mapobject_ids)s
+    ''', {'mapobject_ids': tuple(mapobject_ids)})
+    return dict(cursor.fetchall())
+
+
+def load_labels(cursor):
+    cursor.execute('''
+        SELECT mapobject_id, (values -> '1')::double precision AS value
+        FROM label_values
+    ''')
+    records = cursor.fetchall()
+    mapobject_ids = np.array([r.mapobject_id for r in records], dtype=np.int64)
+    values = np.array([r.value for r in records], dtype=np.int64)
+    index = np.argsort(mapobject_ids)
+    return (mapobject_ids[index], values[index])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--dsn', default='dbname=postgres',
+        help='libpq connection string of the benchmark database'
+    )
+    parser.add_argument(
+        '--objects', type=int, default=5000000,
+        help='number of mapobjects with a label'
+    )
+    parser.add_argument(
+        '--lookups', type=int, default=1000000,
+        help='number of mapobjects per request'
+    )
+    parser.add_argument(
+        '--requests', type=int, default=5,
+        help='number of requests'
+    )
+    args = parser.parse_args()
+
+    print('synthetic table with %d labels' % args.objects)
+    create_table(args.dsn, args.objects)
+    requests = [
+        np.random.randint(1, args.objects + 1, args.lookups)
+        for i in range(args.requests)
+    ]
+
+    connection, cursor = connect(args.dsn)
+    start = time.time()
+    for mapobject_ids in requests:
+        labels = query_labels(cursor, mapobject_ids.tolist())
+    duration = time.time() - start
+    print(
+        'IN query:        %d requests of %d objects in %.2f s'
+        % (args.requests, args.lookups, duration)
+    )
+
+    start = time.time()
+    known_ids, values = load_labels(cursor)
+    load_duration = time.time() - start
+    start = time.time()
+    for mapobject_ids in requests:
+        labels = _lookup_labels(mapobject_ids, known_ids, values)
+    duration = time.time() - start
+    print(
+        'sorted arrays:   %d requests of %d objects in %.2f s '
+        '(+ %.2f s for loading once, %.1f MB in memory)'
+        % (args.requests, args.lookups, duration, load_duration,
+           (known_ids.nbytes + values.nbytes) / 1024.0 ** 2)
+    )
+
+    cursor.execute('DROP SCHEMA %s CASCADE' % SCHEMA)
+    cursor.close()
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
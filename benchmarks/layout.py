@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+'''Benchmark for the calculation of site offsets and the mapping of images
+to tiles at the maximum zoom level (see
+:class:`tmlib.models.layout.ExperimentLayout` and
+:class:`tmlib.models.layout.ImageIndex`) in comparison to the calculation via
+the relationships of individual model instances (see
+:attr:`tmlib.models.site.Site.offset`).
+
+Creates an experiment with 1536 wells (four 384-well plates by default) in
+memory, where each well contains a grid of sites. Instances of models are
+transient and their relationships are set in memory, such that the measured
+durations of the *ORM* path don't include the round trips to the database,
+which are required for loading related instances and for querying image files
+and neighbouring images.
+
+In addition, the total number of image reads required for creating the tiles
+at the maximum zoom level is reported for batches of images ordered by site
+ID and for batches of images ordered along the Z-order curve (see
+:meth:`tmlib.models.layout.ExperimentLayout.sort_sites`).
+'''
+import time
+import argparse
+import itertools
+import collections
+import numpy as np
+
+from tmlib.models.experiment import Experiment
+from tmlib.models.plate import Plate
+from tmlib.models.well import Well
+from tmlib.models.site import Site
+from tmlib.models.layout import ExperimentLayout, ImageIndex
+
+TILE_SIZE = 256
+
+
+def create_experiment(n_plates, n_sites, height, width):
+    experiment = Experiment(
+        id=1, microscope_type='cellvoyager', plate_format=384,
+        plate_acquisition_mode='basic', location='/tmp'
+    )
+    sites = list()
+    for p in range(n_plates):
+        plate = Plate(name='plate%02d' % p, experiment_id=experiment.id)
+        plate.id = p + 1
+        plate.experiment = experiment
+        for w, (r, c) in enumerate(itertools.product(range(16), range(24))):
+            name = Well.map_coordinate_to_name((r, c))
+            well = Well(name=name, plate_id=plate.id)
+            well.id = p * 384 + w + 1
+            well.plate = plate
+            for y, x in itertools.product(range(n_sites), range(n_sites)):
+                site = Site(
+                    y=y, x=x, height=height, width=width, well_id=well.id
+                )
+                site.id = len(sites) + 1
+                site.well = well
+                sites.append(site)
+    return experiment, sites
+
+
+def calc_tile_indices(position, length, displacement):
+    start = int(np.floor(np.float(position) / TILE_SIZE))
+    end = int(np.ceil(np.float(position + length - displacement) / TILE_SIZE))
+    return range(start, end)
+
+
+def map_tiles_via_orm(experiment, sites):
+    start = time.time()
+    mapping = collections.defaultdict(list)
+    for site in sites:
+        y_offset, x_offset = site.offset
+        rows = calc_tile_indices(
+            y_offset, site.image_size[0],
+            experiment.vertical_site_displacement
+        )
+        cols = calc_tile_indices(
+            x_offset, site.image_size[1],
+            experiment.horizontal_site_displacement
+        )
+        for y, x in itertools.product(rows, cols):
+            # The ID of the image file would be queried here.
+            mapping[(y, x)].append(site.id)
+    return (mapping, time.time() - start)
+
+
+def map_tiles_via_layout(experiment, sites):
+    start = time.time()
+    plates = experiment.plates
+    wells = [w for p in plates for w in p.wells]
+    layout = ExperimentLayout(experiment, plates, wells, sites)
+    site_ids = layout.site_ids
+    index = ImageIndex(layout, site_ids, site_ids, TILE_SIZE)
+    mapping = index.to_dict()
+    return (layout, index, mapping, time.time() - start)
+
+
+def count_image_reads(index, image_file_ids, batch_size):
+    count = 0
+    for i in range(0, len(image_file_ids), batch_size):
+        batch = image_file_ids[i:i + batch_size]
+        neighbours = index.get_overlapping_neighbours(batch)
+        count += len(np.union1d(batch, neighbours[neighbours > 0]))
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--plates', type=int, default=4,
+        help='number of 384-well plates'
+    )
+    parser.add_argument(
+        '--sites', type=int, default=3,
+        help='number of sites along each axis of a well'
+    )
+    parser.add_argument(
+        '--height', type=int, default=2160,
+        help='number of pixels along the vertical axis of a site'
+    )
+    parser.add_argument(
+        '--width', type=int, default=2560,
+        help='number of pixels along the horizontal axis of a site'
+    )
+    parser.add_argument(
+        '--batch-size', type=int, default=100,
+        help='number of images per job'
+    )
+    args = parser.parse_args()
+
+    experiment, sites = create_experiment(
+        args.plates, args.sites, args.height, args.width
+    )
+    n = len(sites)
+    print('%d wells with %d sites' % (args.plates * 384, n))
+
+    orm_mapping, orm_duration = map_tiles_via_orm(experiment, sites)
+    layout, index, mapping, duration = map_tiles_via_layout(experiment, sites)
+    offsets = np.array([s.offset for s in sites])
+    assert np.all(offsets == layout.offsets)
+    assert mapping == dict(orm_mapping)
+
+    # Per site and image: one query for the image file, two queries counting
+    # neighbours and one query for neighbouring sites and their image files.
+    print(
+        'ORM:     offsets and tiles in %.2f s (+ at least %d queries)'
+        % (orm_duration, 1 + 4 * n)
+    )
+    print(
+        'layout:  offsets and tiles in %.2f s (+ 5 queries)' % duration
+    )
+
+    start = time.time()
+    for fid in index.image_file_ids:
+        index.get_neighbour(fid, 1, 0)
+        index.get_neighbour(fid, 0, 1)
+        rows, cols = index.get_tile_ranges(fid)
+        index.get_image_file_ids(rows[0], cols[0])
+    print(
+        'layout:  neighbours and tiles of %d images in %.2f s'
+        % (n, time.time() - start)
+    )
+
+    image_file_ids = index.image_file_ids
+    for name, ids in [
+            ('site ID', image_file_ids),
+            ('Z-order', image_file_ids[layout.sort_sites(layout.site_ids)])]:
+        print(
+            'ordered by %-8s %d image reads for batches of %d images'
+            % (name + ':', count_image_reads(index, ids, args.batch_size),
+               args.batch_size)
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+'''Benchmark for building the levels of an image pyramid above the base level
+either level by level, where the tiles of each level are JPEG encoded and
+decoded again for building the next level (as done by separate phases of
+the "illuminati" step), or fused for a block of base tiles, where only the
+base tiles are decoded and all other levels are downsampled in memory (see
+``--fuse-levels`` argument of the "illuminati" step).
+
+Creates a synthetic 8-bit image, which represents a block of base tiles, and
+reports the wall time and the peak signal-to-noise ratio (PSNR) of each level
+relative to a reference pyramid, which is built from the original (not JPEG
+compressed) image. Round trips to the database are not included in the
+measured durations.
+'''
+import time
+import argparse
+import numpy as np
+import cv2
+
+from tmlib.image import PyramidTile, Image
+
+TILE_SIZE = PyramidTile.TILE_SIZE
+
+
+def create_image(n_tiles):
+    size = n_tiles * TILE_SIZE
+    # Smooth background with bright, blurred "cells" and camera noise
+    image = np.random.normal(0, 1, (size, size))
+    image = cv2.GaussianBlur(image, (0, 0), 32)
+    image = (image - image.min()) / (image.max() - image.min()) * 40
+    centers = np.random.randint(0, size, (n_tiles ** 2 * 20, 2))
+    for y, x in centers:
+        cv2.circle(image, (int(x), int(y)), np.random.randint(5, 15), 200, -1)
+    image = cv2.GaussianBlur(image, (0, 0), 2)
+    image += np.random.normal(0, 3, image.shape)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def split(image):
+    tiles = dict()
+    for i in xrange(0, image.shape[0], TILE_SIZE):
+        for j in xrange(0, image.shape[1], TILE_SIZE):
+            tiles[(i / TILE_SIZE, j / TILE_SIZE)] = \
+                image[i:i + TILE_SIZE, j:j + TILE_SIZE]
+    return tiles
+
+
+def merge(tiles):
+    n_rows = max([y for y, x in tiles]) + 1
+    n_cols = max([x for y, x in tiles]) + 1
+    return np.vstack([
+        np.hstack([tiles[(y, x)] for x in range(n_cols)])
+        for y in range(n_rows)
+    ])
+
+
+def encode(tiles):
+    return {
+        k: PyramidTile(v).jpeg_encode().tostring() for k, v in tiles.items()
+    }
+
+
+def decode(tiles):
+    return {
+        k: PyramidTile.create_from_binary(v).array for k, v in tiles.items()
+    }
+
+
+def shrink(array, factor):
+    return Image(array).shrink(factor).array
+
+
+def build_level_by_level(base_tiles, n_levels):
+    levels = [base_tiles]
+    for level in range(n_levels):
+        tiles = levels[-1]
+        n_rows = max([y for y, x in tiles]) + 1
+        n_cols = max([x for y, x in tiles]) + 1
+        new_tiles = dict()
+        for y in xrange(0, n_rows, 2):
+            for x in xrange(0, n_cols, 2):
+                mosaic = merge({
+                    (r - y, c - x): PyramidTile.create_from_binary(
+                        tiles[(r, c)]
+                    ).array
+                    for r in range(y, min(y + 2, n_rows))
+                    for c in range(x, min(x + 2, n_cols))
+                })
+                new_tiles[(y / 2, x / 2)] = PyramidTile(
+                    shrink(mosaic, 2)
+                ).jpeg_encode().tostring()
+        levels.append(new_tiles)
+    return levels[1:]
+
+
+def build_fused(base_tiles, n_levels):
+    mosaic = merge(decode(base_tiles))
+    levels = list()
+    for level in range(n_levels):
+        mosaic = shrink(mosaic, 2)
+        levels.append(encode(split(mosaic)))
+    return levels
+
+
+def calculate_psnr(array, reference):
+    mse = np.mean((array.astype(np.float64) - reference) ** 2)
+    if mse == 0:
+        return np.inf
+    return 10 * np.log10(255.0 ** 2 / mse)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--tiles', type=int, default=32,
+        help='number of base tiles along each axis of the block'
+    )
+    args = parser.parse_args()
+
+    n_levels = int(np.log2(args.tiles))
+    image = create_image(args.tiles)
+    base_tiles = encode(split(image))
+    reference = [image]
+    for level in range(n_levels):
+        reference.append(shrink(reference[-1], 2))
+    print(
+        '%d x %d base tiles, %d levels above the base level'
+        % (args.tiles, args.tiles, n_levels)
+    )
+
+    for name, func in [
+            ('level by level', build_level_by_level),
+            ('fused', build_fused)]:
+        start = time.time()
+        levels = func(base_tiles, n_levels)
+        duration = time.time() - start
+        psnr = [
+            calculate_psnr(merge(decode(tiles)), reference[i + 1])
+            for i, tiles in enumerate(levels)
+        ]
+        print(
+            '%-16s %6.2f s, PSNR per level (dB): %s'
+            % (name, duration, ', '.join(['%.1f' % v for v in psnr]))
+        )
+
+
+if __name__ == '__main__':
+    main()
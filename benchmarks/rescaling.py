@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+'''Benchmark for clipping and rescaling 16-bit images to 8-bit with a cached
+lookup table in a single pass (see :meth:`tmlib.image.ChannelImage.clip`
+with argument ``scale``) in comparison to clipping the image and mapping it
+through a newly created lookup table afterwards (as done previously by
+:meth:`tmlib.image.ChannelImage.clip` and
+:meth:`tmlib.image.ChannelImage.scale`).
+
+Creates synthetic 16-bit images, which are all rescaled with the same range
+(as done for the images of a channel layer by the "illuminati" step), and
+reports the time per image. The rescaled images are checked for equality.
+'''
+import time
+import argparse
+import numpy as np
+
+from tmlib.image import ChannelImage
+from tmlib.metadata import ChannelImageMetadata
+
+
+def create_images(n_images, size):
+    return [
+        np.random.gamma(2, 300, (size, size)).clip(0, 2**16 - 1).
+        astype(np.uint16)
+        for i in range(n_images)
+    ]
+
+
+def rescale_via_concatenated_lut(array, lower, upper):
+    array = np.clip(array, lower, upper)
+    lut = np.concatenate([
+        np.zeros(lower, dtype=np.uint16),
+        np.linspace(0, 255, upper - lower).astype(np.uint16),
+        np.ones(2**16 - upper, dtype=np.uint16) * 255
+    ])
+    return lut[array].astype(np.uint8)
+
+
+def rescale_via_cached_lut(array, lower, upper, out=None):
+    metadata = ChannelImageMetadata(
+        channel_id=1, site_id=1, cycle_id=1, tpoint=0, zplane=0
+    )
+    image = ChannelImage(array, metadata)
+    if out is not None:
+        return image.scale(lower, upper, inplace=False, out=out).array
+    return image.clip(lower, upper, inplace=False, scale=True).array
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--images', type=int, default=20,
+        help='number of images'
+    )
+    parser.add_argument(
+        '--size', type=int, default=2048,
+        help='number of pixels along each axis of an image'
+    )
+    args = parser.parse_args()
+
+    images = create_images(args.images, args.size)
+    lower, upper = 100, int(np.percentile(images[0], 99.9))
+    print(
+        '%d images of %d x %d pixels, range [%d, %d]'
+        % (args.images, args.size, args.size, lower, upper)
+    )
+
+    reference = [
+        rescale_via_concatenated_lut(a, lower, upper) for a in images
+    ]
+    buf = np.empty((args.size, args.size), dtype=np.uint8)
+    for name, func in [
+            ('clip + new LUT', rescale_via_concatenated_lut),
+            ('cached LUT', rescale_via_cached_lut),
+            ('cached LUT, buffer',
+             lambda a, l, u: rescale_via_cached_lut(a, l, u, buf))]:
+        duration = 0
+        for array, expected in zip(images, reference):
+            start = time.time()
+            result = func(array, lower, upper)
+            duration += time.time() - start
+            assert np.array_equal(result, expected)
+        print(
+            '%-20s %6.1f ms per image' % (name, duration / args.images * 1000)
+        )
+
+
+if __name__ == '__main__':
+    main()
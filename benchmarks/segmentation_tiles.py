@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+'''Benchmark for the retrieval of mapobject outlines within tiles of a
+segmentation layer (see
+:meth:`tmlib.models.mapobject.SegmentationLayer.get_segmentations`).
+
+Creates synthetic "mapobject_segmentations" and
+"simplified_mapobject_segmentations" tables in a scratch schema of a local
+PostGIS database, where mapobjects are circular polygons arranged in a
+regular grid, and measures the latency of tile requests at each zoom level at
+which polygons are visualized, once simplifying polygons upon each request,
+once using precomputed polygons (see
+:meth:`tmlib.models.mapobject.SimplifiedMapobjectSegmentation.create_per_partition`)
+and once for repeated requests that are answered from the in-memory cache.
+
+The database requires the "postgis" extension.
+'''
+import time
+import argparse
+import psycopg2
+import numpy as np
+from psycopg2.extras import NamedTupleCursor
+
+from tmlib.models.mapobject import (
+    SegmentationLayer, SimplifiedMapobjectSegmentation
+)
+from tmlib.models.utils import MemoryCache
+
+SCHEMA = 'benchmark_segmentation_tiles'
+
+#: int: distance between centroids of neighboring mapobjects in pixels
+SPACING = 30
+
+
+def connect(dsn):
+    connection = psycopg2.connect(dsn)
+    connection.autocommit = True
+    cursor = connection.cursor(cursor_factory=NamedTupleCursor)
+    cursor.execute('SET search_path TO %s, public' % SCHEMA)
+    return connection, cursor
+
+
+def create_tables(dsn, n_rows, n_partitions, min_zoom, max_zoom):
+    connection, cursor = connect(dsn)
+    cursor.execute('''
+        DROP SCHEMA IF EXISTS {schema} CASCADE;
+        CREATE SCHEMA {schema};
+        CREATE TABLE mapobject_segmentations (
+            partition_key integer NOT NULL,
+            mapobject_id bigint NOT NULL,
+            segmentation_layer_id integer NOT NULL,
+            geom_polygon geometry(POLYGON),
+            geom_centroid geometry(POINT) NOT NULL,
+            PRIMARY KEY (mapobject_id, partition_key, segmentation_layer_id)
+        );
+        CREATE TABLE simplified_mapobject_segmentations (
+            partition_key integer NOT NULL,
+            mapobject_id bigint NOT NULL,
+            segmentation_layer_id integer NOT NULL,
+            zoom integer NOT NULL,
+            geom_polygon geometry(POLYGON) NOT NULL,
+            PRIMARY KEY (
+                mapobject_id, partition_key, segmentation_layer_id, zoom
+            )
+        );
+    '''.format(schema=SCHEMA))
+    # Objects are distributed row-wise over partitions. The y-axis is
+    # inverted on the map.
+    cursor.execute('''
+        INSERT INTO mapobject_segmentations
+        SELECT
+            r * %(n_partitions)s / %(n_rows)s, r * %(n_rows)s + c, 1,
+            ST_Buffer(p, %(radius)s, 8), p
+        FROM generate_series(0, %(n_rows)s - 1) AS r,
+        generate_series(0, %(n_rows)s - 1) AS c,
+        LATERAL ST_MakePoint(
+            c * %(spacing)s + %(spacing)s / 2, -r * %(spacing)s - %(spacing)s / 2
+        ) AS p;
+        CREATE INDEX ON mapobject_segmentations USING gist (geom_polygon);
+        CREATE INDEX ON mapobject_segmentations USING gist (geom_centroid);
+    ''', {
+        'n_rows': n_rows, 'n_partitions': n_partitions,
+        'spacing': SPACING, 'radius': SPACING / 3
+    })
+    start = time.time()
+    for partition_key in range(n_partitions):
+        SimplifiedMapobjectSegmentation.create_per_partition(
+            cursor, partition_key, 1, min_zoom, max_zoom
+        )
+    duration = time.time() - start
+    cursor.execute('''
+        CREATE INDEX ON simplified_mapobject_segmentations
+        USING gist (geom_polygon);
+        ANALYZE;
+    ''')
+    cursor.close()
+    connection.close()
+    return duration
+
+
+def build_tile(x, y, z, max_zoom):
+    minx, miny, maxx, maxy = SegmentationLayer.get_tile_bounding_box(
+        x, y, z, max_zoom
+    )
+    return (
+        'POLYGON(({maxx} {maxy}, {minx} {maxy}, {minx} {miny}, '
+        '{maxx} {miny}, {maxx} {maxy}))'
+    ).format(minx=minx, maxx=maxx, miny=miny, maxy=maxy)
+
+
+def query_simplified_on_the_fly(cursor, x, y, z, max_zoom):
+    cursor.execute('''
+        SELECT
+            mapobject_id,
+            ST_AsGeoJSON(ST_SimplifyPreserveTopology(geom_polygon, %(tol)s))
+        FROM mapobject_segmentations
+        WHERE segmentation_layer_id = 1
+        AND ST_Intersects(geom_polygon, ST_GeomFromText(%(tile)s))
+    ''', {
+        'tol': SegmentationLayer.get_simplification_tolerance(z, max_zoom),
+        'tile': build_tile(x, y, z, max_zoom)
+    })
+    return cursor.fetchall()
+
+
+def query_precomputed(cursor, x, y, z, max_zoom):
+    cursor.execute('''
+        SELECT mapobject_id, ST_AsGeoJSON(geom_polygon)
+        FROM simplified_mapobject_segmentations
+        WHERE segmentation_layer_id = 1 AND zoom = %(z)s
+        AND ST_Intersects(geom_polygon, ST_GeomFromText(%(tile)s))
+    ''', {
+        'z': z,
+        'tile': build_tile(x, y, z, max_zoom)
+    })
+    return cursor.fetchall()
+
+
+def measure(func, cursor, tiles, max_zoom):
+    latencies = list()
+    for x, y, z in tiles:
+        start = time.time()
+        func(cursor, x, y, z, max_zoom)
+        latencies.append(time.time() - start)
+    return np.array(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--dsn', default='dbname=postgres',
+        help='libpq connection string of the benchmark database'
+    )
+    parser.add_argument(
+        '--objects', type=int, default=1000000,
+        help='number of polygons'
+    )
+    parser.add_argument(
+        '--partitions', type=int, default=100,
+        help='number of partitions (sites)'
+    )
+    parser.add_argument(
+        '--tiles', type=int, default=20,
+        help='number of requested tiles per zoom level'
+    )
+    args = parser.parse_args()
+
+    n_rows = int(np.sqrt(args.objects))
+    extent = n_rows * SPACING
+    max_zoom = int(np.ceil(np.log2(extent / 256.0)))
+    # Same threshold as for segmented objects represented as polygons
+    # (see SegmentationLayer.calculate_zoom_thresholds())
+    min_zoom = max(0, max_zoom - 4)
+    print('synthetic table with %d polygons' % n_rows ** 2)
+    duration = create_tables(
+        args.dsn, n_rows, args.partitions, min_zoom, max_zoom
+    )
+    print(
+        'precomputed polygons for zoom levels %d-%d in %.2f s'
+        % (min_zoom, max_zoom, duration)
+    )
+
+    connection, cursor = connect(args.dsn)
+    for z in range(min_zoom, max_zoom + 1):
+        n_tiles = int(np.ceil(extent / (256.0 * 2 ** (max_zoom - z))))
+        tiles = [
+            (np.random.randint(n_tiles), np.random.randint(n_tiles), z)
+            for i in range(args.tiles)
+        ]
+        x, y, z = tiles[0]
+        outlines = query_precomputed(cursor, x, y, z, max_zoom)
+        print('zoom level %d (about %d objects per tile)' % (z, len(outlines)))
+        for name, func in [
+                ('simplify upon request', query_simplified_on_the_fly),
+                ('precomputed', query_precomputed)]:
+            latencies = measure(func, cursor, tiles, max_zoom)
+            print(
+                '    %-24s median %7.1f ms, max %7.1f ms'
+                % (name, np.median(latencies), np.max(latencies))
+            )
+
+        cache = MemoryCache('segmentation_cache_size')
+        latencies = list()
+        for x, y, z in tiles * 2:
+            start = time.time()
+            outlines = cache.get((x, y, z))
+            if outlines is None:
+                outlines = query_precomputed(cursor, x, y, z, max_zoom)
+                size = sum([len(o[1]) + 128 for o in outlines])
+                cache.put((x, y, z), outlines, size)
+            latencies.append(time.time() - start)
+        latencies = np.array(latencies[len(tiles):]) * 1000
+        print(
+            '    %-24s median %7.1f ms, max %7.1f ms'
+            % ('cached', np.median(latencies), np.max(latencies))
+        )
+
+    cursor.execute('DROP SCHEMA %s CASCADE' % SCHEMA)
+    cursor.close()
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
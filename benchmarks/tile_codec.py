@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+'''Benchmark for encoding and decoding pyramid tiles on a pool of threads
+(see :func:`tmlib.models.tile.encode_tiles` and
+:func:`tmlib.models.tile.decode_tiles`).
+
+Creates synthetic 8-bit tiles and reports the throughput for encoding them
+as *JPEG* and decoding them again with an increasing number of threads.
+'''
+import time
+import argparse
+import numpy as np
+import cv2
+
+from tmlib.image import PyramidTile
+from tmlib.models.tile import encode_tiles, decode_tiles
+
+TILE_SIZE = PyramidTile.TILE_SIZE
+
+
+def create_tiles(n_tiles):
+    # Smooth background with bright, blurred "cells" and camera noise
+    tiles = list()
+    for i in range(n_tiles):
+        pixels = np.random.normal(0, 1, (TILE_SIZE, TILE_SIZE))
+        pixels = cv2.GaussianBlur(pixels, (0, 0), 8)
+        pixels = (pixels - pixels.min()) / (pixels.max() - pixels.min()) * 40
+        for y, x in np.random.randint(0, TILE_SIZE, (20, 2)):
+            cv2.circle(pixels, (int(x), int(y)), 10, 200, -1)
+        pixels += np.random.normal(0, 3, pixels.shape)
+        tiles.append(PyramidTile(np.clip(pixels, 0, 255).astype(np.uint8)))
+    return tiles
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--tiles', type=int, default=2000,
+        help='number of tiles'
+    )
+    parser.add_argument(
+        '--threads', type=int, default=8,
+        help='maximal number of threads'
+    )
+    args = parser.parse_args()
+
+    tiles = create_tiles(args.tiles)
+    print('%d tiles of %d x %d pixels' % (args.tiles, TILE_SIZE, TILE_SIZE))
+
+    n_threads = 1
+    while n_threads <= args.threads:
+        start = time.time()
+        buffers = encode_tiles(tiles, n_threads)
+        encode_duration = time.time() - start
+        start = time.time()
+        decode_tiles(buffers, n_threads=n_threads)
+        decode_duration = time.time() - start
+        print(
+            '%2d threads: encode %8.1f tiles/s, decode %8.1f tiles/s'
+            % (n_threads, args.tiles / encode_duration,
+               args.tiles / decode_duration)
+        )
+        n_threads *= 2
+
+
+if __name__ == '__main__':
+    main()
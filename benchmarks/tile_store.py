@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+'''Benchmark for the storage of pyramid tiles in memory-mapped files
+(see :class:`tmlib.models.tile.FileTileStore`) in comparison to BYTEA values
+in the database (see :class:`tmlib.models.tile.DatabaseTileStore`).
+
+Creates synthetic *JPEG* encoded tiles of a single zoom level and reports the
+throughput for writing tiles in batches (as done by jobs of the "illuminati"
+step), for reading individual tiles in random order (as done by the viewer)
+and for reading blocks of tiles (as done for building lower zoom levels).
+Tiles are stored in a "channel_layer_tiles" table in a scratch schema of a
+local PostgreSQL database, which is written and read with the same queries as
+:class:`ChannelLayerTile <tmlib.models.tile.ChannelLayerTile>`, and in a
+temporary directory, respectively. Decoding of pixels is not included in the
+measured durations.
+'''
+import time
+import shutil
+import argparse
+import tempfile
+import itertools
+import psycopg2
+import numpy as np
+import cv2
+
+from tmlib.image import PyramidTile
+from tmlib.models.tile import FileTileStore
+
+SCHEMA = 'benchmark_tile_store'
+
+TILE_SIZE = PyramidTile.TILE_SIZE
+
+
+def connect(dsn):
+    connection = psycopg2.connect(dsn)
+    connection.autocommit = True
+    cursor = connection.cursor()
+    cursor.execute('SET search_path TO %s, public' % SCHEMA)
+    return connection, cursor
+
+
+def create_tiles(n_tiles):
+    # Smooth background with camera noise, which compresses similarly to
+    # tiles of microscope images.
+    tiles = dict()
+    for y, x in itertools.product(range(n_tiles), range(n_tiles)):
+        pixels = np.random.normal(0, 1, (TILE_SIZE, TILE_SIZE))
+        pixels = cv2.GaussianBlur(pixels, (0, 0), 8)
+        pixels = (pixels - pixels.min()) / (pixels.max() - pixels.min()) * 200
+        pixels += np.random.normal(0, 3, pixels.shape)
+        pixels = np.clip(pixels, 0, 255).astype(np.uint8)
+        tiles[(y, x)] = PyramidTile(pixels).jpeg_encode()
+    return tiles
+
+
+def create_blocks(n_tiles, block_size):
+    blocks = list()
+    for y in range(0, n_tiles, block_size):
+        for x in range(0, n_tiles, block_size):
+            blocks.append(list(itertools.product(
+                range(y, min(y + block_size, n_tiles)),
+                range(x, min(x + block_size, n_tiles))
+            )))
+    return blocks
+
+
+def write_database(dsn, tiles, batch_size):
+    connection, cursor = connect(dsn)
+    cursor.execute('''
+        DROP SCHEMA IF EXISTS {schema} CASCADE;
+        CREATE SCHEMA {schema};
+        CREATE TABLE channel_layer_tiles (
+            y integer NOT NULL,
+            channel_layer_id integer NOT NULL,
+            z integer NOT NULL,
+            x integer NOT NULL,
+            pixels bytea,
+            CONSTRAINT channel_layer_tiles_pkey
+                PRIMARY KEY (y, channel_layer_id, z, x)
+        );
+    '''.format(schema=SCHEMA))
+    keys = tiles.keys()
+    start = time.time()
+    for i in range(0, len(keys), batch_size):
+        for y, x in keys[i:i + batch_size]:
+            cursor.execute('''
+                INSERT INTO channel_layer_tiles AS t (
+                    channel_layer_id, z, y, x, pixels
+                )
+                VALUES (1, 0, %(y)s, %(x)s, %(pixels)s)
+                ON CONFLICT ON CONSTRAINT channel_layer_tiles_pkey
+                DO UPDATE SET pixels = %(pixels)s
+            ''', {
+                'y': y, 'x': x,
+                'pixels': psycopg2.Binary(tiles[(y, x)].tostring())
+            })
+    duration = time.time() - start
+    cursor.execute('ANALYZE')
+    cursor.close()
+    connection.close()
+    return duration
+
+
+def read_database(dsn, coordinates, blocks):
+    connection, cursor = connect(dsn)
+    start = time.time()
+    for y, x in coordinates:
+        cursor.execute('''
+            SELECT pixels FROM channel_layer_tiles
+            WHERE channel_layer_id = 1 AND z = 0 AND y = %(y)s AND x = %(x)s
+        ''', {'y': y, 'x': x})
+        np.frombuffer(cursor.fetchone()[0], np.uint8)
+    single_duration = time.time() - start
+    start = time.time()
+    for block in blocks:
+        cursor.execute('''
+            SELECT y, x, pixels FROM channel_layer_tiles
+            WHERE channel_layer_id = 1 AND z = 0 AND (y, x) IN %(coordinates)s
+        ''', {'coordinates': tuple(block)})
+        for y, x, pixels in cursor.fetchall():
+            np.frombuffer(pixels, np.uint8)
+    block_duration = time.time() - start
+    cursor.execute('DROP SCHEMA %s CASCADE' % SCHEMA)
+    cursor.close()
+    connection.close()
+    return (single_duration, block_duration)
+
+
+def write_files(location, n_tiles, tiles, batch_size):
+    store = FileTileStore(1, location, [(n_tiles, n_tiles)])
+    keys = tiles.keys()
+    start = time.time()
+    for i in range(0, len(keys), batch_size):
+        batch = {k: tiles[k] for k in keys[i:i + batch_size]}
+        store.put_encoded_tiles(0, batch)
+    return time.time() - start
+
+
+def read_files(location, n_tiles, coordinates, blocks):
+    store = FileTileStore(1, location, [(n_tiles, n_tiles)])
+    start = time.time()
+    for y, x in coordinates:
+        store.get_encoded_tile(0, y, x)
+    single_duration = time.time() - start
+    start = time.time()
+    for block in blocks:
+        store.get_encoded_tiles(0, block)
+    block_duration = time.time() - start
+    return (single_duration, block_duration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--dsn', default='dbname=postgres',
+        help='libpq connection string of the benchmark database'
+    )
+    parser.add_argument(
+        '--tiles', type=int, default=64,
+        help='number of tiles along each axis of the zoom level'
+    )
+    parser.add_argument(
+        '--batch-size', type=int, default=100,
+        help='number of tiles that are written at once'
+    )
+    parser.add_argument(
+        '--block-size', type=int, default=8,
+        help='number of tiles along each axis of a block that is read at once'
+    )
+    args = parser.parse_args()
+
+    tiles = create_tiles(args.tiles)
+    n = len(tiles)
+    size = sum([t.nbytes for t in tiles.values()]) / 1024.0 ** 2
+    coordinates = tiles.keys()
+    np.random.shuffle(coordinates)
+    blocks = create_blocks(args.tiles, args.block_size)
+    print('%d tiles (%.1f MB encoded)' % (n, size))
+
+    location = tempfile.mkdtemp()
+    try:
+        results = [
+            ('BYTEA',
+             write_database(args.dsn, tiles, args.batch_size),
+             read_database(args.dsn, coordinates, blocks)),
+            ('file',
+             write_files(location, args.tiles, tiles, args.batch_size),
+             read_files(location, args.tiles, coordinates, blocks))
+        ]
+    finally:
+        shutil.rmtree(location)
+
+    for name, write_duration, (single_duration, block_duration) in results:
+        print(
+            '%-6s write %8.1f tiles/s (%6.1f MB/s), '
+            'read single %8.1f tiles/s, read %dx%d blocks %8.1f tiles/s'
+            % (name, n / write_duration, size / write_duration,
+               n / single_duration, args.block_size, args.block_size,
+               n / block_duration)
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+'''Benchmark for the encoding of mapobject outlines as Mapbox Vector Tile in
+comparison to GeoJSON (see
+:meth:`tmlib.models.mapobject.SegmentationLayer.get_vector_tile` and
+:meth:`tmlib.models.mapobject.SegmentationLayer.get_segmentations`).
+
+Creates synthetic tiles of polygons (or centroids) with integer pixel
+coordinates arranged in a regular grid and compares the size of the encoded
+tile (uncompressed and compressed with gzip, as commonly done by the web
+server) and the time required for encoding. For GeoJSON, the time includes
+only the assembly of the feature collection from per-object GeoJSON strings
+(encoding of geometries happens in the database), whereas for vector tiles
+it includes the quantization and encoding of geometries in Python.
+'''
+import gzip
+import json
+import time
+import argparse
+import numpy as np
+from cStringIO import StringIO
+from shapely.geometry import Point, mapping
+from shapely.affinity import affine_transform
+
+from tmlib.models.mvt import encode_vector_tile, EXTENT
+
+
+def create_features(n_objects, tile_size, as_polygons):
+    n_rows = int(np.ceil(np.sqrt(n_objects)))
+    spacing = float(tile_size) / n_rows
+    features = list()
+    for i in range(n_objects):
+        r, c = divmod(i, n_rows)
+        centroid = Point(c * spacing + spacing / 2, -r * spacing - spacing / 2)
+        if as_polygons:
+            # Contours of segmented objects have integer pixel coordinates.
+            polygon = centroid.buffer(spacing / 3, 8)
+            coords = np.round(np.array(polygon.exterior.coords))
+            geometry = type(polygon)(coords)
+        else:
+            geometry = centroid
+        features.append((i + 1, geometry))
+    return features
+
+
+def encode_geojson(features):
+    # Outlines are returned by the database as GeoJSON strings.
+    outlines = [(i, json.dumps(mapping(g))) for i, g in features]
+    start = time.time()
+    payload = '{"type": "FeatureCollection", "features": [%s]}' % ','.join([
+        '{"type": "Feature", "id": %d, "geometry": %s, "properties": {}}'
+        % (i, geometry)
+        for i, geometry in outlines
+    ])
+    return (payload, time.time() - start)
+
+
+def encode_mvt(features, tile_size):
+    factor = float(EXTENT) / tile_size
+    start = time.time()
+    # Coordinates are transformed by the database (see ST_TransScale).
+    transformed = [
+        (i, affine_transform(g, [factor, 0, 0, -factor, 0, 0]))
+        for i, g in features
+    ]
+    payload = encode_vector_tile('objects', transformed)
+    return (payload, time.time() - start)
+
+
+def compress(payload):
+    f = StringIO()
+    with gzip.GzipFile(fileobj=f, mode='wb') as g:
+        g.write(payload)
+    return f.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--objects', type=int, default=10000,
+        help='number of objects per tile'
+    )
+    parser.add_argument(
+        '--tile-size', type=int, default=4096,
+        help='size of the tile in pixels at the highest resolution level'
+    )
+    args = parser.parse_args()
+
+    for as_polygons in [True, False]:
+        features = create_features(args.objects, args.tile_size, as_polygons)
+        print(
+            '%d %s per tile' %
+            (args.objects, 'polygons' if as_polygons else 'centroids')
+        )
+        geojson, geojson_duration = encode_geojson(features)
+        tile, mvt_duration = encode_mvt(features, args.tile_size)
+        for name, payload, duration in [
+                ('GeoJSON', geojson, geojson_duration),
+                ('MVT', tile, mvt_duration)]:
+            print(
+                '    %-8s %8.1f kB (%8.1f kB compressed), encoded in %.3f s'
+                % (name, len(payload) / 1024.0,
+                   len(compress(payload)) / 1024.0, duration)
+            )
+
+
+if __name__ == '__main__':
+    main()
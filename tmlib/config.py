@@ -235,6 +235,12 @@ class LibraryConfig(TmapsConfig):
         self.modules_home = '~/jtlibrary/modules'
         self.formats_home = '~/tmformats'
         self.storage_home = '/storage/filesystem'
+        self.columnar_feature_values = False
+        self.feature_cache_location = '/storage/cache/features'
+        self.feature_cache_size = 0
+        self.label_cache_size = 256
+        self.segmentation_cache_size = 256
+        self.tile_storage = 'database'
         self._resource = None
         self.read()
 
@@ -294,6 +300,145 @@ class LibraryConfig(TmapsConfig):
             )
         self._config.set(self._section, 'storage_home', str(value))
 
+    @property
+    def columnar_feature_values(self):
+        '''bool: whether feature values should additionally be stored in
+        columnar format, i.e. as arrays of single-precision floating point
+        numbers (default: ``False``)
+        '''
+        return self._config.getboolean(
+            self._section, 'columnar_feature_values'
+        )
+
+    @columnar_feature_values.setter
+    def columnar_feature_values(self, value):
+        if not isinstance(value, bool):
+            raise TypeError(
+                'Configuration parameter "columnar_feature_values" must have '
+                'type bool.'
+            )
+        self._config.set(self._section, 'columnar_feature_values', str(value))
+
+    @property
+    def feature_cache_location(self):
+        '''str: absolute path to the directory where data analysis tools cache
+        feature values (default: ``"/storage/cache/features"``)
+        '''
+        return os.path.expandvars(os.path.expanduser(
+            self._config.get(self._section, 'feature_cache_location')
+        ))
+
+    @feature_cache_location.setter
+    def feature_cache_location(self, value):
+        if not isinstance(value, basestring):
+            raise TypeError(
+                'Configuration parameter "feature_cache_location" must have '
+                'type str.'
+            )
+        self._config.set(self._section, 'feature_cache_location', str(value))
+
+    @property
+    def feature_cache_size(self):
+        '''int: maximal size of the feature value cache in gigabytes;
+        ``0`` disables the cache (default: ``0``)
+        '''
+        return self._config.getint(self._section, 'feature_cache_size')
+
+    @feature_cache_size.setter
+    def feature_cache_size(self, value):
+        if not isinstance(value, int):
+            raise TypeError(
+                'Configuration parameter "feature_cache_size" must have '
+                'type int.'
+            )
+        if value < 0:
+            raise ValueError(
+                'Configuration parameter "feature_cache_size" must not be '
+                'negative.'
+            )
+        self._config.set(self._section, 'feature_cache_size', str(value))
+
+    @property
+    def label_cache_size(self):
+        '''int: maximal size of the in-memory cache of label values of tool
+        results per process in megabytes; ``0`` disables the cache
+        (default: ``256``)
+        '''
+        return self._config.getint(self._section, 'label_cache_size')
+
+    @label_cache_size.setter
+    def label_cache_size(self, value):
+        if not isinstance(value, int):
+            raise TypeError(
+                'Configuration parameter "label_cache_size" must have '
+                'type int.'
+            )
+        if value < 0:
+            raise ValueError(
+                'Configuration parameter "label_cache_size" must not be '
+                'negative.'
+            )
+        self._config.set(self._section, 'label_cache_size', str(value))
+
+    @property
+    def segmentation_cache_size(self):
+        '''int: maximal size of the in-memory cache of mapobject
+        segmentations of layer tiles per process in megabytes; ``0`` disables
+        the cache (default: ``256``)
+        '''
+        return self._config.getint(self._section, 'segmentation_cache_size')
+
+    @segmentation_cache_size.setter
+    def segmentation_cache_size(self, value):
+        if not isinstance(value, int):
+            raise TypeError(
+                'Configuration parameter "segmentation_cache_size" must have '
+                'type int.'
+            )
+        if value < 0:
+            raise ValueError(
+                'Configuration parameter "segmentation_cache_size" must not '
+                'be negative.'
+            )
+        self._config.set(self._section, 'segmentation_cache_size', str(value))
+
+    @property
+    def tile_storage(self):
+        '''str: backend for storing pixels of pyramid tiles; either
+        ``"database"``, where tiles are stored as BYTEA values in table
+        "channel_layer_tiles", or ``"filesystem"``, where tiles are stored in
+        memory-mapped files in the location of each channel layer
+        (default: ``"database"``)
+
+        Warning
+        -------
+        Storage in the filesystem relies on file locks and the coherence of
+        memory maps between processes and thus only works when all jobs of
+        the "illuminati" step run on a single node. Tiles stored in the
+        filesystem can only be read via
+        :meth:`ChannelLayer.get_encoded_tile <tmlib.models.channel.ChannelLayer.get_encoded_tile>`.
+
+        See also
+        --------
+        :class:`tmlib.models.tile.DatabaseTileStore`
+        :class:`tmlib.models.tile.FileTileStore`
+        '''
+        return self._config.get(self._section, 'tile_storage')
+
+    @tile_storage.setter
+    def tile_storage(self, value):
+        if not isinstance(value, basestring):
+            raise TypeError(
+                'Configuration parameter "tile_storage" must have type str.'
+            )
+        options = {'database', 'filesystem'}
+        if value not in options:
+            raise ValueError(
+                'Configuration parameter "tile_storage" must be one of the '
+                'following: "%s"' % '", "'.join(sorted(options))
+            )
+        self._config.set(self._section, 'tile_storage', str(value))
+
     @property
     def formats_home(self):
         '''str: absolute path to the root directory of local copy of
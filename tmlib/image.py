@@ -14,6 +14,8 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import os
+import collections
+from multiprocessing.pool import ThreadPool
 import numpy as np
 import scipy.ndimage as ndi
 import cv2
@@ -31,6 +33,20 @@ from tmlib.metadata import ImageMetadata, PyramidTileMetadata
 
 logger = logging.getLogger(__name__)
 
+#: int: maximal number of cached lookup tables for mapping 16-bit to 8-bit
+#: pixel values
+MAX_UINT8_LUTS = 64
+
+# Lookup tables hashable by lower and upper bound of the mapped range
+_uint8_luts = collections.OrderedDict()
+
+#: int: number of pixels per block of rows in which images are corrected for
+#: illumination artifacts
+ILLUMCORR_BLOCK_SIZE = 2**16
+
+# Pools of threads for illumination correction hashable by size
+_thread_pools = dict()
+
 
 class Image(object):
 
@@ -491,8 +507,45 @@ class ChannelImage(Image):
         self._array = value
 
     @staticmethod
-    def _map_to_uint8(img, lower_bound=None, upper_bound=None):
+    def _get_uint8_lut(lower_bound, upper_bound):
+        '''Gets the lookup table for mapping 16-bit pixel values to 8-bit.
+        Lookup tables are cached per range, since all images of a channel
+        are commonly mapped with the same range.
+
+        Parameters
+        ----------
+        lower_bound: int
+            lower bound of the range that should be mapped to ``[0, 255]``
+        upper_bound: int
+            upper bound of the range that should be mapped to ``[0, 255]``
+
+        Returns
+        -------
+        numpy.ndarray[numpy.uint8]
+            lookup table with ``65536`` entries
+        '''
+        key = (int(lower_bound), int(upper_bound))
+        lut = _uint8_luts.pop(key, None)
+        if lut is None:
+            logger.debug('create lookup table for range [%d, %d]', *key)
+            lut = np.empty(2**16, dtype=np.uint8)
+            lut[:key[0]] = 0
+            # Truncate (rather than round) values in the range, as done
+            # by the conversion of the floating point values to integer
+            lut[key[0]:key[1]] = np.linspace(0, 255, key[1] - key[0])
+            lut[key[1]:] = 255
+            lut.flags.writeable = False
+            if len(_uint8_luts) >= MAX_UINT8_LUTS:
+                _uint8_luts.popitem(last=False)
+        # Most recently used tables are kept at the end.
+        _uint8_luts[key] = lut
+        return lut
+
+    @staticmethod
+    def _map_to_uint8(img, lower_bound=None, upper_bound=None, out=None):
         '''Maps a 16-bit image trough a lookup table to convert it to 8-bit.
+        Values below `lower_bound` and above `upper_bound` are mapped to
+        ``0`` and ``255``, respectively, such that clipping is not required.
 
         Parameters
         ----------
@@ -506,6 +559,9 @@ class ChannelImage(Image):
             upper bound of the range that should be mapped to ``[0, 255]``,
             value must be in the range ``[0, 65535]``
             (defaults to ``numpy.max(img)``)
+        out: numpy.ndarray[np.uint8], optional
+            array with the same dimensions as `img` into which mapped values
+            should be written (default: ``None``)
 
         Returns
         -------
@@ -524,14 +580,19 @@ class ChannelImage(Image):
             upper_bound = np.max(img)
         if lower_bound >= upper_bound:
             raise ValueError('"lower_bound" must be smaller than "upper_bound"')
-        lut = np.concatenate([
-            np.zeros(lower_bound, dtype=np.uint16),
-            np.linspace(0, 255, upper_bound - lower_bound).astype(np.uint16),
-            np.ones(2**16 - upper_bound, dtype=np.uint16) * 255
-        ])
-        return lut[img].astype(np.uint8)
-
-    def scale(self, lower, upper, inplace=True):
+        if out is None:
+            out = np.empty(img.shape, dtype=np.uint8)
+        elif out.dtype != np.uint8 or out.shape != img.shape:
+            raise ValueError(
+                '"out" must have 8-bit unsigned integer type and the same '
+                'dimensions as "img".'
+            )
+        lut = ChannelImage._get_uint8_lut(lower_bound, upper_bound)
+        # All indices are within the table, but mode "clip" prevents
+        # buffering of the output.
+        return np.take(lut, img, out=out, mode='clip')
+
+    def scale(self, lower, upper, inplace=True, out=None):
         '''Scales values to 8-bit such that the range [`lower`, `upper`]
         will be mapped to the range [0, 255].
 
@@ -544,6 +605,10 @@ class ChannelImage(Image):
         inplace: bool, optional
             whether values should be rescaled in place rather than creating
             a new image object (default: ``True``)
+        out: numpy.ndarray[numpy.uint8], optional
+            array with the same dimensions as the image into which rescaled
+            values should be written, e.g. a buffer that is reused for
+            several images (default: ``None``)
 
         Returns
         -------
@@ -551,7 +616,7 @@ class ChannelImage(Image):
             image with rescaled pixels
         '''
         if self.is_uint16:
-            array = self._map_to_uint8(self.array, lower, upper)
+            array = self._map_to_uint8(self.array, lower, upper, out)
             if inplace:
                 self.array = array
                 self.metadata.is_rescaled = True
@@ -567,7 +632,7 @@ class ChannelImage(Image):
                 'Only pixels with unsigned integer type can be scaled.'
             )
 
-    def clip(self, lower, upper, inplace=True):
+    def clip(self, lower, upper, inplace=True, scale=False):
         '''Clips intensity values below `lower` and above `upper`, i.e. set all
         pixel values below `lower` to `lower` and all above `upper` to `upper`.
 
@@ -580,12 +645,22 @@ class ChannelImage(Image):
         inplace: bool, optional
             whether values should be clipped in place rather than creating
             a new image object (default: ``True``)
+        scale: bool, optional
+            whether values should further be scaled to 8-bit in the same
+            pass, which is equivalent to, but faster than, calling
+            :meth:`scale <tmlib.image.ChannelImage.scale>` with the same
+            bounds afterwards (default: ``False``)
 
         Returns
         -------
         tmlib.image.ChannelImage
             image with clipped pixels
         '''
+        if scale and self.is_uint16:
+            # Values outside of the range are mapped to the bounds anyways.
+            image = self.scale(lower, upper, inplace)
+            image.metadata.is_clipped = True
+            return image
         array = np.clip(self.array, lower, upper)
         if inplace:
             self.array = array
@@ -597,7 +672,8 @@ class ChannelImage(Image):
             return new_image
 
     @staticmethod
-    def _correct_illumination(img, mean, std, log_transform=True):
+    def _correct_illumination(img, mean, std, log_transform=True, out=None,
+            n_threads=1):
         '''Corrects an image for illumination artifacts.
 
         Parameters
@@ -610,28 +686,71 @@ class ChannelImage(Image):
             matrix of standard deviation values (same dimensions as `img`)
         log_transform: bool, optional
             log10 transform `img` (default: ``True``)
+        out: numpy.ndarray, optional
+            array with the same dimensions and data type as `img` into which
+            corrected values should be written; may be `img` itself
+            (default: ``None``)
+        n_threads: int, optional
+            number of threads across which blocks of rows should be
+            distributed (default: ``1``)
 
         Returns
         -------
         numpy.ndarray
             corrected image (same data type as `img`)
+
+        Note
+        ----
+        Computations are performed in single precision on blocks of rows
+        (see :const:`ILLUMCORR_BLOCK_SIZE <tmlib.image.ILLUMCORR_BLOCK_SIZE>`)
+        to avoid temporary copies of the entire image. Corrected values may
+        thus differ by one from values computed in double precision.
         '''
-        img_type = img.dtype
-        # Do all computations with type float
-        img = img.astype(np.float64)
-        if log_transform:
-            img[img == 0] = 10**-10
-            img = np.log10(img)
-            img[img == 0] = 0
-        img = (img - mean) / std
-        img = (img * np.mean(std)) + np.mean(mean)
-        if log_transform:
-            img = 10 ** img
-        # Cast back to original type.
-        return img.astype(img_type)
+        if out is None:
+            out = np.empty(img.shape, dtype=img.dtype)
+        elif out.dtype != img.dtype or out.shape != img.shape:
+            raise ValueError(
+                '"out" must have the same data type and dimensions as "img".'
+            )
+        mean_of_mean = np.float32(np.mean(mean))
+        mean_of_std = np.float32(np.mean(std))
+        n_rows = max(1, ILLUMCORR_BLOCK_SIZE // img.shape[1])
+
+        def correct(start):
+            end = min(start + n_rows, img.shape[0])
+            # Do all computations with type float
+            block = img[start:end].astype(np.float32)
+            if log_transform:
+                np.maximum(block, 10**-10, out=block)
+                np.log10(block, out=block)
+            np.subtract(block, mean[start:end], out=block, casting='unsafe')
+            np.divide(block, std[start:end], out=block, casting='unsafe')
+            block *= mean_of_std
+            block += mean_of_mean
+            if log_transform:
+                np.power(np.float32(10), block, out=block)
+            # Cast back to original type.
+            out[start:end] = block
+
+        starts = range(0, img.shape[0], n_rows)
+        if n_threads > 1 and len(starts) > 1:
+            # Numpy releases the global interpreter lock for the
+            # computations, such that blocks are processed in parallel.
+            # Pools are reused for all images corrected by the process.
+            if n_threads not in _thread_pools:
+                logger.debug(
+                    'create pool of %d threads for illumination correction',
+                    n_threads
+                )
+                _thread_pools[n_threads] = ThreadPool(n_threads)
+            _thread_pools[n_threads].map(correct, starts)
+        else:
+            for start in starts:
+                correct(start)
+        return out
 
     @assert_type(stats='tmlib.image.IllumstatsContainer')
-    def correct(self, stats, inplace=True):
+    def correct(self, stats, inplace=True, n_threads=1):
         '''Corrects the image for illumination artifacts.
 
         Parameters
@@ -642,6 +761,8 @@ class ChannelImage(Image):
         inplace: bool, optional
             whether values should be corrected in place rather than creating
             a new image object (default: ``True``)
+        n_threads: int, optional
+            number of threads for the correction (default: ``1``)
 
         Returns
         -------
@@ -657,8 +778,13 @@ class ChannelImage(Image):
         if (stats.mean.metadata.channel_id != self.metadata.channel_id or
                 stats.std.metadata.channel_id != self.metadata.channel_id):
             raise ValueError('Channels don\'t match!')
+        if inplace and self.array.flags.writeable:
+            out = self.array
+        else:
+            out = None
         array = self._correct_illumination(
-            self.array, stats.mean.array, stats.std.array
+            self.array, stats.mean.array, stats.std.array, out=out,
+            n_threads=n_threads
         )
         if inplace:
             self.array = array
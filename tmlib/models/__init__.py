@@ -138,9 +138,12 @@ from tmlib.models.well import Well
 from tmlib.models.channel import Channel, ChannelLayer
 from tmlib.models.tile import ChannelLayerTile
 from tmlib.models.mapobject import (
-    MapobjectType, Mapobject, MapobjectSegmentation, SegmentationLayer
+    MapobjectType, Mapobject, MapobjectSegmentation, SegmentationLayer,
+    SimplifiedMapobjectSegmentation
+)
+from tmlib.models.feature import (
+    Feature, FeatureValues, FeatureStatistics, SiteFeatureStatistics
 )
-from tmlib.models.feature import Feature, FeatureValues
 from tmlib.models.plate import Plate
 from tmlib.models.acquisition import Acquisition
 from tmlib.models.cycle import Cycle
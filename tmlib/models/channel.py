@@ -23,24 +23,24 @@ import lxml
 import numpy as np
 from cached_property import cached_property
 from sqlalchemy import Column, Integer, ForeignKey, String, UniqueConstraint
-from sqlalchemy import or_
 from sqlalchemy.dialects.postgresql import JSON
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.orm import relationship, backref, Session
 from sqlalchemy.ext.hybrid import hybrid_property
 
 from tmlib.models.file import ChannelImageFile
-from tmlib.models.site import Site
-from tmlib.models.well import Well
 from tmlib.models.feature import FeatureValues
 from tmlib.models.result import LabelValues
-from tmlib.models.tile import ChannelLayerTile
+from tmlib.models.tile import (
+    ChannelLayerTile, DatabaseTileStore, FileTileStore
+)
 from tmlib.models.mapobject import MapobjectSegmentation
-from tmlib.models.plate import Plate
+from tmlib.models.layout import ExperimentLayout, ImageIndex
 from tmlib.models.base import (
     ExperimentModel, DirectoryModel, DateMixIn, IdMixIn
 )
 from tmlib.models.utils import ExperimentConnection, ExperimentSession
+from tmlib import cfg
 from tmlib.models.utils import remove_location_upon_delete
 from tmlib.errors import RegexError, DataError
 from tmlib.image import PyramidTile
@@ -216,6 +216,59 @@ class ChannelLayer(ExperimentModel, IdMixIn):
         self.zplane = zplane
         self.channel_id = channel_id
 
+    @property
+    def location(self):
+        '''str: location were channel layer content is stored'''
+        return os.path.join(
+            self.channel.location,
+            CHANNEL_LAYER_LOCATION_FORMAT.format(id=self.id)
+        )
+
+    @property
+    def tiles_location(self):
+        '''str: location where tiles are stored in case of storage in the
+        filesystem
+        '''
+        return os.path.join(self.location, 'tiles')
+
+    @cached_property
+    def tile_store(self):
+        '''tmlib.models.tile.TileStore: storage backend for the tiles of the
+        layer as configured by
+        :attr:`tile_storage <tmlib.config.LibraryConfig.tile_storage>`
+        '''
+        if cfg.tile_storage == 'filesystem':
+            return FileTileStore(self.id, self.tiles_location, self.dimensions)
+        session = Session.object_session(self)
+        return DatabaseTileStore(session, self.id, self.dimensions)
+
+    def get_encoded_tile(self, z, y, x):
+        '''Gets an individual *JPEG* encoded tile of the layer from the
+        configured storage backend. Tiles should be read via this method
+        rather than by querying
+        :class:`ChannelLayerTile <tmlib.models.tile.ChannelLayerTile>`
+        directly, because tiles are not stored in the database when
+        :attr:`tile_storage <tmlib.config.LibraryConfig.tile_storage>` is
+        ``"filesystem"``.
+
+        Parameters
+        ----------
+        z: int
+            zero-based zoom level index
+        y: int
+            zero-based row index
+        x: int
+            zero-based column index
+
+        Returns
+        -------
+        numpy.ndarray[numpy.uint8]
+            encoded tile or ``None`` in case the tile doesn't exist; when
+            tiles are stored in the database, tiles within the bounds of the
+            layer always exist, because background tiles are not stored
+        '''
+        return self.tile_store.get_encoded_tile(z, y, x)
+
     @cached_property
     def height(self):
         '''int: number of pixels along vertical axis at highest resolution level
@@ -299,29 +352,11 @@ class ChannelLayer(ExperimentModel, IdMixIn):
             maximum zoom level
         '''
         logger.debug('calculate size of image at highest resolution level')
-        experiment = self.channel.experiment
-        plate_sizes = np.array([p.image_size for p in experiment.plates])
+        # The size of the plate which contains the most wells is used for all
+        # plates. The other plates are then filled with empty tiles.
         # TODO: This can cause problems when wells were deleted (because
         # metadata configuration was resubmitted), but channels still exist
-        if not(len(np.unique(plate_sizes[:, 0])) == 1 and
-                len(np.unique(plate_sizes[:, 1]) == 1)):
-            logger.warning('plates don\'t have equal sizes')
-        # Take the size of the plate which contains the most wells. The
-        # other plates should then be filled with empty tiles.
-        plate_size = (np.max(plate_sizes[:, 0]), np.max(plate_sizes[:, 1]))
-        # Introduce spacers between plates
-        row_spacer_height = (
-            (experiment.plate_grid.shape[0] - 1) *
-            experiment.plate_spacer_size
-        )
-        column_spacer_width = (
-            (experiment.plate_grid.shape[1] - 1) *
-            experiment.plate_spacer_size
-        )
-        return tuple(
-            np.array(plate_size) * experiment.plate_grid.shape +
-            np.array([row_spacer_height, column_spacer_width])
-        )
+        return self.layout.image_size
 
     def calculate_zoom_levels(self, height, width):
         '''Calculates number of zoom levels.
@@ -432,19 +467,21 @@ class ChannelLayer(ExperimentModel, IdMixIn):
         upper and/or left border of the image in `image_file`.
         '''
         mappings = list()
-        experiment = self.channel.experiment
-        site = image_file.site
-        well = image_file.site.well
-        y_offset_site, x_offset_site = site.offset
+        layout = self.layout
+        index = layout.get_site_index(image_file.site_id)
+        site_y, site_x = layout.coordinates[index]
+        image_size = layout.image_sizes[index]
+        well_dimensions = layout.well_dimensions[layout.well_index[index]]
+        y_offset_site, x_offset_site = layout.offsets[index]
         # Determine the index and offset of each tile whose pixels are part of
         # the image
         row_info = self._calc_tile_indices_and_offsets(
-            y_offset_site, site.image_size[0],
-            experiment.vertical_site_displacement
+            y_offset_site, image_size[0],
+            layout.vertical_site_displacement
         )
         col_info = self._calc_tile_indices_and_offsets(
-            x_offset_site, site.image_size[1],
-            experiment.horizontal_site_displacement
+            x_offset_site, image_size[1],
+            layout.horizontal_site_displacement
         )
         # Each job processes only the overlapping tiles at the upper and/or
         # left border of the image. This prevents that tiles are created twice,
@@ -453,34 +490,19 @@ class ChannelLayer(ExperimentModel, IdMixIn):
         # or plates represent an exception because in these cases there is
         # no neighboring image to create the tile instead, but an empty spacer.
         # The same is true in case of missing neighboring images.
-        session = Session.object_session(self)
-        lower_neighbor_count = session.query(ChannelImageFile.id).\
-            join(Site).\
-            filter(
-                Site.y == site.y + 1, Site.x == site.x,
-                Site.well_id == site.well_id,
-                ChannelImageFile.channel_id == self.channel_id,
-                ChannelImageFile.tpoint == self.tpoint
-            ).\
-            count()
-        right_neighbor_count = session.query(ChannelImageFile.id).\
-            join(Site).\
-            filter(
-                Site.y == site.y, Site.x == site.x + 1,
-                Site.well_id == site.well_id,
-                ChannelImageFile.channel_id == self.channel_id,
-                ChannelImageFile.tpoint == self.tpoint
-            ).\
-            count()
-        has_lower_neighbor = lower_neighbor_count > 0
-        has_right_neighbor = right_neighbor_count > 0
+        has_lower_neighbor = (
+            self.image_index.get_neighbour(image_file.id, 1, 0) is not None
+        )
+        has_right_neighbor = (
+            self.image_index.get_neighbour(image_file.id, 0, 1) is not None
+        )
         for i, y in enumerate(row_info['indices']):
             y_offset = row_info['offsets'][i]
             is_overhanging_vertically = (
-                (y_offset + self.tile_size) > site.image_size[0]
+                (y_offset + self.tile_size) > image_size[0]
             )
             is_not_lower_plate_border = (y + 1) != self.dimensions[-1][0]
-            is_not_lower_well_border = (site.y + 1) != well.dimensions[0]
+            is_not_lower_well_border = (site_y + 1) != well_dimensions[0]
             if is_overhanging_vertically and has_lower_neighbor:
                 if (is_not_lower_plate_border and
                         is_not_lower_well_border):
@@ -488,10 +510,10 @@ class ChannelLayer(ExperimentModel, IdMixIn):
             for j, x in enumerate(col_info['indices']):
                 x_offset = col_info['offsets'][j]
                 is_overhanging_horizontally = (
-                    (x_offset + self.tile_size) > site.image_size[1]
+                    (x_offset + self.tile_size) > image_size[1]
                 )
                 is_not_right_plate_border = (x + 1) != self.dimensions[-1][1]
-                is_not_right_well_border = (site.x + 1) != well.dimensions[1]
+                is_not_right_well_border = (site_x + 1) != well_dimensions[1]
                 if is_overhanging_horizontally and has_right_neighbor:
                     if (is_not_right_plate_border and
                             is_not_right_well_border):
@@ -513,47 +535,12 @@ class ChannelLayer(ExperimentModel, IdMixIn):
             row, column coordinates
         '''
         logger.debug('get coordinates of empty tiles at maxzoom level')
-        tile_coords = self.base_tile_coordinate_to_image_file_map.keys()
+        tile_coords = self.image_index.coordinates
         rows = range(self.dimensions[-1][0])
         cols = range(self.dimensions[-1][1])
         all_tile_coords = list(itertools.product(rows, cols))
         return set(all_tile_coords) - set(tile_coords)
 
-    def _calc_tile_indices(self, position, length, displacement):
-        '''Calculates row or column index for each tile
-        that maps to either the vertical or horizontal axis of the given image,
-        respectively.
-
-        Parameters
-        ----------
-        position: int
-            pixel position of the top, left corner of the image in the layer
-            on the given axis
-        length: int
-            length of the image in pixels along the given axis
-        displacement: int
-            displacement of the image to its neighboring image in pixels
-            along the given axis
-
-        Returns
-        -------
-        List[int]
-            indices of tiles that map to the given axis
-        '''
-        start_fraction = (
-            np.float(position) /
-            np.float(self.tile_size)
-        )
-        start_index = int(np.floor(start_fraction))
-
-        end_fraction = (
-            np.float(position + length - displacement) /
-            np.float(self.tile_size)
-        )
-        end_index = int(np.ceil(end_fraction))
-
-        return range(start_index, end_index)
-
     def map_base_tile_to_images(self, site):
         '''Maps tiles at the highest resolution level to all image files of
         the same channel, which intersect with the given tile. Only images
@@ -570,43 +557,52 @@ class ChannelLayer(ExperimentModel, IdMixIn):
             IDs of images intersecting with a given tile hashable by tile
             y, x coordinates
         '''
-        experiment = self.channel.experiment
-        session = Session.object_session(self)
+        layout = self.layout
+        site_index = layout.get_site_index(site.id)
         # Only consider sites to the left and/or top of the current site
-        neighbouring_sites = session.query(Site).\
-            join(Well).\
-            filter(
-                Well.id == site.well.id,
-                Site.x.in_([site.x - 1, site.x]),
-                Site.y.in_([site.y - 1, site.y])
-            )
-
         mapping = collections.defaultdict(list)
-        for current_site in neighbouring_sites:
-            if current_site.y == site.y and current_site.x == site.x:
+        for y, x in [(-1, -1), (-1, 0), (0, -1)]:
+            neighbour = layout.neighbours[site_index, y + 1, x + 1]
+            if neighbour < 0 or layout.omitted[neighbour]:
                 continue
-            if current_site.omitted:
+            fid = int(self.image_index.image_file_ids[neighbour])
+            if fid == 0:
                 continue
-            fid = session.query(ChannelImageFile.id).\
-                filter_by(
-                    site_id=current_site.id, channel_id=self.channel.id,
-                    tpoint=self.tpoint, zplane=self.zplane
-                ).\
-                one()[0]
-            y_offset_site, x_offset_site = current_site.offset
-            row_indices = self._calc_tile_indices(
-                y_offset_site, current_site.image_size[0],
-                experiment.vertical_site_displacement
-            )
-            col_indices = self._calc_tile_indices(
-                x_offset_site, current_site.image_size[1],
-                experiment.horizontal_site_displacement
-            )
-            for y, x in itertools.product(row_indices, col_indices):
-                mapping[(y, x)].append(fid)
-
+            row_indices, col_indices = self.image_index.get_tile_ranges(fid)
+            for r, c in itertools.product(row_indices, col_indices):
+                mapping[(r, c)].append(fid)
         return mapping
 
+    @cached_property
+    def layout(self):
+        '''tmlib.models.layout.ExperimentLayout: offsets and sizes of all
+        sites of the parent experiment
+        '''
+        session = Session.object_session(self)
+        return ExperimentLayout.load(session)
+
+    @cached_property
+    def image_index(self):
+        '''tmlib.models.layout.ImageIndex: spatial index of the images of
+        the layer, which maps tiles at the maximal zoom level to intersecting
+        images and images to their neighbours
+        '''
+        logger.debug('create spatial index of images')
+        session = Session.object_session(self)
+        image_files = session.query(
+                ChannelImageFile.site_id, ChannelImageFile.id
+            ).\
+            filter_by(
+                channel_id=self.channel_id, tpoint=self.tpoint,
+                zplane=self.zplane
+            ).\
+            all()
+        return ImageIndex(
+            self.layout,
+            [f.site_id for f in image_files], [f.id for f in image_files],
+            self.tile_size
+        )
+
     @cached_property
     def base_tile_coordinate_to_image_file_map(self):
         '''Dict[Tuple[int], List[int]]: IDs of all images, which intersect
@@ -614,34 +610,7 @@ class ChannelLayer(ExperimentModel, IdMixIn):
         to the files of intersecting images
         '''
         logger.debug('create mapping of base tile coordinates to image files')
-        experiment = self.channel.experiment
-        session = Session.object_session(self)
-        sites = session.query(Site).\
-            join(Well).\
-            join(Plate).\
-            filter(Plate.experiment_id == experiment.id)
-        mapping = collections.defaultdict(list)
-        for site in sites:
-            if site.omitted:
-                continue
-            fid = session.query(ChannelImageFile.id).\
-                filter_by(
-                    site_id=site.id, channel_id=self.channel.id,
-                    tpoint=self.tpoint, zplane=self.zplane
-                ).\
-                one()[0]
-            y_offset_site, x_offset_site = site.offset
-            row_indices = self._calc_tile_indices(
-                y_offset_site, site.image_size[0],
-                experiment.vertical_site_displacement
-            )
-            col_indices = self._calc_tile_indices(
-                x_offset_site, site.image_size[1],
-                experiment.horizontal_site_displacement
-            )
-            for y, x in itertools.product(row_indices, col_indices):
-                mapping[(y, x)].append(fid)
-        return mapping
+        return self.image_index.to_dict()
 
     def calc_coordinates_of_next_higher_level(self, z, y, x):
         '''Calculates for a given tile the coordinates of the 4 tiles at the
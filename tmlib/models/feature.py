@@ -15,12 +15,15 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import logging
 import csv
+import itertools
+import collections
+import numpy as np
 from cStringIO import StringIO
 from sqlalchemy import (
-    Column, String, Integer, BigInteger, ForeignKey, Boolean, Index,
+    Column, String, Integer, BigInteger, ForeignKey, Boolean, Index, Float,
     PrimaryKeyConstraint, UniqueConstraint, ForeignKeyConstraint
 )
-from sqlalchemy.dialects.postgresql import HSTORE
+from sqlalchemy.dialects.postgresql import HSTORE, ARRAY, REAL
 from sqlalchemy.orm import relationship, backref
 
 from tmlib.models.base import (
@@ -52,6 +55,11 @@ class Feature(ExperimentModel, IdMixIn):
     #: bool: whether the feature is an aggregate of child object features
     is_aggregate = Column(Boolean, index=True)
 
+    #: int: zero-based position of the feature in
+    #: :attr:`FeatureValues.value_array <tmlib.models.feature.FeatureValues.value_array>`;
+    #: ``None`` if values of the feature are not stored in columnar format
+    column_index = Column(Integer)
+
     #: int: id of the parent mapobject type
     mapobject_type_id = Column(
         Integer,
@@ -65,7 +73,8 @@ class Feature(ExperimentModel, IdMixIn):
         backref=backref('features', cascade='all, delete-orphan')
     )
 
-    def __init__(self, name, mapobject_type_id, is_aggregate=False):
+    def __init__(self, name, mapobject_type_id, is_aggregate=False,
+            column_index=None):
         '''
         Parameters
         ----------
@@ -77,10 +86,14 @@ class Feature(ExperimentModel, IdMixIn):
         is_aggregate: bool, optional
             whether the feature is an aggregate calculated based on another
             feature
+        column_index: int, optional
+            zero-based position of the feature in columnar storage
+            (default: ``None``)
         '''
         self.name = name
         self.mapobject_type_id = mapobject_type_id
         self.is_aggregate = is_aggregate
+        self.column_index = column_index
 
     def __repr__(self):
         return '<Feature(id=%r, name=%r)>' % (self.id, self.name)
@@ -124,7 +137,16 @@ class FeatureValues(DistributedExperimentModel):
     #: int: ID of the parent mapobject
     mapobject_id = Column(BigInteger, index=True)
 
-    def __init__(self, partition_key, mapobject_id, values, tpoint=None):
+    #: List[float]: feature values in columnar format, where the position of
+    #: each value is given by
+    #: :attr:`Feature.column_index <tmlib.models.feature.Feature.column_index>`
+    # NOTE: Values are stored in addition to "values" when enabled via
+    # "columnar_feature_values" in the configuration. This allows reading
+    # values directly as numbers without having to parse text.
+    value_array = Column(ARRAY(REAL))
+
+    def __init__(self, partition_key, mapobject_id, values, tpoint=None,
+            value_array=None):
         '''
         Parameters
         ----------
@@ -136,11 +158,14 @@ class FeatureValues(DistributedExperimentModel):
             mapping of feature ID to value
         tpoint: int, optional
             zero-based time point index
+        value_array: numpy.ndarray[numpy.float32], optional
+            values in columnar format (default: ``None``)
         '''
         self.partition_key = partition_key
         self.mapobject_id = mapobject_id
         self.tpoint = tpoint
         self.values = values
+        self.value_array = value_array
 
     @classmethod
     def _add(cls, connection, instance):
@@ -173,13 +198,22 @@ class FeatureValues(DistributedExperimentModel):
         f = StringIO()
         w = csv.writer(f, delimiter=';')
         for obj in instances:
+            if obj.value_array is not None:
+                value_array = '{%s}' % ','.join([
+                    str(v) for v in obj.value_array
+                ])
+            else:
+                value_array = None
             w.writerow((
                 obj.partition_key, obj.mapobject_id, obj.tpoint,
                 ','.join([
                     '=>'.join([k, str(v)]) for k, v in obj.values.iteritems()
-                ])
+                ]),
+                value_array
             ))
-        columns = ('partition_key', 'mapobject_id', 'tpoint', 'values')
+        columns = (
+            'partition_key', 'mapobject_id', 'tpoint', 'values', 'value_array'
+        )
         f.seek(0)
         connection.copy_from(
             f, cls.__table__.name, sep=';', columns=columns, null=''
@@ -191,3 +225,426 @@ class FeatureValues(DistributedExperimentModel):
             '<FeatureValues(id=%r, tpoint=%r, mapobject_id=%r)>'
             % (self.id, self.tpoint, self.mapobject_id)
         )
+
+
+#: numpy.ndarray[numpy.float64]: probabilities of the approximate quantiles
+#: that are stored in
+#: :attr:`FeatureStatistics.quantiles <tmlib.models.feature.FeatureStatistics.quantiles>`
+QUANTILE_PROBABILITIES = np.linspace(0, 1, 21)
+
+
+class _FeatureStatisticsMixIn(object):
+
+    '''Mixin class for columns that describe the distribution of values of a
+    :class:`Feature <tmlib.models.feature.Feature>`.
+    '''
+
+    #: int: zero-based time point index
+    tpoint = Column(Integer, nullable=False)
+
+    #: int: number of values that are not NaN
+    count = Column(BigInteger)
+
+    #: int: number of NaN values
+    nan_count = Column(BigInteger)
+
+    #: float: minimum value
+    min = Column(Float(precision=53))
+
+    #: float: maximum value
+    max = Column(Float(precision=53))
+
+    #: float: arithmetic mean
+    mean = Column(Float(precision=53))
+
+    #: float: (population) standard deviation
+    std = Column(Float(precision=53))
+
+    #: List[float]: approximate quantiles at
+    #: :const:`QUANTILE_PROBABILITIES <tmlib.models.feature.QUANTILE_PROBABILITIES>`
+    quantiles = Column(ARRAY(REAL))
+
+    def _set_statistics(self, tpoint, count, nan_count, min, max, mean, std,
+            quantiles):
+        # NOTE: NumPy integer types cannot be adapted by psycopg2.
+        self.tpoint = int(tpoint)
+        self.count = int(count)
+        self.nan_count = int(nan_count)
+        self.min = float(min)
+        self.max = float(max)
+        self.mean = float(mean)
+        self.std = float(std)
+        self.quantiles = [float(q) for q in quantiles]
+
+
+class SiteFeatureStatistics(ExperimentModel, IdMixIn, _FeatureStatisticsMixIn):
+
+    '''Partial statistics of a :class:`Feature <tmlib.models.feature.Feature>`
+    for all mapobjects of a :class:`Site <tmlib.models.site.Site>`, which get
+    computed upon saving of feature values and merged into
+    :class:`FeatureStatistics <tmlib.models.feature.FeatureStatistics>`.
+    '''
+
+    __tablename__ = 'site_feature_statistics'
+
+    __table_args__ = (UniqueConstraint('feature_id', 'tpoint', 'site_id'), )
+
+    #: int: ID of the parent feature
+    feature_id = Column(
+        Integer,
+        ForeignKey('features.id', onupdate='CASCADE', ondelete='CASCADE'),
+        index=True
+    )
+
+    #: int: ID of the parent site
+    site_id = Column(
+        Integer,
+        ForeignKey('sites.id', onupdate='CASCADE', ondelete='CASCADE'),
+        index=True
+    )
+
+    def __init__(self, feature_id, site_id, tpoint, count, nan_count, min, max,
+            mean, std, quantiles):
+        '''
+        Parameters
+        ----------
+        feature_id: int
+            ID of the parent :class:`Feature <tmlib.models.feature.Feature>`
+        site_id: int
+            ID of the parent :class:`Site <tmlib.models.site.Site>`
+        tpoint: int
+            zero-based time point index
+        count: int
+            number of values that are not NaN
+        nan_count: int
+            number of NaN values
+        min: float
+            minimum value
+        max: float
+            maximum value
+        mean: float
+            arithmetic mean
+        std: float
+            standard deviation
+        quantiles: List[float]
+            approximate quantiles
+        '''
+        self.feature_id = feature_id
+        self.site_id = site_id
+        self._set_statistics(
+            tpoint, count, nan_count, min, max, mean, std, quantiles
+        )
+
+    @classmethod
+    def update_per_partition(cls, connection, partition_key,
+            mapobject_type_id):
+        '''Recalculates statistics of all features of a given mapobject type
+        for a given site from the feature values of the remaining mapobjects,
+        e.g. after invalid mapobjects have been deleted.
+
+        Parameters
+        ----------
+        connection: tmlib.models.utils.ExperimentConnection
+            experiment-specific database connection
+        partition_key: int
+            value of the distribution column, i.e. ID of the site
+        mapobject_type_id: int
+            ID of the parent
+            :class:`MapobjectType <tmlib.models.mapobject.MapobjectType>`
+
+        Returns
+        -------
+        int
+            number of updated statistics
+        '''
+        connection.execute('''
+            SELECT s.id, s.feature_id, s.tpoint
+            FROM site_feature_statistics AS s
+            JOIN features AS f ON f.id = s.feature_id
+            WHERE s.site_id = %(site_id)s
+            AND f.mapobject_type_id = %(mapobject_type_id)s
+        ''', {
+            'site_id': partition_key,
+            'mapobject_type_id': mapobject_type_id
+        })
+        records = connection.fetchall()
+        if len(records) == 0:
+            return 0
+        feature_ids = sorted({r.feature_id for r in records})
+        column_lut = {str(fid): j for j, fid in enumerate(feature_ids)}
+        # Values of deleted mapobjects may still exist, but are excluded by
+        # the join with the remaining mapobjects.
+        connection.execute('''
+            SELECT v.tpoint, slice(v.values, %(feature_ids)s) AS values
+            FROM feature_values AS v
+            JOIN mapobjects AS m
+            ON m.id = v.mapobject_id AND m.partition_key = v.partition_key
+            WHERE v.partition_key = %(partition_key)s
+            AND m.partition_key = %(partition_key)s
+            AND m.mapobject_type_id = %(mapobject_type_id)s
+        ''', {
+            'feature_ids': column_lut.keys(),
+            'partition_key': partition_key,
+            'mapobject_type_id': mapobject_type_id
+        })
+        rows = collections.defaultdict(list)
+        for r in connection.fetchall():
+            row = np.full((len(feature_ids), ), np.nan)
+            for k, v in r.values.iteritems():
+                row[column_lut[k]] = float(v)
+            rows[r.tpoint].append(row)
+        stats = dict()
+        for t in {r.tpoint for r in records}:
+            values = np.array(rows[t]).reshape(-1, len(feature_ids))
+            stats[t] = FeatureStatistics.calculate(values)
+        for r in records:
+            j = column_lut[str(r.feature_id)]
+            values = {k: v[j] for k, v in stats[r.tpoint].iteritems()}
+            connection.execute('''
+                UPDATE site_feature_statistics
+                SET count = %(count)s, nan_count = %(nan_count)s,
+                    min = %(min)s, max = %(max)s, mean = %(mean)s,
+                    std = %(std)s, quantiles = %(quantiles)s
+                WHERE id = %(id)s
+            ''', {
+                'id': r.id,
+                'count': int(values['count']),
+                'nan_count': int(values['nan_count']),
+                'min': float(values['min']),
+                'max': float(values['max']),
+                'mean': float(values['mean']),
+                'std': float(values['std']),
+                'quantiles': [float(q) for q in values['quantiles']]
+            })
+        return len(records)
+
+    def __repr__(self):
+        return (
+            '<SiteFeatureStatistics(id=%r, feature_id=%r, site_id=%r, '
+            'tpoint=%r)>' % (self.id, self.feature_id, self.site_id, self.tpoint)
+        )
+
+
+class FeatureStatistics(ExperimentModel, IdMixIn, _FeatureStatisticsMixIn):
+
+    '''Statistics of a :class:`Feature <tmlib.models.feature.Feature>`
+    for all mapobjects at a given time point, which allow describing the
+    distribution of values without having to query
+    :class:`FeatureValues <tmlib.models.feature.FeatureValues>`.
+
+    Statistics are merged from
+    :class:`SiteFeatureStatistics <tmlib.models.feature.SiteFeatureStatistics>`.
+    Count, extrema, mean and standard deviation are exact,
+    while quantiles are approximated.
+    '''
+
+    __tablename__ = 'feature_statistics'
+
+    __table_args__ = (UniqueConstraint('feature_id', 'tpoint'), )
+
+    #: int: ID of the parent feature
+    feature_id = Column(
+        Integer,
+        ForeignKey('features.id', onupdate='CASCADE', ondelete='CASCADE'),
+        index=True
+    )
+
+    #: tmlib.models.feature.Feature: parent feature
+    feature = relationship(
+        'Feature',
+        backref=backref('statistics', cascade='all, delete-orphan')
+    )
+
+    def __init__(self, feature_id, tpoint, count, nan_count, min, max, mean,
+            std, quantiles):
+        '''
+        Parameters
+        ----------
+        feature_id: int
+            ID of the parent :class:`Feature <tmlib.models.feature.Feature>`
+        tpoint: int
+            zero-based time point index
+        count: int
+            number of values that are not NaN
+        nan_count: int
+            number of NaN values
+        min: float
+            minimum value
+        max: float
+            maximum value
+        mean: float
+            arithmetic mean
+        std: float
+            standard deviation
+        quantiles: List[float]
+            approximate quantiles
+        '''
+        self.feature_id = feature_id
+        self._set_statistics(
+            tpoint, count, nan_count, min, max, mean, std, quantiles
+        )
+
+    @staticmethod
+    def calculate(values):
+        '''Calculates statistics of feature values.
+
+        Parameters
+        ----------
+        values: numpy.ndarray
+            two-dimensional array of values, where rows are mapobjects and
+            columns are features
+
+        Returns
+        -------
+        Dict[str, numpy.ndarray]
+            "count", "nan_count", "min", "max", "mean", "std" and "quantiles"
+            for each feature; statistics of features without any values other
+            than NaN are NaN
+        '''
+        values = np.asarray(values, dtype=np.float64)
+        is_nan = np.isnan(values)
+        n = values.shape[1]
+        count = np.sum(~is_nan, axis=0)
+        stats = {
+            'count': count,
+            'nan_count': values.shape[0] - count,
+            'min': np.full((n, ), np.nan),
+            'max': np.full((n, ), np.nan),
+            'mean': np.full((n, ), np.nan),
+            'std': np.full((n, ), np.nan),
+            'quantiles': np.full((n, len(QUANTILE_PROBABILITIES)), np.nan)
+        }
+        # NOTE: Functions of the "nan" family warn for all-NaN columns.
+        index = np.where(count > 0)[0]
+        if len(index) == 0:
+            return stats
+        values = values[:, index]
+        stats['min'][index] = np.nanmin(values, axis=0)
+        stats['max'][index] = np.nanmax(values, axis=0)
+        stats['mean'][index] = np.nanmean(values, axis=0)
+        stats['std'][index] = np.nanstd(values, axis=0)
+        stats['quantiles'][index, :] = np.nanpercentile(
+            values, QUANTILE_PROBABILITIES * 100, axis=0
+        ).T
+        return stats
+
+    @staticmethod
+    def merge(partials):
+        '''Merges partial statistics of a feature at a given time point.
+
+        Parameters
+        ----------
+        partials: List[tmlib.models.feature.SiteFeatureStatistics]
+            partial statistics (or records with the same attributes)
+
+        Returns
+        -------
+        Dict[str, Union[int, float, List[float]]]
+            merged "count", "nan_count", "min", "max", "mean", "std" and
+            "quantiles"
+
+        Note
+        ----
+        Quantiles are approximated by treating the quantiles of each partial
+        as equally weighted samples of its values.
+        '''
+        nan_count = sum([p.nan_count for p in partials])
+        partials = [p for p in partials if p.count > 0]
+        n = len(QUANTILE_PROBABILITIES)
+        if len(partials) == 0:
+            return {
+                'count': 0, 'nan_count': nan_count,
+                'min': np.nan, 'max': np.nan, 'mean': np.nan, 'std': np.nan,
+                'quantiles': np.full((n, ), np.nan)
+            }
+        counts = np.array([p.count for p in partials], dtype=np.float64)
+        means = np.array([p.mean for p in partials], dtype=np.float64)
+        stds = np.array([p.std for p in partials], dtype=np.float64)
+        count = np.sum(counts)
+        mean = np.sum(counts * means) / count
+        # Sum of squared deviations from the common mean (Chan et al.)
+        m2 = np.sum(counts * (stds ** 2 + (means - mean) ** 2))
+        lower = np.min([p.min for p in partials])
+        upper = np.max([p.max for p in partials])
+
+        points = np.array(
+            [p.quantiles for p in partials], dtype=np.float64
+        ).ravel()
+        weights = np.repeat(counts / n, n)
+        index = np.argsort(points, kind='mergesort')
+        points = points[index]
+        weights = weights[index]
+        positions = (np.cumsum(weights) - weights / 2) / count
+        quantiles = np.interp(QUANTILE_PROBABILITIES, positions, points)
+        quantiles[0] = lower
+        quantiles[-1] = upper
+        return {
+            'count': int(count), 'nan_count': nan_count,
+            'min': lower, 'max': upper, 'mean': mean,
+            'std': np.sqrt(m2 / count), 'quantiles': quantiles
+        }
+
+    @classmethod
+    def update(cls, connection, feature_id):
+        '''Merges partial statistics of all sites for a given feature and
+        inserts or updates statistics for each time point.
+
+        Parameters
+        ----------
+        connection: tmlib.models.utils.ExperimentConnection
+            experiment-specific database connection
+        feature_id: int
+            ID of the :class:`Feature <tmlib.models.feature.Feature>`
+
+        Returns
+        -------
+        int
+            number of time points
+        '''
+        connection.execute('''
+            SELECT tpoint, count, nan_count, min, max, mean, std, quantiles
+            FROM site_feature_statistics
+            WHERE feature_id = %(feature_id)s
+            ORDER BY tpoint
+        ''', {
+            'feature_id': feature_id
+        })
+        records = connection.fetchall()
+        tpoints = 0
+        for t, partials in itertools.groupby(records, lambda r: r.tpoint):
+            stats = cls.merge(list(partials))
+            connection.execute('''
+                INSERT INTO feature_statistics AS s (
+                    feature_id, tpoint, count, nan_count, min, max, mean, std,
+                    quantiles
+                )
+                VALUES (
+                    %(feature_id)s, %(tpoint)s, %(count)s, %(nan_count)s,
+                    %(min)s, %(max)s, %(mean)s, %(std)s, %(quantiles)s
+                )
+                ON CONFLICT
+                ON CONSTRAINT feature_statistics_feature_id_tpoint_key
+                DO UPDATE
+                SET count = EXCLUDED.count, nan_count = EXCLUDED.nan_count,
+                    min = EXCLUDED.min, max = EXCLUDED.max,
+                    mean = EXCLUDED.mean, std = EXCLUDED.std,
+                    quantiles = EXCLUDED.quantiles
+            ''', {
+                'feature_id': feature_id,
+                'tpoint': t,
+                'count': int(stats['count']),
+                'nan_count': int(stats['nan_count']),
+                'min': float(stats['min']),
+                'max': float(stats['max']),
+                'mean': float(stats['mean']),
+                'std': float(stats['std']),
+                'quantiles': [float(q) for q in stats['quantiles']]
+            })
+            tpoints += 1
+        return tpoints
+
+    def __repr__(self):
+        return (
+            '<FeatureStatistics(id=%r, feature_id=%r, tpoint=%r)>'
+            % (self.id, self.feature_id, self.tpoint)
+        )
@@ -26,6 +26,7 @@ from cached_property import cached_property
 from tmlib.utils import assert_type
 from tmlib.utils import notimplemented
 from tmlib.image import ChannelImage
+from tmlib.image import PyramidTile
 from tmlib.image import IllumstatsImage
 from tmlib.image import IllumstatsContainer
 from tmlib.metadata import ChannelImageMetadata
@@ -319,13 +320,27 @@ class ChannelImageFile(FileModel, DateMixIn):
         self.acquisition_id = acquisition_id
         self.file_map = file_map
 
-    def get(self):
+    def get(self, region=None, align=False):
         '''Gets stored image.
 
+        Parameters
+        ----------
+        region: Tuple[int], optional
+            *y* offset, height, *x* offset and width of a rectangular region
+            of the image that should be loaded (default: ``None``)
+        align: bool, optional
+            whether the image should be aligned with zero-valued padding,
+            in which case `region` refers to the aligned image
+            (default: ``False``)
+
         Returns
         -------
         tmlib.image.ChannelImage
             image stored in the file
+
+        See also
+        --------
+        :meth:`tmlib.models.file.ChannelImageFile.load`
         '''
         metadata = ChannelImageMetadata(
             channel_id=self.channel_id,
@@ -334,8 +349,6 @@ class ChannelImageFile(FileModel, DateMixIn):
             zplane=self.zplane,
             cycle_id=self.cycle_id
         )
-        with DatasetReader(self.location) as f:
-            array = f.read('array')
         metadata.bottom_residue = self.site.bottom_residue
         metadata.top_residue = self.site.top_residue
         metadata.left_residue = self.site.left_residue
@@ -348,7 +361,98 @@ class ChannelImageFile(FileModel, DateMixIn):
         if shifts is not None:
             metadata.x_shift = shifts.x
             metadata.y_shift = shifts.y
-        return ChannelImage(array, metadata)
+        return self.load(self.location, metadata, region, align)
+
+    @staticmethod
+    def load(location, metadata, region=None, align=False):
+        '''Loads an image from a file without querying the database.
+        This is useful when the metadata of many images have been determined
+        upfront.
+
+        Parameters
+        ----------
+        location: str
+            absolute path to the file
+        metadata: tmlib.metadata.ChannelImageMetadata
+            metadata of the image, including alignment information
+        region: Tuple[int], optional
+            *y* offset, height, *x* offset and width of a rectangular region
+            of the image that should be loaded (default: ``None``)
+        align: bool, optional
+            whether the image should be aligned with zero-valued padding
+            (see :meth:`tmlib.image.Image.align` with ``crop=False``),
+            in which case `region` refers to the aligned image
+            (default: ``False``)
+
+        Returns
+        -------
+        tmlib.image.ChannelImage
+            image stored in the file
+
+        Raises
+        ------
+        ValueError
+            when `region` lies outside of the image
+
+        Note
+        ----
+        Only the chunks of the dataset that overlap with `region` are read
+        from the file.
+        '''
+        with DatasetReader(location) as f:
+            if region is None:
+                image = ChannelImage(f.read('array'), metadata)
+                if align:
+                    image.align(crop=False)
+                return image
+
+            n_rows, n_cols = f.get_dims('array')
+            y_offset, height, x_offset, width = region
+            # Regions are truncated at the borders of the image in the same
+            # way as by Image.extract().
+            height = min(height, n_rows - y_offset)
+            width = min(width, n_cols - x_offset)
+            if y_offset < 0 or x_offset < 0 or height < 1 or width < 1:
+                raise ValueError(
+                    'Region lies outside of the image: %s' % str(region)
+                )
+            if not align:
+                array = f.read_subset(
+                    'array',
+                    row_index=slice(y_offset, y_offset + height),
+                    column_index=slice(x_offset, x_offset + width)
+                )
+                return ChannelImage(array, metadata)
+
+            # Pixel (y, x) of the aligned image corresponds to pixel
+            # (y - y_shift, x - x_shift) of the stored image, except for
+            # pixels falling into residues, which are zero.
+            md = metadata
+            row_start = max(y_offset, md.top_residue, md.y_shift)
+            row_end = min(
+                y_offset + height, n_rows - md.bottom_residue,
+                n_rows + md.y_shift
+            )
+            col_start = max(x_offset, md.left_residue, md.x_shift)
+            col_end = min(
+                x_offset + width, n_cols - md.right_residue,
+                n_cols + md.x_shift
+            )
+            array = np.zeros((height, width), dtype=f.get_type('array'))
+            if row_end > row_start and col_end > col_start:
+                array[
+                    row_start - y_offset:row_end - y_offset,
+                    col_start - x_offset:col_end - x_offset
+                ] = f.read_subset(
+                    'array',
+                    row_index=slice(row_start - md.y_shift,
+                                    row_end - md.y_shift),
+                    column_index=slice(col_start - md.x_shift,
+                                       col_end - md.x_shift)
+                )
+        image = ChannelImage(array, metadata)
+        image.metadata.is_aligned = True
+        return image
 
     @assert_type(image='tmlib.image.ChannelImage')
     def put(self, image):
@@ -358,9 +462,18 @@ class ChannelImageFile(FileModel, DateMixIn):
         ----------
         image: tmlib.image.ChannelImage
             pixels data that should be stored in the image file
+
+        Note
+        ----
+        Pixels are stored in chunks of the size of
+        :class:`PyramidTile <tmlib.image.PyramidTile>` objects, such that
+        regions of the image can be loaded efficiently.
         '''
+        chunks = tuple([
+            min(PyramidTile.TILE_SIZE, d) for d in image.dimensions
+        ])
         with DatasetWriter(self.location, truncate=True) as f:
-            f.write('array', image.array, compression=True)
+            f.write('array', image.array, compression=True, chunks=chunks)
 
     @hybrid_property
     def location(self):
@@ -0,0 +1,609 @@
+# TmLibrary - TissueMAPS library for distibuted image analysis routines.
+# Copyright (C) 2016  Markus D. Herrmann, University of Zurich and Robin Hafen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''Spatial arrangement of plates, wells and sites in the overview of an
+experiment at the maximum zoom level.
+
+The position of a :class:`Site <tmlib.models.site.Site>` depends on the
+position of its parent :class:`Well <tmlib.models.well.Well>`, which in turn
+depends on the position of its parent :class:`Plate <tmlib.models.plate.Plate>`
+and on the other wells of the plate. Calculating offsets via the
+*ORM* relationships of each individual site requires many round trips to the
+database. :class:`ExperimentLayout` instead loads all rows of the respective
+tables at once and calculates the offsets of all sites in a vectorized
+manner. :class:`ImageIndex` additionally maps the images of a
+:class:`ChannelLayer <tmlib.models.channel.ChannelLayer>` to the tiles at the
+base of the pyramid and to neighbouring images.
+'''
+import logging
+import itertools
+import numpy as np
+
+from tmlib.models.experiment import Experiment
+from tmlib.models.plate import Plate
+from tmlib.models.well import Well
+from tmlib.models.site import Site
+from tmlib.workflow.illuminati.stitch import guess_stitch_dimensions
+
+logger = logging.getLogger(__name__)
+
+
+def calculate_morton_code(y, x):
+    '''Calculates the position of grid coordinates along the Z-order
+    (Morton) curve by interleaving the bits of both coordinates, such that
+    coordinates within aligned square blocks of size 2^k are contiguous.
+
+    Parameters
+    ----------
+    y: numpy.ndarray[int]
+        non-negative row coordinates (smaller than 2^32)
+    x: numpy.ndarray[int]
+        non-negative column coordinates (smaller than 2^32)
+
+    Returns
+    -------
+    numpy.ndarray[numpy.uint64]
+        position of each coordinate along the curve
+    '''
+    def spread(values):
+        values = np.asarray(values).astype(np.uint64)
+        for shift, mask in [
+                (16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF),
+                (4, 0x0F0F0F0F0F0F0F0F), (2, 0x3333333333333333),
+                (1, 0x5555555555555555)]:
+            values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+        return values
+
+    return (spread(y) << np.uint64(1)) | spread(x)
+
+
+class ExperimentLayout(object):
+
+    '''Offsets and sizes of all sites of an experiment relative to the
+    layer overview at the maximum zoom level.
+
+    Sites are stored in order of their IDs and all attributes are arrays
+    with one element (or row) per site.
+    '''
+
+    def __init__(self, experiment, plates, wells, sites):
+        '''
+        Parameters
+        ----------
+        experiment: tmlib.models.experiment.Experiment
+            experiment
+        plates: List[tmlib.models.plate.Plate]
+            plates of `experiment` (only the attribute ``id`` is used)
+        wells: List[tmlib.models.well.Well]
+            wells of `plates` (only attributes ``id``, ``plate_id`` and
+            ``name`` are used)
+        sites: List[tmlib.models.site.Site]
+            sites of `wells` (only column attributes are used)
+        '''
+        self.vertical_site_displacement = \
+            experiment.vertical_site_displacement
+        self.horizontal_site_displacement = \
+            experiment.horizontal_site_displacement
+        self.well_spacer_size = experiment.well_spacer_size
+        self.plate_spacer_size = experiment.plate_spacer_size
+        displacement = np.array([
+            self.vertical_site_displacement, self.horizontal_site_displacement
+        ])
+
+        plate_ids = np.sort(np.array([p.id for p in plates], dtype=np.int64))
+        self.plate_ids = plate_ids
+
+        wells = sorted(wells, key=lambda w: w.id)
+        self.well_ids = np.array([w.id for w in wells], dtype=np.int64)
+        well_plate_index = np.searchsorted(
+            plate_ids, np.array([w.plate_id for w in wells], dtype=np.int64)
+        )
+        well_coordinates = np.array(
+            [Well.map_name_to_coordinate(w.name) for w in wells],
+            dtype=np.int64
+        ).reshape(-1, 2)
+
+        sites = sorted(sites, key=lambda s: s.id)
+        self.site_ids = np.array([s.id for s in sites], dtype=np.int64)
+        self.well_index = np.searchsorted(
+            self.well_ids,
+            np.array([s.well_id for s in sites], dtype=np.int64)
+        )
+        self.coordinates = np.array(
+            [(s.y, s.x) for s in sites], dtype=np.int64
+        ).reshape(-1, 2)
+        self.image_sizes = np.array(
+            [(s.height, s.width) for s in sites], dtype=np.int64
+        ).reshape(-1, 2)
+        self.omitted = np.array([bool(s.omitted) for s in sites], dtype=bool)
+        # Residues are given as top, bottom, left, right
+        self.residues = np.array([
+            (s.top_residue or 0, s.bottom_residue or 0,
+             s.left_residue or 0, s.right_residue or 0)
+            for s in sites
+        ], dtype=np.int64).reshape(-1, 4)
+
+        # Number of sites along each axis of a well
+        self.well_dimensions = np.zeros((len(wells), 2), dtype=np.int64)
+        np.maximum.at(
+            self.well_dimensions, self.well_index, self.coordinates + 1
+        )
+        site_sizes = np.zeros((len(wells), 2), dtype=np.int64)
+        np.maximum.at(site_sizes, self.well_index, self.image_sizes)
+        well_image_sizes = (
+            self.well_dimensions * site_sizes +
+            displacement * (self.well_dimensions - 1)
+        )
+
+        # Since wells are allowed to have different sizes, all wells of a
+        # plate are represented by the size of its largest well.
+        plate_well_sizes = np.zeros((len(plate_ids), 2), dtype=np.int64)
+        np.maximum.at(plate_well_sizes, well_plate_index, well_image_sizes)
+
+        # Empty rows and columns of a plate (where no well has been imaged)
+        # are skipped. The position of a well is thus given by its rank among
+        # the nonempty rows and columns of the plate.
+        well_ranks = np.zeros(well_coordinates.shape, dtype=np.int64)
+        plate_dimensions = np.zeros((len(plate_ids), 2), dtype=np.int64)
+        for axis in range(2):
+            n = np.max(well_coordinates[:, axis]) + 1 if len(wells) else 1
+            keys = well_plate_index * n + well_coordinates[:, axis]
+            unique_keys = np.unique(keys)
+            plate_starts = np.searchsorted(
+                unique_keys, np.arange(len(plate_ids) + 1) * n
+            )
+            well_ranks[:, axis] = (
+                np.searchsorted(unique_keys, keys) -
+                plate_starts[well_plate_index]
+            )
+            plate_dimensions[:, axis] = np.diff(plate_starts)
+        self.plate_image_sizes = (
+            plate_dimensions * plate_well_sizes +
+            self.well_spacer_size * (plate_dimensions - 1)
+        )
+
+        # Plates are arranged column-wise in order of their IDs.
+        self.plate_grid_shape = guess_stitch_dimensions(len(plate_ids))
+        plate_index = np.arange(len(plate_ids))
+        plate_coordinates = np.column_stack([
+            plate_index % self.plate_grid_shape[0],
+            plate_index // self.plate_grid_shape[0]
+        ])
+        self.plate_offsets = (
+            plate_coordinates * self.plate_image_sizes +
+            plate_coordinates * self.plate_spacer_size
+        )
+        # All wells of a plate have the same size (see above).
+        self.well_image_sizes = plate_well_sizes[well_plate_index]
+        self.well_offsets = (
+            well_ranks * self.well_image_sizes +
+            well_ranks * self.well_spacer_size +
+            self.plate_offsets[well_plate_index]
+        )
+        self.offsets = (
+            self.coordinates * self.image_sizes +
+            self.coordinates * displacement +
+            self.well_offsets[self.well_index]
+        )
+        self.neighbours = self._find_neighbours()
+
+    @classmethod
+    def load(cls, session):
+        '''Loads the layout of the experiment from the database.
+
+        Parameters
+        ----------
+        session: tmlib.models.utils.ExperimentSession
+            session for the experiment-specific database
+
+        Returns
+        -------
+        tmlib.models.layout.ExperimentLayout
+        '''
+        logger.debug('load layout of experiment')
+        experiment = session.query(Experiment).one()
+        plates = session.query(Plate.id).all()
+        wells = session.query(Well.id, Well.plate_id, Well.name).all()
+        sites = session.query(
+                Site.id, Site.well_id, Site.y, Site.x, Site.height,
+                Site.width, Site.omitted, Site.top_residue,
+                Site.bottom_residue, Site.left_residue, Site.right_residue
+            ).\
+            all()
+        return cls(experiment, plates, wells, sites)
+
+    def _find_neighbours(self):
+        '''Determines for each site the index of the sites within the same
+        well at the relative positions -1, 0 and +1 along both axes.
+
+        Returns
+        -------
+        numpy.ndarray[numpy.int64]
+            3D array with one 3x3 matrix per site; ``-1`` where there is no
+            neighbouring site
+        '''
+        shape = (
+            max(len(self.well_ids), 1),
+            np.max(self.coordinates[:, 0]) + 3 if len(self.site_ids) else 3,
+            np.max(self.coordinates[:, 1]) + 3 if len(self.site_ids) else 3
+        )
+        y = self.coordinates[:, 0] + 1
+        x = self.coordinates[:, 1] + 1
+        keys = np.ravel_multi_index((self.well_index, y, x), shape)
+        order = np.argsort(keys)
+        sorted_keys = keys[order]
+        neighbours = np.full((len(self.site_ids), 3, 3), -1, dtype=np.int64)
+        if len(self.site_ids) == 0:
+            return neighbours
+        for dy, dx in itertools.product([-1, 0, 1], [-1, 0, 1]):
+            k = np.ravel_multi_index((self.well_index, y + dy, x + dx), shape)
+            index = np.searchsorted(sorted_keys, k)
+            index[index == len(sorted_keys)] = 0
+            neighbours[:, dy + 1, dx + 1] = np.where(
+                sorted_keys[index] == k, order[index], -1
+            )
+        return neighbours
+
+    @property
+    def aligned_offsets(self):
+        '''numpy.ndarray[numpy.int64]: *y*, *x* coordinate of the top, left
+        corner of each site after alignment for shifts between cycles
+        '''
+        return self.offsets + self.residues[:, [0, 2]]
+
+    @property
+    def aligned_image_sizes(self):
+        '''numpy.ndarray[numpy.int64]: height and width of each site after
+        alignment for shifts between cycles
+        '''
+        return self.image_sizes - np.column_stack([
+            self.residues[:, 0] + self.residues[:, 1],
+            self.residues[:, 2] + self.residues[:, 3]
+        ])
+
+    @property
+    def image_size(self):
+        '''Tuple[int]: number of pixels along the vertical and horizontal
+        axis of the overview at the maximum zoom level
+
+        Note
+        ----
+        All plates are represented by the size of the largest plate.
+        '''
+        plate_size = np.max(self.plate_image_sizes, axis=0)
+        shape = np.array(self.plate_grid_shape)
+        return tuple(
+            int(v) for v in
+            plate_size * shape + (shape - 1) * self.plate_spacer_size
+        )
+
+    def get_site_index(self, site_ids):
+        '''Gets the position of sites in the arrays of the layout.
+
+        Parameters
+        ----------
+        site_ids: Union[int, numpy.ndarray[int]]
+            IDs of sites
+
+        Returns
+        -------
+        Union[int, numpy.ndarray[numpy.int64]]
+            index of each site
+
+        Raises
+        ------
+        KeyError
+            when a site is not part of the layout
+        '''
+        ids = np.atleast_1d(np.asarray(site_ids, dtype=np.int64))
+        index = np.searchsorted(self.site_ids, ids)
+        if (np.any(index >= len(self.site_ids)) or
+                np.any(self.site_ids[index] != ids)):
+            raise KeyError('Sites are not part of the layout.')
+        if np.ndim(site_ids) == 0:
+            return int(index[0])
+        return index
+
+    def get_offset(self, site_id):
+        '''Gets the offset of a site.
+
+        Parameters
+        ----------
+        site_id: int
+            ID of the site
+
+        Returns
+        -------
+        Tuple[int]
+            *y*, *x* coordinate of the top, left corner of the site
+
+        See also
+        --------
+        :attr:`tmlib.models.site.Site.offset`
+        '''
+        return tuple(int(v) for v in self.offsets[self.get_site_index(site_id)])
+
+    def get_aligned_offset(self, site_id):
+        '''Gets the offset of a site after alignment.
+
+        Parameters
+        ----------
+        site_id: int
+            ID of the site
+
+        Returns
+        -------
+        Tuple[int]
+            *y*, *x* coordinate of the top, left corner of the aligned site
+
+        See also
+        --------
+        :attr:`tmlib.models.site.Site.aligned_offset`
+        '''
+        index = self.get_site_index(site_id)
+        return tuple(int(v) for v in self.aligned_offsets[index])
+
+    def calculate_tile_ranges(self, tile_size):
+        '''Calculates the rows and columns of the tiles at the maximum zoom
+        level that intersect with each site.
+
+        Parameters
+        ----------
+        tile_size: int
+            number of pixels along each axis of a tile
+
+        Returns
+        -------
+        numpy.ndarray[numpy.int64]
+            first row, last row + 1, first column and last column + 1 for
+            each site
+        '''
+        displacement = np.array([
+            self.vertical_site_displacement, self.horizontal_site_displacement
+        ])
+        start = np.floor_divide(self.offsets, tile_size)
+        end = -np.floor_divide(
+            -(self.offsets + self.image_sizes - displacement), tile_size
+        )
+        return np.column_stack([start[:, 0], end[:, 0], start[:, 1], end[:, 1]])
+
+    def sort_sites(self, site_ids):
+        '''Sorts sites spatially, first by the position of their well in
+        the overview and then by their position within the well, both
+        along the Z-order curve (see :func:`calculate_morton_code`).
+        Consecutive sites thus form compact, mostly rectangular blocks within
+        wells.
+
+        Parameters
+        ----------
+        site_ids: List[int]
+            IDs of sites
+
+        Returns
+        -------
+        numpy.ndarray[numpy.int64]
+            order of `site_ids`
+        '''
+        index = self.get_site_index(np.asarray(site_ids, dtype=np.int64))
+        # Wells are enumerated by their rank among all distinct offsets.
+        well_grid = [
+            np.unique(self.well_offsets[:, axis], return_inverse=True)[1]
+            for axis in range(2)
+        ]
+        well_index = self.well_index[index]
+        well_codes = calculate_morton_code(
+            well_grid[0][well_index], well_grid[1][well_index]
+        )
+        site_codes = calculate_morton_code(
+            self.coordinates[index, 0], self.coordinates[index, 1]
+        )
+        return np.lexsort((site_codes, well_codes))
+
+
+class ImageIndex(object):
+
+    '''Array-backed spatial index of the images of a
+    :class:`ChannelLayer <tmlib.models.channel.ChannelLayer>`, which maps
+    tiles at the maximum zoom level to intersecting images and images to their
+    neighbours within the same well.
+
+    Images of omitted sites are not mapped to tiles.
+    '''
+
+    def __init__(self, layout, site_ids, image_file_ids, tile_size):
+        '''
+        Parameters
+        ----------
+        layout: tmlib.models.layout.ExperimentLayout
+            layout of the experiment
+        site_ids: List[int]
+            IDs of sites
+        image_file_ids: List[int]
+            IDs of the corresponding images
+            (:class:`ChannelImageFile <tmlib.models.file.ChannelImageFile>`)
+        tile_size: int
+            number of pixels along each axis of a tile
+        '''
+        self.layout = layout
+        self.tile_size = tile_size
+        site_ids = np.asarray(site_ids, dtype=np.int64)
+        image_file_ids = np.asarray(image_file_ids, dtype=np.int64)
+        # Image of each site of the layout, 0 if the site has no image.
+        self.image_file_ids = np.zeros(layout.site_ids.shape, dtype=np.int64)
+        self.image_file_ids[layout.get_site_index(site_ids)] = image_file_ids
+        order = np.argsort(image_file_ids)
+        self._sorted_image_file_ids = image_file_ids[order]
+        self._sorted_site_index = layout.get_site_index(site_ids[order])
+
+        self.tile_ranges = layout.calculate_tile_ranges(tile_size)
+        site_index = np.where(
+            (self.image_file_ids > 0) & np.logical_not(layout.omitted)
+        )[0]
+        ranges = self.tile_ranges[site_index]
+        n_rows = np.maximum(ranges[:, 1] - ranges[:, 0], 0)
+        n_cols = np.maximum(ranges[:, 3] - ranges[:, 2], 0)
+        counts = n_rows * n_cols
+        tile_site_index = np.repeat(site_index, counts)
+        position = (
+            np.arange(np.sum(counts)) -
+            np.repeat(np.cumsum(counts) - counts, counts)
+        )
+        n_cols = np.repeat(n_cols, counts)
+        tile_y = np.repeat(ranges[:, 0], counts) + position // n_cols
+        tile_x = np.repeat(ranges[:, 2], counts) + position % n_cols
+        self._n_columns = int(np.max(tile_x)) + 1 if len(tile_x) else 1
+        keys = tile_y * self._n_columns + tile_x
+        order = np.lexsort((self.image_file_ids[tile_site_index], keys))
+        self._tile_keys = keys[order]
+        self._tile_site_index = tile_site_index[order]
+
+    def _get_site_index(self, image_file_ids):
+        ids = np.atleast_1d(np.asarray(image_file_ids, dtype=np.int64))
+        index = np.searchsorted(self._sorted_image_file_ids, ids)
+        if (np.any(index >= len(self._sorted_image_file_ids)) or
+                np.any(self._sorted_image_file_ids[index] != ids)):
+            raise KeyError('Image files are not part of the index.')
+        if np.ndim(image_file_ids) == 0:
+            return self._sorted_site_index[index[0]]
+        return self._sorted_site_index[index]
+
+    @property
+    def coordinates(self):
+        '''List[Tuple[int]]: *y*, *x* coordinate of each tile at the maximum
+        zoom level that intersects with at least one image
+        '''
+        keys = np.unique(self._tile_keys)
+        return zip(
+            (keys // self._n_columns).tolist(),
+            (keys % self._n_columns).tolist()
+        )
+
+    def get_image_file_ids(self, y, x):
+        '''Gets the images that intersect with a tile.
+
+        Parameters
+        ----------
+        y: int
+            row index of the tile at the maximum zoom level
+        x: int
+            column index of the tile at the maximum zoom level
+
+        Returns
+        -------
+        List[int]
+            IDs of images
+        '''
+        if x < 0 or x >= self._n_columns:
+            return list()
+        key = y * self._n_columns + x
+        start, end = np.searchsorted(self._tile_keys, [key, key + 1])
+        index = self._tile_site_index[start:end]
+        return self.image_file_ids[index].tolist()
+
+    def get_tile_ranges(self, image_file_id):
+        '''Gets the tiles that intersect with an image.
+
+        Parameters
+        ----------
+        image_file_id: int
+            ID of the image
+
+        Returns
+        -------
+        Tuple[List[int]]
+            row and column indices of tiles at the maximum zoom level
+        '''
+        y0, y1, x0, x1 = self.tile_ranges[self._get_site_index(image_file_id)]
+        return (range(y0, y1), range(x0, x1))
+
+    def get_neighbour(self, image_file_id, y, x):
+        '''Gets a neighbouring image within the same well.
+
+        Parameters
+        ----------
+        image_file_id: int
+            ID of the image
+        y: int
+            relative position of the neighbour along the vertical axis
+            (``-1``, ``0`` or ``1``)
+        x: int
+            relative position of the neighbour along the horizontal axis
+            (``-1``, ``0`` or ``1``)
+
+        Returns
+        -------
+        int
+            ID of the neighbouring image or ``None`` if there is no such
+            image
+        '''
+        index = self._get_site_index(image_file_id)
+        neighbour = self.layout.neighbours[index, y + 1, x + 1]
+        if neighbour < 0 or self.image_file_ids[neighbour] == 0:
+            return None
+        return int(self.image_file_ids[neighbour])
+
+    def get_overlapping_neighbours(self, image_file_ids):
+        '''Gets the neighbouring images at the upper left, upper and left
+        border of images, which share tiles at the maximum zoom level with
+        the respective image. Pixels of these images are required for
+        creating the tiles of the images.
+
+        Parameters
+        ----------
+        image_file_ids: List[int]
+            IDs of images
+
+        Returns
+        -------
+        numpy.ndarray[numpy.int64]
+            IDs of the upper left, upper and left neighbour of each image;
+            ``0`` where the neighbour doesn't exist or doesn't share a tile
+        '''
+        site_index = self._get_site_index(
+            np.asarray(image_file_ids, dtype=np.int64)
+        )
+        ranges = self.tile_ranges
+        neighbours = np.zeros((len(site_index), 3), dtype=np.int64)
+        for i, (y, x) in enumerate([(-1, -1), (-1, 0), (0, -1)]):
+            index = self.layout.neighbours[site_index, y + 1, x + 1]
+            is_valid = index >= 0
+            index[~is_valid] = 0
+            is_valid &= np.logical_not(self.layout.omitted[index])
+            if y < 0:
+                is_valid &= ranges[index, 1] > ranges[site_index, 0]
+            if x < 0:
+                is_valid &= ranges[index, 3] > ranges[site_index, 2]
+            neighbours[:, i] = np.where(
+                is_valid, self.image_file_ids[index], 0
+            )
+        return neighbours
+
+    def to_dict(self):
+        '''Maps coordinates of tiles to intersecting images.
+
+        Returns
+        -------
+        Dict[Tuple[int], List[int]]
+            IDs of images hashable by *y*, *x* coordinate of tiles at the
+            maximum zoom level
+        '''
+        keys, starts = np.unique(self._tile_keys, return_index=True)
+        ids = np.split(
+            self.image_file_ids[self._tile_site_index], starts[1:]
+        )
+        return {
+            (int(k // self._n_columns), int(k % self._n_columns)): v.tolist()
+            for k, v in zip(keys, ids)
+        }
@@ -24,11 +24,13 @@ from cStringIO import StringIO
 from sqlalchemy import func, case
 from geoalchemy2 import Geometry
 from geoalchemy2.shape import to_shape
+from shapely import wkb
 from sqlalchemy.orm import Session
 from sqlalchemy import (
     Column, String, Integer, BigInteger, Boolean, ForeignKey, not_, Index,
     UniqueConstraint, PrimaryKeyConstraint, ForeignKeyConstraint
 )
+from sqlalchemy.dialects.postgresql import FLOAT
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.ext.hybrid import hybrid_property
 
@@ -41,10 +43,16 @@ from tmlib.models.base import (
 from tmlib.models.feature import Feature, FeatureValues
 from tmlib.models.types import ST_SimplifyPreserveTopology
 from tmlib.models.site import Site
+from tmlib.models.utils import MemoryCache
+from tmlib.models import mvt
 from tmlib.utils import autocreate_directory_property, create_partitions
 
 logger = logging.getLogger(__name__)
 
+#: tmlib.models.utils.MemoryCache: GeoJSON and vector tile representations of
+#: mapobjects within tiles of segmentation layers
+_segmentation_cache = MemoryCache('segmentation_cache_size')
+
 
 class MapobjectType(ExperimentModel, IdMixIn):
 
@@ -254,28 +262,39 @@ class MapobjectType(ExperimentModel, IdMixIn):
         Returns
         -------
         pandas.DataFrame[numpy.float]
-            feature values for each mapobject
+            feature values for each mapobject, where columns are named after
+            features
+
+        Note
+        ----
+        Values are read from
+        :attr:`FeatureValues.value_array <tmlib.models.feature.FeatureValues.value_array>`
+        for features with a column index and from
+        :attr:`FeatureValues.values <tmlib.models.feature.FeatureValues.values>`
+        otherwise or for rows without values in columnar format.
         '''
         session = Session.object_session(self)
 
-        features = session.query(Feature.id, Feature.name).\
+        features = session.query(
+                Feature.id, Feature.name, Feature.column_index
+            ).\
             filter_by(mapobject_type_id=self.id)
         if feature_ids is not None:
             features = features.filter(Feature.id.in_(feature_ids))
-        features = features.all()
-        feature_map = {str(id): name for id, name in features}
-
-        if feature_ids is not None:
-            records = session.query(
-                FeatureValues.mapobject_id,
-                FeatureValues.values.slice(feature_map.keys()).label('values')
-            )
-        else:
-            records = session.query(
-                FeatureValues.mapobject_id,
-                FeatureValues.values
-            )
-        records = records.\
+        features = features.order_by(Feature.id).all()
+
+        columns = list()
+        for f in features:
+            value = FeatureValues.values[str(f.id)].cast(FLOAT)
+            if f.column_index is not None:
+                # Rows without values in columnar format fall back to hstore.
+                # NOTE: Arrays are one-based in PostgreSQL.
+                value = func.coalesce(
+                    FeatureValues.value_array[f.column_index + 1], value
+                )
+            columns.append(value)
+
+        records = session.query(FeatureValues.mapobject_id, *columns).\
             join(Mapobject).\
             join(MapobjectSegmentation).\
             filter(
@@ -285,10 +304,12 @@ class MapobjectType(ExperimentModel, IdMixIn):
             ).\
             order_by(Mapobject.id).\
             all()
-        values = [r.values for r in records]
+        values = [r[1:] for r in records]
         mapobject_ids = [r.mapobject_id for r in records]
-        df = pd.DataFrame(values, index=mapobject_ids)
-        df.rename(columns=feature_map, inplace=True)
+        df = pd.DataFrame(
+            values, index=mapobject_ids, columns=[f.name for f in features],
+            dtype=float
+        )
 
         return df
 
@@ -565,6 +586,80 @@ class Mapobject(DistributedExperimentModel):
             )
             cls._delete_cascade(connection, missing_ids)
 
+    @classmethod
+    def delete_invalid_objects_per_partition(cls, connection, shard_ids,
+            partition_key, mapobject_type_id, check_feature_values=True):
+        '''Deletes all instances of a given type within a given partition
+        that have a missing or invalid
+        :class:`MapobjectSegmentation <tmlib.models.mapobject.MapobjectSegmentation>`
+        or missing :class:`FeatureValues <tmlib.models.feature.FeatureValues>`
+        as well as their "children" instances.
+
+        Parameters
+        ----------
+        connection: tmlib.models.utils.ExperimentWorkerConnection
+            experiment-specific database connection to the worker server
+            that holds the shards of the partition
+        shard_ids: Dict[str, int]
+            ID of the shard that holds the partition for each of the tables
+            "mapobjects", "mapobject_segmentations" and "feature_values"
+            (see :meth:`locate_partitions <tmlib.models.utils.ExperimentConnection.locate_partitions>`)
+        partition_key: int
+            value of the distribution column
+        mapobject_type_id: int
+            ID of the parent
+            :class:`MapobjectType <tmlib.models.mapobject.MapobjectType>`
+        check_feature_values: bool, optional
+            whether instances without feature values should be deleted;
+            should only be used when the type has any features, otherwise all
+            instances would be deleted (default: ``True``)
+
+        Returns
+        -------
+        int
+            number of deleted instances
+
+        Note
+        ----
+        DELETE queries with subqueries are not supported for distributed
+        tables. Objects are therefore deleted via an anti-join directly on
+        the shards, which are colocated on the same worker server, such that
+        the IDs of the objects never need to be transferred to the client.
+        '''
+        sql = '''
+            DELETE FROM mapobjects_{mapobjects} AS m
+            WHERE m.partition_key = %(partition_key)s
+            AND m.mapobject_type_id = %(mapobject_type_id)s
+            AND (
+                NOT EXISTS (
+                    SELECT 1
+                    FROM mapobject_segmentations_{mapobject_segmentations} AS s
+                    WHERE s.partition_key = %(partition_key)s
+                    AND s.mapobject_id = m.id
+                )
+                OR EXISTS (
+                    SELECT 1
+                    FROM mapobject_segmentations_{mapobject_segmentations} AS s
+                    WHERE s.partition_key = %(partition_key)s
+                    AND s.mapobject_id = m.id
+                    AND NOT ST_IsValid(s.geom_polygon)
+                )
+        '''
+        if check_feature_values:
+            sql += '''
+                OR NOT EXISTS (
+                    SELECT 1 FROM feature_values_{feature_values} AS v
+                    WHERE v.partition_key = %(partition_key)s
+                    AND v.mapobject_id = m.id
+                )
+            '''
+        sql += ')'
+        connection.execute(sql.format(**shard_ids), {
+            'partition_key': partition_key,
+            'mapobject_type_id': mapobject_type_id
+        })
+        return connection.rowcount
+
     @classmethod
     def _add(cls, connection, instance):
         if not isinstance(instance, cls):
@@ -662,10 +757,12 @@ class MapobjectSegmentation(DistributedExperimentModel):
         ----------
         partition_key: int
             key that determines on which shard the object will be stored
-        geom_polygon: shapely.geometry.polygon.Polygon
-            polygon geometry of the mapobject contour
-        geom_centroid: shapely.geometry.point.Point
-            point geometry of the mapobject centroid
+        geom_polygon: Union[shapely.geometry.polygon.Polygon, str]
+            polygon geometry of the mapobject contour or its EWKT
+            representation
+        geom_centroid: Union[shapely.geometry.point.Point, str]
+            point geometry of the mapobject centroid or its EWKT
+            representation
         mapobject_id: int
             ID of parent :class:`Mapobject <tmlib.models.mapobject.Mapobject>`
         segmentation_layer_id: int
@@ -675,8 +772,8 @@ class MapobjectSegmentation(DistributedExperimentModel):
             label assigned to the segmented object
         '''
         self.partition_key = partition_key
-        self.geom_polygon = getattr(geom_polygon, 'wkt', None)
-        self.geom_centroid = geom_centroid.wkt
+        self.geom_polygon = getattr(geom_polygon, 'wkt', geom_polygon)
+        self.geom_centroid = getattr(geom_centroid, 'wkt', geom_centroid)
         self.mapobject_id = mapobject_id
         self.segmentation_layer_id = segmentation_layer_id
         self.label = label
@@ -742,6 +839,191 @@ class MapobjectSegmentation(DistributedExperimentModel):
         )
 
 
+class SimplifiedMapobjectSegmentation(DistributedExperimentModel):
+
+    '''A simplified polygon of a
+    :class:`MapobjectSegmentation <tmlib.models.mapobject.MapobjectSegmentation>`
+    for visualization at a given zoom level, which is precomputed to avoid
+    simplifying polygons upon each tile request.
+
+    See also
+    --------
+    :meth:`SegmentationLayer.get_segmentations <tmlib.models.mapobject.SegmentationLayer.get_segmentations>`
+    '''
+
+    __tablename__ = 'simplified_mapobject_segmentations'
+
+    __table_args__ = (
+        PrimaryKeyConstraint(
+            'mapobject_id', 'partition_key', 'segmentation_layer_id', 'zoom'
+        ),
+        ForeignKeyConstraint(
+            ['mapobject_id', 'partition_key'],
+            ['mapobjects.id', 'mapobjects.partition_key'],
+            ondelete='CASCADE'
+        )
+    )
+
+    __distribution_method__ = 'hash'
+
+    __distribute_by__ = 'partition_key'
+
+    __colocate_with__ = 'mapobjects'
+
+    partition_key = Column(Integer, nullable=False)
+
+    #: str: EWKT POLYGON geometry
+    geom_polygon = Column(Geometry('POLYGON'), nullable=False)
+
+    #: int: ID of parent mapobject
+    mapobject_id = Column(BigInteger)
+
+    #: int: ID of parent segmentation layer
+    segmentation_layer_id = Column(Integer)
+
+    #: int: zoom level for which the polygon was simplified
+    zoom = Column(Integer)
+
+    def __init__(self, partition_key, geom_polygon, mapobject_id,
+            segmentation_layer_id, zoom):
+        '''
+        Parameters
+        ----------
+        partition_key: int
+            key that determines on which shard the object will be stored
+        geom_polygon: shapely.geometry.polygon.Polygon
+            simplified polygon geometry of the mapobject contour
+        mapobject_id: int
+            ID of parent :class:`Mapobject <tmlib.models.mapobject.Mapobject>`
+        segmentation_layer_id: int
+            ID of parent
+            :class:`SegmentationLayer <tmlib.models.layer.SegmentationLayer>`
+        zoom: int
+            zoom level for which the polygon was simplified
+        '''
+        self.partition_key = partition_key
+        self.geom_polygon = geom_polygon.wkt
+        self.mapobject_id = mapobject_id
+        self.segmentation_layer_id = segmentation_layer_id
+        self.zoom = zoom
+
+    @classmethod
+    def _add(cls, connection, instance):
+        if not isinstance(instance, cls):
+            raise TypeError('Object must have type %s' % cls.__name__)
+        connection.execute('''
+            INSERT INTO simplified_mapobject_segmentations AS s (
+                partition_key, mapobject_id, segmentation_layer_id, zoom,
+                geom_polygon
+            )
+            VALUES (
+                %(partition_key)s, %(mapobject_id)s, %(segmentation_layer_id)s,
+                %(zoom)s, %(geom_polygon)s
+            )
+            ON CONFLICT
+            ON CONSTRAINT simplified_mapobject_segmentations_pkey
+            DO UPDATE
+            SET geom_polygon = %(geom_polygon)s
+        ''', {
+            'partition_key': instance.partition_key,
+            'mapobject_id': instance.mapobject_id,
+            'segmentation_layer_id': instance.segmentation_layer_id,
+            'zoom': instance.zoom,
+            'geom_polygon': instance.geom_polygon
+        })
+
+    @classmethod
+    def _bulk_ingest(cls, connection, instances):
+        if not instances:
+            return
+        f = StringIO()
+        w = csv.writer(f, delimiter=';')
+        for obj in instances:
+            if not isinstance(obj, cls):
+                raise TypeError('Object must have type %s' % cls.__name__)
+            w.writerow((
+                obj.partition_key, obj.geom_polygon, obj.mapobject_id,
+                obj.segmentation_layer_id, obj.zoom
+            ))
+        columns = (
+            'partition_key', 'geom_polygon', 'mapobject_id',
+            'segmentation_layer_id', 'zoom'
+        )
+        f.seek(0)
+        connection.copy_from(
+            f, cls.__table__.name, sep=';', columns=columns, null=''
+        )
+        f.close()
+
+    @classmethod
+    def create_per_partition(cls, connection, partition_key,
+            segmentation_layer_id, min_zoom, max_zoom):
+        '''Simplifies polygons of all mapobjects of a given
+        :class:`SegmentationLayer <tmlib.models.mapobject.SegmentationLayer>`
+        within a given partition for each zoom level and replaces previously
+        simplified polygons.
+
+        Parameters
+        ----------
+        connection: tmlib.models.utils.ExperimentConnection
+            experiment-specific database connection
+        partition_key: int
+            value of the distribution column
+        segmentation_layer_id: int
+            ID of the segmentation layer
+        min_zoom: int
+            lowest zoom level at which polygons are visualized
+        max_zoom: int
+            maximal zoom level of the pyramid
+
+        Returns
+        -------
+        int
+            number of created polygons
+
+        See also
+        --------
+        :meth:`SegmentationLayer.get_simplification_tolerance <tmlib.models.mapobject.SegmentationLayer.get_simplification_tolerance>`
+        '''
+        params = {
+            'partition_key': partition_key,
+            'segmentation_layer_id': segmentation_layer_id,
+            'min_zoom': min_zoom,
+            'max_zoom': max_zoom
+        }
+        connection.execute('''
+            DELETE FROM simplified_mapobject_segmentations
+            WHERE partition_key = %(partition_key)s
+            AND segmentation_layer_id = %(segmentation_layer_id)s
+        ''', params)
+        # NOTE: The tolerance must be consistent with
+        # SegmentationLayer.get_simplification_tolerance().
+        connection.execute('''
+            INSERT INTO simplified_mapobject_segmentations (
+                partition_key, mapobject_id, segmentation_layer_id, zoom,
+                geom_polygon
+            )
+            SELECT
+                s.partition_key, s.mapobject_id, s.segmentation_layer_id,
+                z.zoom,
+                ST_SimplifyPreserveTopology(
+                    s.geom_polygon, (%(max_zoom)s - z.zoom) ^ 2 + 1
+                )
+            FROM mapobject_segmentations AS s,
+            generate_series(%(min_zoom)s, %(max_zoom)s) AS z (zoom)
+            WHERE s.partition_key = %(partition_key)s
+            AND s.segmentation_layer_id = %(segmentation_layer_id)s
+            AND s.geom_polygon IS NOT NULL
+        ''', params)
+        return connection.rowcount
+
+    def __repr__(self):
+        return '<%s(mapobject_id=%r, segmentation_layer_id=%r, zoom=%r)>' % (
+            self.__class__.__name__, self.mapobject_id,
+            self.segmentation_layer_id, self.zoom
+        )
+
+
 class SegmentationLayer(ExperimentModel, IdMixIn):
 
     __tablename__ = 'segmentation_layers'
@@ -762,6 +1044,15 @@ class SegmentationLayer(ExperimentModel, IdMixIn):
     #: int: zoom level threshold below which centroids will not be visualized
     centroid_thresh = Column(Integer)
 
+    #: bool: whether simplified polygons have been precomputed for each zoom
+    #: level at which polygons are visualized
+    #: (see :class:`SimplifiedMapobjectSegmentation <tmlib.models.mapobject.SimplifiedMapobjectSegmentation>`)
+    has_simplified_polygons = Column(Boolean, default=False)
+
+    #: int: number of times the representation of the layer on the map has
+    #: been updated
+    revision = Column(Integer, default=0)
+
     #: int: ID of parent channel
     mapobject_type_id = Column(
         Integer,
@@ -879,6 +1170,26 @@ class SegmentationLayer(ExperimentModel, IdMixIn):
         centroid_thresh = 0 if centroid_thresh < 0 else centroid_thresh
         return (polygon_thresh, centroid_thresh)
 
+    @staticmethod
+    def get_simplification_tolerance(z, maxzoom):
+        '''Calculates the tolerance for simplification of polygons that
+        should be visualized at a given zoom level.
+
+        Parameters
+        ----------
+        z: int
+            zero-based zoom level index
+        maxzoom: int
+            maximal zoom level of the pyramid
+
+        Returns
+        -------
+        int
+            maximal distance in pixels between points on the contour of
+            original and simplified polygons
+        '''
+        return (maxzoom - z) ** 2 + 1
+
     def get_segmentations(self, x, y, z, tolerance=2):
         '''Get outlines of each
         :class:`Mapobject <tmlib.models.mapobject.Mapobject>`
@@ -912,11 +1223,121 @@ class SegmentationLayer(ExperimentModel, IdMixIn):
         `polygon_thresh` < *z* < `centroid_thresh`,
         mapobjects are represented by points and if *z* < `centroid_thresh`
         they are not represented at all.
+        Polygons precomputed in the "collect" phase of the ``jterator`` step
+        are used if available
+        (see :class:`SimplifiedMapobjectSegmentation <tmlib.models.mapobject.SimplifiedMapobjectSegmentation>`)
+        and results are cached in memory per tile
+        (see :attr:`segmentation_cache_size <tmlib.config.LibraryConfig.segmentation_cache_size>`).
         '''
         logger.debug('get mapobject outlines falling into tile')
-        session = Session.object_session(self)
+        experiment = self.mapobject_type.experiment
+        key = (experiment.id, self.id, x, y, z, 'geojson')
+        # The revision changes whenever the representation of the layer
+        # gets recomputed.
+        revision = self.revision or 0
+        outlines = _segmentation_cache.get(key, revision)
+        if outlines is not None:
+            logger.debug('use cached outlines')
+            return outlines
+
+        maxzoom = experiment.pyramid_depth - 1
+        outlines = self._query_tile(
+            x, y, z, maxzoom, lambda geometry: geometry.ST_AsGeoJSON()
+        )
+        if outlines is None:
+            return list()
+        outlines = [tuple(o) for o in outlines]
+        # Approximate memory footprint of the tuples and strings
+        size = sum([len(o[1]) + 128 for o in outlines])
+        _segmentation_cache.put(key, outlines, size, revision)
+        return outlines
+
+    def get_vector_tile(self, x, y, z):
+        '''Get outlines of each
+        :class:`Mapobject <tmlib.models.mapobject.Mapobject>`
+        contained by a given pyramid tile encoded as
+        `Mapbox Vector Tile <https://github.com/mapbox/vector-tile-spec/tree/master/2.1>`_.
+
+        Parameters
+        ----------
+        x: int
+            zero-based column map coordinate at the given `z` level
+        y: int
+            zero-based row map coordinate at the given `z` level
+        z: int
+            zero-based zoom level index
+
+        Returns
+        -------
+        str
+            Protocol Buffers encoded tile with a single layer named after the
+            parent :class:`MapobjectType <tmlib.models.mapobject.MapobjectType>`,
+            where IDs of features are mapobject IDs and coordinates are
+            quantized to :const:`EXTENT <tmlib.models.mvt.EXTENT>` units
+            relative to the top left corner of the tile
+
+        Note
+        ----
+        Objects are represented the same way as by
+        :meth:`get_segmentations <tmlib.models.mapobject.SegmentationLayer.get_segmentations>`,
+        i.e. according to `polygon_thresh` and `centroid_thresh`.
+        '''
+        logger.debug('get vector tile of mapobject outlines')
+        experiment = self.mapobject_type.experiment
+        key = (experiment.id, self.id, x, y, z, 'mvt')
+        revision = self.revision or 0
+        tile = _segmentation_cache.get(key, revision)
+        if tile is not None:
+            logger.debug('use cached vector tile')
+            return tile
+
+        maxzoom = experiment.pyramid_depth - 1
+        minx, miny, maxx, maxy = self.get_tile_bounding_box(x, y, z, maxzoom)
+        factor = float(mvt.EXTENT) / (maxx - minx)
+
+        def encode(geometry):
+            # Transform map coordinates into tile coordinates, where the
+            # y-axis points downwards.
+            return func.ST_AsBinary(
+                func.ST_TransScale(geometry, -minx, -miny, factor, -factor)
+            )
+
+        outlines = self._query_tile(x, y, z, maxzoom, encode)
+        if outlines is None:
+            outlines = list()
+        tile = mvt.encode_vector_tile(
+            self.mapobject_type.name,
+            ((mapobject_id, wkb.loads(bytes(geometry)))
+             for mapobject_id, geometry in outlines)
+        )
+        _segmentation_cache.put(key, tile, len(tile), revision)
+        return tile
+
+    def _query_tile(self, x, y, z, maxzoom, encode):
+        '''Selects geometries of mapobjects that intersect with a given
+        pyramid tile in the representation appropriate for the zoom level.
 
-        maxzoom = self.mapobject_type.experiment.pyramid_depth - 1
+        Parameters
+        ----------
+        x: int
+            zero-based column map coordinate at the given `z` level
+        y: int
+            zero-based row map coordinate at the given `z` level
+        z: int
+            zero-based zoom level index
+        maxzoom: int
+            maximal zoom level of the pyramid
+        encode: function
+            function that receives the SQL expression of the geometry and
+            returns the SQL expression of the selected column
+
+        Returns
+        -------
+        Union[List[Tuple[int, object]], None]
+            mapobject ID and encoded geometry of each selected mapobject or
+            ``None`` if objects are not represented at the given zoom level
+        '''
+        session = Session.object_session(self)
         minx, miny, maxx, maxy = self.get_tile_bounding_box(x, y, z, maxzoom)
         tile = (
             'POLYGON(('
@@ -927,32 +1348,34 @@ class SegmentationLayer(ExperimentModel, IdMixIn):
 
         do_simplify = self.centroid_thresh <= z < self.polygon_thresh
         do_nothing = z < self.centroid_thresh
+        filters = list()
         if do_nothing:
             logger.debug('dont\'t represent objects')
-            return list()
+            return None
         elif do_simplify:
             logger.debug('represent objects by centroids')
-            query = session.query(
-                MapobjectSegmentation.mapobject_id,
-                MapobjectSegmentation.geom_centroid.ST_AsGeoJSON()
-            )
-            outlines = query.filter(
-                MapobjectSegmentation.segmentation_layer_id == self.id,
-                MapobjectSegmentation.geom_centroid.ST_Intersects(tile)
-            ).\
-            all()
+            model = MapobjectSegmentation
+            geometry = model.geom_centroid
+            extent = model.geom_centroid
+        elif self.has_simplified_polygons and z <= maxzoom:
+            logger.debug('represent objects by precomputed polygons')
+            model = SimplifiedMapobjectSegmentation
+            geometry = model.geom_polygon
+            extent = model.geom_polygon
+            filters.append(model.zoom == z)
         else:
             logger.debug('represent objects by polygons')
-            tolerance = (maxzoom - z) ** 2 + 1
+            tolerance = self.get_simplification_tolerance(z, maxzoom)
             logger.debug('simplify polygons using tolerance %d', tolerance)
-            query = session.query(
-                MapobjectSegmentation.mapobject_id,
-                MapobjectSegmentation.geom_polygon.
-                ST_SimplifyPreserveTopology(tolerance).ST_AsGeoJSON()
-            )
-            outlines = query.filter(
-                MapobjectSegmentation.segmentation_layer_id == self.id,
-                MapobjectSegmentation.geom_polygon.ST_Intersects(tile)
+            model = MapobjectSegmentation
+            geometry = model.geom_polygon.ST_SimplifyPreserveTopology(tolerance)
+            extent = model.geom_polygon
+
+        outlines = session.query(model.mapobject_id, encode(geometry)).\
+            filter(
+                model.segmentation_layer_id == self.id,
+                extent.ST_Intersects(tile),
+                *filters
             ).\
             all()
 
@@ -961,7 +1384,6 @@ class SegmentationLayer(ExperimentModel, IdMixIn):
                 'no outlines found for objects of type "%s" within tile: '
                 'x=%d, y=%d, z=%d', self.mapobject_type.name, x, y, z
             )
-
         return outlines
 
     def __repr__(self):
@@ -0,0 +1,215 @@
+# TmLibrary - TissueMAPS library for distibuted image analysis routines.
+# Copyright (C) 2016  Markus D. Herrmann, University of Zurich and Robin Hafen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''Encoding of geometries as
+`Mapbox Vector Tile <https://github.com/mapbox/vector-tile-spec/tree/master/2.1>`_
+(MVT).
+
+Tiles are encoded directly as Protocol Buffers messages, which only requires
+a few wire types, such that no additional dependencies are needed.
+'''
+import logging
+import numpy as np
+from shapely.geometry import Point, Polygon, MultiPolygon
+
+logger = logging.getLogger(__name__)
+
+#: int: default number of units along each axis of a tile
+EXTENT = 4096
+
+_POINT = 1
+_POLYGON = 3
+
+_MOVE_TO = 1
+_LINE_TO = 2
+_CLOSE_PATH = 7
+
+
+def _encode_varint(value):
+    '''Encodes a non-negative integer as Protocol Buffers "varint".'''
+    buf = bytearray()
+    while value > 0x7f:
+        buf.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buf.append(value)
+    return bytes(buf)
+
+
+def _encode_varints(values):
+    '''Encodes an array of non-negative integers smaller than 2^32 as
+    concatenated Protocol Buffers "varints".
+    '''
+    values = np.asarray(values, dtype=np.uint32).astype(np.int64)
+    n_bytes = np.ones(values.shape, dtype=np.int64)
+    for i in range(1, 5):
+        n_bytes += values >= (1 << (7 * i))
+    offsets = np.cumsum(n_bytes) - n_bytes
+    buf = np.zeros((np.sum(n_bytes), ), dtype=np.uint8)
+    for i in range(np.max(n_bytes) if len(values) > 0 else 0):
+        index = np.where(n_bytes > i)[0]
+        byte = (values[index] >> (7 * i)) & 0x7f
+        has_more = n_bytes[index] > i + 1
+        buf[offsets[index] + i] = byte | (has_more * 0x80)
+    return buf.tostring()
+
+
+def _encode_field(number, payload):
+    '''Encodes a length-delimited field.'''
+    return (
+        _encode_varint((number << 3) | 2) + _encode_varint(len(payload)) +
+        payload
+    )
+
+
+def _zigzag(values):
+    return (values << 1) ^ (values >> 63)
+
+
+def _command(command_id, count):
+    return (command_id & 0x7) | (count << 3)
+
+
+def _encode_ring(coords, cursor, is_exterior):
+    '''Builds commands for a closed ring of a polygon.
+
+    Parameters
+    ----------
+    coords: numpy.ndarray[numpy.int64]
+        integer coordinates of the ring, where the last point equals the first
+    cursor: numpy.ndarray[numpy.int64]
+        current position of the cursor
+    is_exterior: bool
+        whether the ring is the exterior ring of the polygon
+
+    Returns
+    -------
+    Tuple[numpy.ndarray[numpy.int64]]
+        commands and new position of the cursor
+    '''
+    coords = coords[:-1]
+    # Remove repeated points, which may result from rounding.
+    is_repeated = np.all(coords[1:] == coords[:-1], axis=1)
+    coords = coords[np.concatenate([[True], ~is_repeated])]
+    if len(coords) > 1 and np.all(coords[-1] == coords[0]):
+        coords = coords[:-1]
+    if len(coords) < 3:
+        return (None, cursor)
+    # Exterior rings must have positive area in tile coordinates, where the
+    # y-axis points downwards, and interior rings negative area.
+    x = coords[:, 0]
+    y = coords[:, 1]
+    area = np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y)
+    if area == 0:
+        return (None, cursor)
+    if (area > 0) != is_exterior:
+        coords = coords[::-1]
+    deltas = np.diff(np.vstack([cursor, coords]), axis=0)
+    params = _zigzag(deltas).ravel()
+    commands = np.concatenate([
+        [_command(_MOVE_TO, 1)], params[:2],
+        [_command(_LINE_TO, len(coords) - 1)], params[2:],
+        [_command(_CLOSE_PATH, 1)]
+    ])
+    return (commands, coords[-1])
+
+
+def _encode_geometry(geometry):
+    '''Builds commands for a geometry in tile coordinates.
+
+    Parameters
+    ----------
+    geometry: shapely.geometry.base.BaseGeometry
+        point, polygon or multi-polygon
+
+    Returns
+    -------
+    Tuple[Union[int, numpy.ndarray[numpy.int64]]]
+        geometry type and commands; ``None`` if the geometry degenerates
+        upon rounding of coordinates
+    '''
+    if isinstance(geometry, Point):
+        x, y = np.round(geometry.coords[0]).astype(np.int64)
+        return (
+            _POINT,
+            np.array([_command(_MOVE_TO, 1), _zigzag(x), _zigzag(y)])
+        )
+    if isinstance(geometry, Polygon):
+        polygons = [geometry]
+    elif isinstance(geometry, MultiPolygon):
+        polygons = list(geometry.geoms)
+    else:
+        raise TypeError(
+            'Geometry of type "%s" is not supported.' % geometry.geom_type
+        )
+    cursor = np.zeros((2, ), dtype=np.int64)
+    commands = list()
+    for polygon in polygons:
+        rings = [(polygon.exterior, True)]
+        rings.extend([(r, False) for r in polygon.interiors])
+        for ring, is_exterior in rings:
+            coords = np.round(np.array(ring.coords)[:, :2]).astype(np.int64)
+            ring_commands, cursor = _encode_ring(coords, cursor, is_exterior)
+            if ring_commands is None:
+                if is_exterior:
+                    break
+                continue
+            commands.append(ring_commands)
+    if not commands:
+        return None
+    return (_POLYGON, np.concatenate(commands))
+
+
+def encode_vector_tile(layer_name, features, extent=EXTENT):
+    '''Encodes geometries as a vector tile with a single layer.
+
+    Parameters
+    ----------
+    layer_name: str
+        name of the layer
+    features: Iterable[Tuple[int, shapely.geometry.base.BaseGeometry]]
+        ID and geometry of each feature, where coordinates are relative to
+        the top left corner of the tile, the *y*-axis points downwards and
+        the tile spans `extent` units along each axis
+    extent: int, optional
+        number of units along each axis of the tile (default:
+        :const:`EXTENT <tmlib.models.mvt.EXTENT>`)
+
+    Returns
+    -------
+    str
+        Protocol Buffers encoded tile
+
+    Note
+    ----
+    Coordinates are rounded to integers. Geometries that degenerate upon
+    rounding are omitted.
+    '''
+    layer = [
+        _encode_varint((15 << 3) | 0) + _encode_varint(2),  # version
+        _encode_field(1, layer_name.encode('utf-8')),  # name
+    ]
+    for feature_id, geometry in features:
+        encoded = _encode_geometry(geometry)
+        if encoded is None:
+            continue
+        geometry_type, commands = encoded
+        feature = (
+            _encode_varint((1 << 3) | 0) + _encode_varint(feature_id) +
+            _encode_varint((3 << 3) | 0) + _encode_varint(geometry_type) +
+            _encode_field(4, _encode_varints(commands))
+        )
+        layer.append(_encode_field(2, feature))
+    layer.append(_encode_varint((5 << 3) | 0) + _encode_varint(extent))
+    return _encode_field(3, b''.join(layer))
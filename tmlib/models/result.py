@@ -27,10 +27,103 @@ from sqlalchemy.orm import relationship, backref, Session
 
 from tmlib.models.base import ExperimentModel, IdMixIn
 from tmlib.models.feature import FeatureValues
+from tmlib.models.utils import MemoryCache
 
 logger = logging.getLogger(__name__)
 
 
+#: tmlib.models.utils.MemoryCache: label values of tool results as arrays
+#: sorted by mapobject ID
+_label_cache = MemoryCache('label_cache_size')
+
+
+def _lookup_labels(mapobject_ids, known_ids, values, discrete=False):
+    '''Looks up label values of mapobjects.
+
+    Parameters
+    ----------
+    mapobject_ids: List[int]
+        IDs of mapobjects for which labels should be retrieved
+    known_ids: numpy.ndarray[numpy.int64]
+        sorted IDs of mapobjects that have a label
+    values: numpy.ndarray[numpy.float64]
+        label value of each mapobject in `known_ids`
+    discrete: bool, optional
+        whether label values should be returned as integers; ``NaN`` values
+        are returned as floats (default: ``False``)
+
+    Returns
+    -------
+    Dict[int, float or int]
+        mapping of mapobject ID to label value for mapobjects that have a label
+    '''
+    mapobject_ids = np.asarray(mapobject_ids, dtype=np.int64)
+    if len(known_ids) == 0 or len(mapobject_ids) == 0:
+        return dict()
+    index = np.searchsorted(known_ids, mapobject_ids)
+    index[index == len(known_ids)] = 0
+    is_known = known_ids[index] == mapobject_ids
+    values = values[index[is_known]].tolist()
+    if discrete:
+        values = [v if np.isnan(v) else int(v) for v in values]
+    return dict(zip(mapobject_ids[is_known].tolist(), values))
+
+
+def _load_labels(session, sql, params):
+    '''Loads label values of all mapobjects.
+
+    Parameters
+    ----------
+    session: sqlalchemy.orm.session.Session
+        database session
+    sql: str
+        SQL query that selects "mapobject_id", "tpoint" and "value"
+    params: dict
+        query parameters
+
+    Returns
+    -------
+    Tuple[numpy.ndarray]
+        mapobject IDs sorted in ascending order and corresponding values;
+        in case a mapobject has values for several time points, the value of
+        the first time point is used
+    '''
+    # Rows are streamed via a server-side cursor to avoid holding all of them
+    # as Python objects in memory.
+    connection = session.connection().execution_options(stream_results=True)
+    result = connection.execute(sql, params)
+    mapobject_ids = list()
+    tpoints = list()
+    values = list()
+    try:
+        while True:
+            records = result.fetchmany(10**5)
+            if not records:
+                break
+            mapobject_ids.append(
+                np.array([r.mapobject_id for r in records], dtype=np.int64)
+            )
+            tpoints.append(
+                np.array([r.tpoint for r in records], dtype=np.int64)
+            )
+            # Values are stored as floats, since labels may be NaN.
+            values.append(
+                np.array([r.value for r in records], dtype=np.float64)
+            )
+    finally:
+        result.close()
+    if not mapobject_ids:
+        return (np.array([], dtype=np.int64), np.array([], dtype=np.float64))
+    mapobject_ids = np.concatenate(mapobject_ids)
+    tpoints = np.concatenate(tpoints)
+    values = np.concatenate(values)
+    index = np.lexsort((tpoints, mapobject_ids))
+    mapobject_ids = mapobject_ids[index]
+    values = values[index]
+    mapobject_ids, index = np.unique(mapobject_ids, return_index=True)
+    return (mapobject_ids, values[index])
+
+
 class ToolResult(ExperimentModel, IdMixIn):
 
     '''A tool result bundles all elements that should be visualized together
@@ -62,8 +155,16 @@ class ToolResult(ExperimentModel, IdMixIn):
     #: dict: mapping of tool-specific attributes
     attributes = Column(JSON)
 
+    #: int: number of times label values (or feature values in case of a
+    #: :class:`HeatmapToolResult <tmlib.models.result.HeatmapToolResult>`)
+    #: have been saved for the result
+    revision = Column(Integer, default=0)
+
     __mapper_args__ = {'polymorphic_on': type}
 
+    #: bool: whether label values are returned as integers
+    _discrete_labels = False
+
     #: int: id of the parent mapobject type
     mapobject_type_id = Column(
         Integer,
@@ -113,8 +214,7 @@ class ToolResult(ExperimentModel, IdMixIn):
                 self.attributes[attr] = value.tolist()
 
     def get_labels(self, mapobject_ids):
-        '''Queries the database to retrieve the generated label values for
-        the given `mapobjects`.
+        '''Retrieves the generated label values for the given `mapobjects`.
 
         Parameters
         ----------
@@ -125,16 +225,48 @@ class ToolResult(ExperimentModel, IdMixIn):
         -------
         Dict[int, float or int]
             mapping of mapobject ID to label value
+
+        Note
+        ----
+        Label values of all mapobjects are loaded once and cached in memory
+        (see :attr:`label_cache_size <tmlib.config.LibraryConfig.label_cache_size>`),
+        such that subsequent lookups don't need to query the database.
         '''
+        known_ids, values = self._get_cached_labels(
+            '''
+                SELECT
+                    v.mapobject_id, v.tpoint,
+                    (v.values -> %(key)s)::double precision AS value
+                FROM label_values AS v
+                JOIN mapobjects AS m
+                ON m.id = v.mapobject_id AND m.partition_key = v.partition_key
+                WHERE m.mapobject_type_id = %(mapobject_type_id)s
+                AND v.values ? %(key)s
+            ''', {
+                'key': str(self.id),
+                'mapobject_type_id': self.mapobject_type_id
+            }
+        )
+        return _lookup_labels(
+            mapobject_ids, known_ids, values, self._discrete_labels
+        )
+
+    def _get_cached_labels(self, sql, params):
         session = Session.object_session(self)
-        return dict(
-            session.query(
-                LabelValues.mapobject_id,
-                LabelValues.values[str(self.id)]
-            ).
-            filter(LabelValues.mapobject_id.in_(mapobject_ids)).
-            all()
+        key = (
+            self.mapobject_type.experiment_id, self.id, self.mapobject_type_id
         )
+        # The revision changes whenever label values (or feature values of
+        # heatmaps) get saved.
+        revision = self.revision or 0
+        labels = _label_cache.get(key, revision)
+        if labels is None:
+            logger.debug('load label values of result %d', self.id)
+            labels = _load_labels(session, sql, params)
+            _label_cache.put(
+                key, labels, labels[0].nbytes + labels[1].nbytes, revision
+            )
+        return labels
 
 
 class ScalarToolResult(ToolResult):
@@ -145,6 +277,8 @@ class ScalarToolResult(ToolResult):
 
     __mapper_args__ = {'polymorphic_identity': 'ScalarToolResult'}
 
+    _discrete_labels = True
+
     def __init__(self, submission_id, tool_name, mapobject_type_id,
             unique_labels, **extra_attributes):
         '''
@@ -275,8 +409,8 @@ class HeatmapToolResult(ContinuousToolResult):
         )
 
     def get_labels(self, mapobject_ids):
-        '''Queries the database to retrieve the pre-computed feature values for
-        the given `mapobjects`.
+        '''Retrieves the pre-computed feature values for the given
+        `mapobjects`.
 
         Parameters
         ----------
@@ -287,17 +421,32 @@ class HeatmapToolResult(ContinuousToolResult):
         -------
         Dict[int, float or int]
             mapping of mapobject ID to feature value
+
+        Note
+        ----
+        Feature values of all mapobjects are loaded once and cached in memory
+        (see :meth:`ToolResult.get_labels <tmlib.models.result.ToolResult.get_labels>`).
+        Cached values get invalidated via
+        :attr:`revision <tmlib.models.result.ToolResult.revision>` when
+        feature values of the mapobject type are modified, e.g. by the
+        :class:`Aggregation <tmlib.tools.aggregation.Aggregation>` tool.
         '''
-        session = Session.object_session(self)
-        feature_id = self.attributes['feature_id']
-        return dict(
-            session.query(
-                FeatureValues.mapobject_id,
-                FeatureValues.values[str(feature_id)]
-            ).
-            filter(FeatureValues.mapobject_id.in_(mapobject_ids)).
-            all()
+        known_ids, values = self._get_cached_labels(
+            '''
+                SELECT
+                    v.mapobject_id, v.tpoint,
+                    (v.values -> %(key)s)::double precision AS value
+                FROM feature_values AS v
+                JOIN mapobjects AS m
+                ON m.id = v.mapobject_id AND m.partition_key = v.partition_key
+                WHERE m.mapobject_type_id = %(mapobject_type_id)s
+                AND v.values ? %(key)s
+            ''', {
+                'key': str(self.attributes['feature_id']),
+                'mapobject_type_id': self.mapobject_type_id
+            }
         )
+        return _lookup_labels(mapobject_ids, known_ids, values)
 
 
 class LabelValues(ExperimentModel):
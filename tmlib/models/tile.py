@@ -14,16 +14,22 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import os
+import mmap
+import fcntl
+import shutil
 import logging
 import collections
+from abc import ABCMeta
+from abc import abstractmethod
 from io import BytesIO
-from struct import pack
+from struct import pack, unpack
+from multiprocessing.pool import ThreadPool
 import psycopg2
 import numpy as np
 import pandas as pd
 from sqlalchemy import (
     Column, String, Integer, BigInteger, Boolean, ForeignKey, Index,
-    PrimaryKeyConstraint
+    PrimaryKeyConstraint, tuple_
 )
 from sqlalchemy.dialects.postgresql import BYTEA
 from sqlalchemy.orm import relationship, backref
@@ -31,10 +37,198 @@ from sqlalchemy.ext.hybrid import hybrid_property
 
 from tmlib.image import PyramidTile
 from tmlib.metadata import PyramidTileMetadata
+from tmlib.errors import DataError
 from tmlib.models.base import DistributedExperimentModel
 
 logger = logging.getLogger(__name__)
 
+#: str: format of the placeholder that represents a tile with uniform pixel
+#: values, consisting of the value and the number of rows and columns
+UNIFORM_TILE_FORMAT = '<BHH'
+
+_UNIFORM_TILE_SIZE = len(pack(UNIFORM_TILE_FORMAT, 0, 0, 0))
+
+#: str: placeholder of a background tile, i.e. a tile of maximal size with
+#: zero-valued pixels (see
+#: :meth:`PyramidTile.create_as_background <tmlib.image.PyramidTile.create_as_background>`)
+BACKGROUND_TILE = pack(
+    UNIFORM_TILE_FORMAT, 0, PyramidTile.TILE_SIZE, PyramidTile.TILE_SIZE
+)
+
+# JPEG encoded uniform tiles hashable by value and dimensions
+_uniform_tile_cache = dict()
+
+# Pools of threads for encoding and decoding tiles hashable by size
+_thread_pools = dict()
+
+
+def encode_tile(tile):
+    '''Encodes the pixels of a tile. Tiles with uniform pixel values, such as
+    background tiles, are represented by a small placeholder
+    (see :const:`UNIFORM_TILE_FORMAT <tmlib.models.tile.UNIFORM_TILE_FORMAT>`)
+    instead of *JPEG*.
+
+    Parameters
+    ----------
+    tile: tmlib.image.PyramidTile
+        tile
+
+    Returns
+    -------
+    numpy.ndarray[numpy.uint8]
+        encoded tile
+    '''
+    array = tile.array
+    value = array.min()
+    if value == array.max():
+        return np.frombuffer(
+            pack(UNIFORM_TILE_FORMAT, value, *array.shape), np.uint8
+        )
+    return tile.jpeg_encode()
+
+
+def is_uniform_tile(buf):
+    '''Determines whether an encoded tile is the placeholder of a tile with
+    uniform pixel values.
+
+    Parameters
+    ----------
+    buf: numpy.ndarray[numpy.uint8]
+        encoded tile
+
+    Returns
+    -------
+    bool
+    '''
+    return len(buf) == _UNIFORM_TILE_SIZE
+
+
+def is_background_tile(buf):
+    '''Determines whether an encoded tile is the placeholder of a background
+    tile (see :const:`BACKGROUND_TILE <tmlib.models.tile.BACKGROUND_TILE>`).
+
+    Parameters
+    ----------
+    buf: numpy.ndarray[numpy.uint8]
+        encoded tile
+
+    Returns
+    -------
+    bool
+    '''
+    return (
+        is_uniform_tile(buf) and
+        np.frombuffer(buf, np.uint8).tostring() == BACKGROUND_TILE
+    )
+
+
+def decode_tile(buf, metadata=None):
+    '''Decodes the pixels of a tile, which was encoded with
+    :func:`encode_tile <tmlib.models.tile.encode_tile>`.
+
+    Parameters
+    ----------
+    buf: numpy.ndarray[numpy.uint8]
+        encoded tile
+    metadata: tmlib.metadata.PyramidTileMetadata, optional
+        tile metadata (default: ``None``)
+
+    Returns
+    -------
+    tmlib.image.PyramidTile
+        decoded tile
+    '''
+    buf = np.frombuffer(buf, np.uint8)
+    if is_uniform_tile(buf):
+        value, height, width = unpack(UNIFORM_TILE_FORMAT, buf.tostring())
+        array = np.empty((height, width), np.uint8)
+        array.fill(value)
+        return PyramidTile(array, metadata)
+    return PyramidTile.create_from_buffer(buf, metadata)
+
+
+def get_jpeg_encoded_tile(buf):
+    '''Gets the *JPEG* encoded representation of an encoded tile. For tiles
+    with uniform pixel values, the *JPEG* is created only once per value and
+    dimensions and cached.
+
+    Parameters
+    ----------
+    buf: numpy.ndarray[numpy.uint8]
+        tile encoded with :func:`encode_tile <tmlib.models.tile.encode_tile>`
+
+    Returns
+    -------
+    numpy.ndarray[numpy.uint8]
+        *JPEG* encoded tile
+    '''
+    if not is_uniform_tile(buf):
+        return buf
+    key = np.frombuffer(buf, np.uint8).tostring()
+    if key not in _uniform_tile_cache:
+        _uniform_tile_cache[key] = decode_tile(buf).jpeg_encode()
+    return _uniform_tile_cache[key]
+
+
+def _map_in_threads(func, items, n_threads):
+    if n_threads <= 1 or len(items) < 2:
+        return [func(item) for item in items]
+    if n_threads not in _thread_pools:
+        logger.debug('create pool of %d threads for tile codec', n_threads)
+        _thread_pools[n_threads] = ThreadPool(n_threads)
+    # Items are distributed in chunks such that each thread gets several
+    # tiles at once, which reduces the overhead of the pool.
+    chunksize = max(1, len(items) / (n_threads * 4))
+    return _thread_pools[n_threads].map(func, items, chunksize)
+
+
+def encode_tiles(tiles, n_threads=1):
+    '''Encodes the pixels of multiple tiles
+    (see :func:`encode_tile <tmlib.models.tile.encode_tile>`).
+
+    Parameters
+    ----------
+    tiles: List[tmlib.image.PyramidTile]
+        tiles
+    n_threads: int, optional
+        number of threads across which encoding should be distributed;
+        *OpenCV* releases the global interpreter lock, such that tiles are
+        encoded in parallel (default: ``1``)
+
+    Returns
+    -------
+    List[numpy.ndarray[numpy.uint8]]
+        encoded tiles in the same order as `tiles`
+    '''
+    return _map_in_threads(encode_tile, tiles, n_threads)
+
+
+def decode_tiles(buffers, metadata=None, n_threads=1):
+    '''Decodes the pixels of multiple tiles
+    (see :func:`decode_tile <tmlib.models.tile.decode_tile>`).
+
+    Parameters
+    ----------
+    buffers: List[numpy.ndarray[numpy.uint8]]
+        encoded tiles
+    metadata: List[tmlib.metadata.PyramidTileMetadata], optional
+        metadata for each tile (default: ``None``)
+    n_threads: int, optional
+        number of threads across which decoding should be distributed;
+        *OpenCV* releases the global interpreter lock, such that tiles are
+        decoded in parallel (default: ``1``)
+
+    Returns
+    -------
+    List[tmlib.image.PyramidTile]
+        decoded tiles in the same order as `buffers`
+    '''
+    if metadata is None:
+        metadata = [None] * len(buffers)
+    return _map_in_threads(
+        lambda args: decode_tile(*args), zip(buffers, metadata), n_threads
+    )
+
 
 class ChannelLayerTile(DistributedExperimentModel):
 
@@ -151,3 +345,446 @@ class ChannelLayerTile(DistributedExperimentModel):
         )
 
 
+class TileStore(object):
+
+    '''Abstract base class for a storage backend of the tiles of a
+    :class:`ChannelLayer <tmlib.models.channel.ChannelLayer>`.
+
+    Tiles are written and read in bulk for a given zoom level. Derived classes
+    implement the storage of encoded tiles, which are represented by
+    one-dimensional arrays of 8-bit unsigned integers (see
+    :func:`encode_tile <tmlib.models.tile.encode_tile>`). Whether tiles with
+    uniform pixel values are stored as placeholders or as *JPEG* depends on
+    the backend.
+
+    See also
+    --------
+    :attr:`tmlib.config.LibraryConfig.tile_storage`
+    '''
+
+    __metaclass__ = ABCMeta
+
+    def __init__(self, channel_layer_id):
+        '''
+        Parameters
+        ----------
+        channel_layer_id: int
+            ID of the parent channel layer
+        '''
+        self.channel_layer_id = channel_layer_id
+
+    @abstractmethod
+    def _read_tiles(self, z, coordinates):
+        pass
+
+    @abstractmethod
+    def _write_tiles(self, z, tiles):
+        pass
+
+    @abstractmethod
+    def clear(self):
+        '''Deletes all tiles of the layer.'''
+        pass
+
+    def get_encoded_tiles(self, z, coordinates):
+        '''Gets *JPEG* encoded tiles.
+
+        Parameters
+        ----------
+        z: int
+            zero-based zoom level index
+        coordinates: List[Tuple[int]]
+            zero-based row and column indices of tiles at level `z`
+
+        Returns
+        -------
+        Dict[Tuple[int], numpy.ndarray[numpy.uint8]]
+            encoded tiles hashable by row and column index; tiles that don't
+            exist are omitted
+        '''
+        return {
+            k: get_jpeg_encoded_tile(buf)
+            for k, buf in self._read_tiles(z, coordinates).iteritems()
+        }
+
+    def get_encoded_tile(self, z, y, x):
+        '''Gets an individual *JPEG* encoded tile.
+
+        Parameters
+        ----------
+        z: int
+            zero-based zoom level index
+        y: int
+            zero-based row index
+        x: int
+            zero-based column index
+
+        Returns
+        -------
+        numpy.ndarray[numpy.uint8]
+            encoded tile or ``None`` in case the tile doesn't exist
+        '''
+        return self.get_encoded_tiles(z, [(y, x)]).get((y, x))
+
+    def put_encoded_tiles(self, z, tiles):
+        '''Puts encoded tiles. Existing tiles get replaced.
+
+        Parameters
+        ----------
+        z: int
+            zero-based zoom level index
+        tiles: Dict[Tuple[int], numpy.ndarray[numpy.uint8]]
+            encoded tiles hashable by row and column index (see
+            :func:`encode_tile <tmlib.models.tile.encode_tile>`)
+        '''
+        if len(tiles) == 0:
+            return
+        logger.debug(
+            'put %d tiles at zoom level %d, %d of which are uniform',
+            len(tiles), z, sum([is_uniform_tile(t) for t in tiles.values()])
+        )
+        self._write_tiles(z, tiles)
+
+    def get_tiles(self, z, coordinates, n_threads=1):
+        '''Gets tiles and decodes their pixels.
+
+        Parameters
+        ----------
+        z: int
+            zero-based zoom level index
+        coordinates: List[Tuple[int]]
+            zero-based row and column indices of tiles at level `z`
+        n_threads: int, optional
+            number of threads for decoding (default: ``1``)
+
+        Returns
+        -------
+        Dict[Tuple[int], tmlib.image.PyramidTile]
+            tiles hashable by row and column index; tiles that don't exist
+            are omitted
+
+        See also
+        --------
+        :func:`tmlib.models.tile.decode_tiles`
+        '''
+        buffers = self._read_tiles(z, coordinates)
+        keys = buffers.keys()
+        metadata = [
+            PyramidTileMetadata(
+                z=z, y=y, x=x, channel_layer_id=self.channel_layer_id
+            )
+            for y, x in keys
+        ]
+        tiles = decode_tiles(
+            [buffers[k] for k in keys], metadata, n_threads
+        )
+        return dict(zip(keys, tiles))
+
+    def get_tile(self, z, y, x):
+        '''Gets an individual tile and decodes its pixels.
+
+        Parameters
+        ----------
+        z: int
+            zero-based zoom level index
+        y: int
+            zero-based row index
+        x: int
+            zero-based column index
+
+        Returns
+        -------
+        tmlib.image.PyramidTile
+            tile or ``None`` in case the tile doesn't exist
+        '''
+        return self.get_tiles(z, [(y, x)]).get((y, x))
+
+    def put_tiles(self, z, tiles, n_threads=1):
+        '''Encodes the pixels of tiles and puts them. Existing tiles get
+        replaced.
+
+        Parameters
+        ----------
+        z: int
+            zero-based zoom level index
+        tiles: Dict[Tuple[int], tmlib.image.PyramidTile]
+            tiles hashable by row and column index
+        n_threads: int, optional
+            number of threads for encoding (default: ``1``)
+
+        See also
+        --------
+        :func:`tmlib.models.tile.encode_tiles`
+        '''
+        keys = tiles.keys()
+        buffers = encode_tiles([tiles[k] for k in keys], n_threads)
+        self.put_encoded_tiles(z, dict(zip(keys, buffers)))
+
+
+class DatabaseTileStore(TileStore):
+
+    '''Storage of tiles as BYTEA values in the distributed table of
+    :class:`ChannelLayerTile <tmlib.models.tile.ChannelLayerTile>`.
+
+    Tiles are stored as *JPEG*, including tiles with uniform pixel values,
+    because the values of the column are served to clients as is.
+    Background tiles (see
+    :const:`BACKGROUND_TILE <tmlib.models.tile.BACKGROUND_TILE>`), which make
+    up large parts of the lower zoom levels, are not stored at all. Tiles that
+    don't exist within the bounds of the layer are read as background tiles.
+    '''
+
+    def __init__(self, session, channel_layer_id, dimensions):
+        '''
+        Parameters
+        ----------
+        session: sqlalchemy.orm.session.Session
+            database session for the experiment
+        channel_layer_id: int
+            ID of the parent channel layer
+        dimensions: List[Tuple[int]]
+            number of tiles along the vertical and horizontal axis of the
+            layer at each zoom level
+        '''
+        super(DatabaseTileStore, self).__init__(channel_layer_id)
+        self._session = session
+        self.dimensions = dimensions
+
+    def _read_tiles(self, z, coordinates):
+        if len(coordinates) == 0:
+            return dict()
+        tiles = self._select_tiles(z, coordinates)
+        n_rows, n_cols = self.dimensions[z]
+        background = np.frombuffer(BACKGROUND_TILE, np.uint8)
+        for y, x in coordinates:
+            key = (int(y), int(x))
+            if key not in tiles and 0 <= y < n_rows and 0 <= x < n_cols:
+                tiles[key] = background
+        return tiles
+
+    def _write_tiles(self, z, tiles):
+        instances = list()
+        background_coordinates = collections.defaultdict(list)
+        for (y, x), buf in tiles.iteritems():
+            if is_background_tile(buf):
+                background_coordinates[int(y)].append(int(x))
+                continue
+            instance = ChannelLayerTile(
+                z=z, y=y, x=x, channel_layer_id=self.channel_layer_id
+            )
+            instance._pixels = get_jpeg_encoded_tile(buf)
+            instances.append(instance)
+        self._insert_tiles(instances)
+        # Background tiles are not stored, but they may replace existing
+        # tiles.
+        self._delete_tiles(z, background_coordinates)
+
+    def _select_tiles(self, z, coordinates):
+        tiles = self._session.query(
+                ChannelLayerTile.y, ChannelLayerTile.x,
+                ChannelLayerTile._pixels
+            ).\
+            filter(
+                ChannelLayerTile.channel_layer_id == self.channel_layer_id,
+                ChannelLayerTile.z == z,
+                tuple_(ChannelLayerTile.y, ChannelLayerTile.x).in_(
+                    [tuple(c) for c in coordinates]
+                )
+            ).\
+            all()
+        return {
+            (t.y, t.x): np.frombuffer(t._pixels, np.uint8) for t in tiles
+        }
+
+    def _insert_tiles(self, instances):
+        if len(instances) == 0:
+            return
+        connection = self._session.get_bind()
+        with connection.connection.cursor() as c:
+            ChannelLayerTile._bulk_ingest(c, instances)
+
+    def _delete_tiles(self, z, coordinates):
+        if len(coordinates) == 0:
+            return
+        connection = self._session.get_bind()
+        with connection.connection.cursor() as c:
+            # Each statement is routed to a single shard, since the table is
+            # distributed by row index.
+            for y, x in coordinates.iteritems():
+                c.execute('''
+                    DELETE FROM channel_layer_tiles
+                    WHERE channel_layer_id = %(channel_layer_id)s
+                    AND z = %(z)s AND y = %(y)s AND x = ANY(%(x)s)
+                ''', {
+                    'channel_layer_id': self.channel_layer_id,
+                    'z': z, 'y': y, 'x': x
+                })
+
+    def clear(self):
+        self._session.query(ChannelLayerTile).\
+            filter_by(channel_layer_id=self.channel_layer_id).\
+            delete()
+
+
+class FileTileStore(TileStore):
+
+    '''Storage of tiles in memory-mapped files, one file per zoom level.
+
+    Each file starts with a fixed-size header and index, followed by the
+    concatenated encoded tiles::
+
+        magic string (8 bytes) | number of rows | number of columns |
+        offset and length of each tile (in row-major order) | tile data
+
+    where all numbers are stored as little-endian 64-bit integers and
+    tiles that don't exist have length zero. Tiles are read as zero-copy
+    slices of the memory-mapped file. Tiles with uniform pixel values that
+    are written together share a single placeholder in the file.
+
+    Tiles get appended to the file and the index gets updated afterwards
+    while holding an exclusive lock on the file, such that several processes
+    can write tiles of the same level concurrently. Replaced tiles are not
+    removed from the file, but their space is only reclaimed upon
+    :meth:`clear <tmlib.models.tile.FileTileStore.clear>`.
+
+    Warning
+    -------
+    Neither ``flock`` nor the coherence of memory maps is guaranteed on
+    shared network filesystems. Processes that write tiles of the same
+    layer concurrently must therefore run on the same node.
+    '''
+
+    _MAGIC = 'TMTILES1'
+
+    _HEADER_SIZE = 24
+
+    _INDEX_DTYPE = np.dtype('<i8')
+
+    def __init__(self, channel_layer_id, location, dimensions):
+        '''
+        Parameters
+        ----------
+        channel_layer_id: int
+            ID of the parent channel layer
+        location: str
+            absolute path to the directory where files should be stored
+        dimensions: List[Tuple[int]]
+            number of tiles along the vertical and horizontal axis of the
+            layer at each zoom level
+        '''
+        super(FileTileStore, self).__init__(channel_layer_id)
+        self.location = location
+        self.dimensions = dimensions
+        self._maps = dict()
+
+    def _get_filename(self, z):
+        return os.path.join(self.location, 'level_%d.tiles' % z)
+
+    def _get_index_size(self, z):
+        n_rows, n_cols = self.dimensions[z]
+        return n_rows * n_cols * 2 * self._INDEX_DTYPE.itemsize
+
+    def _map(self, z, refresh=False):
+        filename = self._get_filename(z)
+        if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+            return None
+        if z not in self._maps or refresh:
+            with open(filename, 'rb') as f:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if buf[:len(self._MAGIC)] != self._MAGIC:
+                raise DataError('Tile file "%s" is invalid.' % filename)
+            shape = tuple(np.frombuffer(
+                buf, self._INDEX_DTYPE, count=2, offset=len(self._MAGIC)
+            ))
+            if shape != tuple(self.dimensions[z]):
+                raise DataError(
+                    'Dimensions of tile file "%s" don\'t match dimensions of '
+                    'zoom level %d.' % (filename, z)
+                )
+            index = np.frombuffer(
+                buf, self._INDEX_DTYPE, count=int(np.prod(shape)) * 2,
+                offset=self._HEADER_SIZE
+            )
+            self._maps[z] = (buf, index.reshape(shape + (2, )))
+        return self._maps[z]
+
+    def _read_tiles(self, z, coordinates):
+        mapped = self._map(z)
+        if mapped is None:
+            return dict()
+        buf, index = mapped
+        if len(coordinates) == 0:
+            return dict()
+        coordinates = np.array(coordinates, dtype=int).reshape(-1, 2)
+        entries = index[coordinates[:, 0], coordinates[:, 1]]
+        if np.any(entries[:, 0] + entries[:, 1] > len(buf)):
+            # Tiles were appended by another process since the file was
+            # mapped.
+            buf, index = self._map(z, refresh=True)
+            entries = index[coordinates[:, 0], coordinates[:, 1]]
+        tiles = dict()
+        for (y, x), (offset, length) in zip(coordinates, entries):
+            if length == 0:
+                continue
+            tiles[(int(y), int(x))] = np.frombuffer(
+                buf, np.uint8, count=int(length), offset=int(offset)
+            )
+        return tiles
+
+    def _write_tiles(self, z, tiles):
+        if not os.path.exists(self.location):
+            try:
+                os.makedirs(self.location)
+            except OSError:
+                # The directory may have been created by another process.
+                if not os.path.isdir(self.location):
+                    raise
+        n_rows, n_cols = self.dimensions[z]
+        filename = self._get_filename(z)
+        fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o664)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            end = os.lseek(fd, 0, os.SEEK_END)
+            if end == 0:
+                header = np.array([n_rows, n_cols], self._INDEX_DTYPE)
+                os.write(fd, self._MAGIC + header.tostring())
+                # Entries of the index are initialized with zeros.
+                end = self._HEADER_SIZE + self._get_index_size(z)
+                os.ftruncate(fd, end)
+                os.lseek(fd, end, os.SEEK_SET)
+            # Write the tile data before the index, such that the index never
+            # refers to incomplete tiles.
+            keys = tiles.keys()
+            entries = np.zeros((len(keys), 2), self._INDEX_DTYPE)
+            buffers = list()
+            placeholders = dict()
+            offset = end
+            for i, k in enumerate(keys):
+                buf = np.asarray(tiles[k], np.uint8).tostring()
+                if is_uniform_tile(buf):
+                    if buf in placeholders:
+                        entries[i] = (placeholders[buf], len(buf))
+                        continue
+                    placeholders[buf] = offset
+                entries[i] = (offset, len(buf))
+                buffers.append(buf)
+                offset += len(buf)
+            os.write(fd, ''.join(buffers))
+            for (y, x), entry in zip(keys, entries):
+                position = (
+                    self._HEADER_SIZE +
+                    (y * n_cols + x) * 2 * self._INDEX_DTYPE.itemsize
+                )
+                os.lseek(fd, position, os.SEEK_SET)
+                os.write(fd, entry.tostring())
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        # Entries that were mapped before still refer to valid (replaced)
+        # tiles, but new tiles are only visible after remapping.
+        self._maps.pop(z, None)
+
+    def clear(self):
+        self._maps = dict()
+        if os.path.exists(self.location):
+            shutil.rmtree(self.location)
@@ -20,7 +20,7 @@ import logging
 import inspect
 import collections
 from copy import copy
-from threading import Thread
+from threading import Thread, Lock
 from itertools import chain
 
 import pandas as pd
@@ -54,6 +54,107 @@ POOL_SIZE = 5
 _SCHEMA_NAME_FORMAT_STRING = 'experiment_{experiment_id}'
 
 
+class MemoryCache(object):
+
+    '''Thread-safe, in-process cache with least recently used eviction.
+
+    Each entry is tagged with a revision number of the cached data, such that
+    entries become invalid once the data have been modified, possibly by
+    another process.
+    '''
+
+    #: int: approximate memory footprint of an entry in bytes in addition to
+    #: the size of its value (key, revision and bookkeeping)
+    ENTRY_OVERHEAD = 512
+
+    def __init__(self, size_parameter):
+        '''
+        Parameters
+        ----------
+        size_parameter: str
+            name of the configuration parameter that specifies the maximal
+            size of the cache in megabytes (see
+            :class:`LibraryConfig <tmlib.config.LibraryConfig>`)
+        '''
+        self.size_parameter = size_parameter
+        self._entries = collections.OrderedDict()
+        self._lock = Lock()
+        self._size = 0
+
+    @property
+    def max_size(self):
+        '''int: maximal size of the cache in bytes'''
+        return getattr(cfg, self.size_parameter) * 1024 ** 2
+
+    def get(self, key, revision=0):
+        '''Gets a cached value.
+
+        Parameters
+        ----------
+        key: tuple
+            unique identifier of the value
+        revision: int, optional
+            current revision of the value
+
+        Returns
+        -------
+        object
+            cached value or ``None`` if no entry exists for the given `key`
+            and `revision`
+        '''
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            if entry[0] != revision:
+                self._size -= entry[1]
+                return None
+            # Re-insert the entry to mark it as most recently used.
+            self._entries[key] = entry
+            return entry[2]
+
+    def put(self, key, value, size, revision=0):
+        '''Adds a value and evicts least recently used entries in case the
+        size of the cache exceeds the limit.
+
+        Parameters
+        ----------
+        key: tuple
+            unique identifier of the value
+        value: object
+            value that should be cached
+        size: int
+            size of `value` in bytes
+        revision: int, optional
+            current revision of the value
+
+        Note
+        ----
+        :attr:`ENTRY_OVERHEAD <tmlib.models.utils.MemoryCache.ENTRY_OVERHEAD>`
+        is added to `size`, such that empty values also count towards the
+        size of the cache. Nothing gets cached if the maximal size is zero.
+        '''
+        max_size = self.max_size
+        size += self.ENTRY_OVERHEAD
+        if max_size == 0 or size > max_size:
+            return
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._size -= entry[1]
+            self._entries[key] = (revision, size, value)
+            self._size += size
+            while self._size > max_size:
+                _, entry = self._entries.popitem(last=False)
+                self._size -= entry[1]
+
+    def clear(self):
+        '''Removes all entries.'''
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
 def set_pool_size(n):
     '''Sets the pool size for database connections of the current Python
     process.
@@ -109,6 +210,20 @@ def create_db_engine(db_uri, cache=True):
     return engine
 
 
+def dispose_db_engines():
+    '''Closes all pooled connections of cached database engines and removes
+    the engines from the cache.
+
+    This must be called before the current Python process gets forked,
+    because database connections must not be shared between processes.
+    Child processes will subsequently create their own engines.
+    '''
+    logger.debug('dispose cached database engines of process %d', os.getpid())
+    for engine in DATABASE_ENGINES.values():
+        engine.dispose()
+    DATABASE_ENGINES.clear()
+
+
 def create_db_tables(engine):
     '''Creates all tables in the *public* schema.
 
@@ -591,7 +706,7 @@ class _SQLAlchemy_Session(object):
         else:
             self._session.add(instance)
 
-    def add_all(self, instance):
+    def add_all(self, instances):
         '''Adds multiple instances of a model class.
 
         Parameters
@@ -613,7 +728,7 @@ class _SQLAlchemy_Session(object):
                 for i in instances:
                     cls._add(c, i)
         else:
-            self._session.add_all(instance)
+            self._session.add_all(instances)
 
 class _Session(object):
 
@@ -831,6 +946,38 @@ class _Connection(object):
         self._cursor.close()
         self._connection.close()
 
+    def create_server_side_cursor(self, name):
+        '''Creates a named cursor, which keeps the result of a query on the
+        database server and transfers records to the client only upon
+        fetching.
+
+        Parameters
+        ----------
+        name: str
+            name of the cursor
+
+        Returns
+        -------
+        psycopg2.extras.NamedTupleCursor
+            cursor that must be closed by the caller
+
+        Raises
+        ------
+        ValueError
+            when the connection is not part of a transaction
+
+        Note
+        ----
+        The cursor only lives as long as the current transaction.
+        '''
+        if not self._transaction:
+            raise ValueError(
+                'Server-side cursors require a transaction.'
+            )
+        return self._connection.cursor(
+            name=name, cursor_factory=NamedTupleCursor
+        )
+
     def __getattr__(self, attr):
         if hasattr(self._cursor, attr):
             return getattr(self._cursor, attr)
@@ -940,6 +1087,44 @@ class ExperimentConnection(_Connection):
         node, port = self._cursor.fetchone()
         return (node, port, shard_id)
 
+    def locate_partitions(self, model, partition_keys):
+        '''Determines the location of several table partitions (shards) at
+        once.
+
+        Parameters
+        ----------
+        model: class
+            class derived from
+            :class:`ExperimentModel <tmlib.models.base.ExperimentModel>`
+        partition_keys: List[int]
+            values of the distribution column
+
+        Returns
+        -------
+        Dict[int, Tuple[Union[str, int]]]
+            host and port of the worker server and the ID of the shard
+            for each partition key
+
+        See also
+        --------
+        :meth:`locate_partition <tmlib.models.utils.ExperimentConnection.locate_partition>`
+        '''
+        self._cursor.execute('''
+            SELECT k.partition_key, p.nodename, p.nodeport, p.shardid
+            FROM unnest(%(partition_keys)s::integer[]) AS k(partition_key)
+            JOIN pg_dist_shard_placement AS p
+            ON p.shardid = get_shard_id_for_distribution_column(
+                %(table)s, k.partition_key
+            )
+        ''', {
+            'table': model.__table__.name,
+            'partition_keys': list(partition_keys)
+        })
+        return {
+            r.partition_key: (r.nodename, r.nodeport, r.shardid)
+            for r in self._cursor.fetchall()
+        }
+
     def get_unique_ids(self, model, n):
         '''Gets a unique, but shard-specific value for the distribution column.
 
@@ -398,9 +398,9 @@ class DatasetReader(Reader):
             absolute path to the dataset within the file
         index: int or List[int], optional
             zero-based index
-        row_index: int or List[int], optional
+        row_index: int or List[int] or slice, optional
             zero-based row index
-        column_index: int or List[int], optional
+        column_index: int or List[int] or slice, optional
             zero-based column index
 
         Returns
@@ -408,6 +408,11 @@ class DatasetReader(Reader):
         numpy.ndarray
             dataset
 
+        Note
+        ----
+        Only chunks of a chunked dataset that overlap with the selection
+        are read from the file.
+
         Raises
         ------
         KeyError
@@ -43,8 +43,8 @@ additional method ``bar`` (which does nothing):
 
         __description__ = 'Does nothing.'
 
-        def __init__(self, experiment_id):
-            super(Foo, self).__init__(experiment_id)
+        def __init__(self, experiment_id, n_cores=1):
+            super(Foo, self).__init__(experiment_id, n_cores)
 
         def bar(self, values):
             return values
@@ -69,6 +69,7 @@ additional method ``bar`` (which does nothing):
 import logging
 
 from tmlib.version import __version__
+from tmlib.tools.aggregation import Aggregation
 from tmlib.tools.classification import Classification
 from tmlib.tools.clustering import Clustering
 from tmlib.tools.heatmap import Heatmap
@@ -16,11 +16,14 @@
 import numpy as np
 import pandas as pd
 import logging
+from functools import reduce
 
 import tmlib.models as tm
 from tmlib.utils import same_docstring_as
+from tmlib.errors import WorkflowError
 
 from tmlib.tools.base import Tool
+from tmlib.tools.cache import FeatureValueCache
 
 logger = logging.getLogger(__name__)
 
@@ -34,10 +37,427 @@ class Aggregation(Tool):
         fall within larger mapobjects of a different type.
     '''
 
+    __options__ = {
+        'statistics': ['count', 'mean', 'std', 'min', 'max', 'sum', 'median']
+    }
+
     @same_docstring_as(Tool.__init__)
-    def __init__(self, experiment_id):
-        super(Aggregation, self).__init__(experiment_id)
+    def __init__(self, experiment_id, n_cores=1):
+        super(Aggregation, self).__init__(experiment_id, n_cores)
 
-    @same_docstring_as(Tool.process_request)
     def process_request(self, submission_id, payload):
-        pass
+        '''Processes a client tool request and inserts the generated
+        aggregate features into the database. The `payload` is expected to
+        have the following form::
+
+            {
+                "chosen_object_type": str,
+                "selected_features": [str, ...],
+                "options": {
+                    "child_object_type": str,
+                    "statistics": [str, ...]
+                }
+            }
+
+        where "chosen_object_type" is the type of the parent objects and
+        "selected_features" are features of the child objects.
+
+        Parameters
+        ----------
+        submission_id: int
+            ID of the corresponding job submission
+        payload: dict
+            description of the tool job
+
+        Note
+        ----
+        A child object is assigned to a parent object if the centroid of the
+        child lies within the polygon of the parent. Parent objects of the
+        static types "Wells" and "Plates" are assigned via the *site* in which
+        the child object was segmented instead.
+        For each statistic and child feature a
+        :class:`Feature <tmlib.models.feature.Feature>` named
+        ``"<child_object_type>_<feature>_<statistic>"`` is created for the
+        parent type, for statistic "count" a single feature named
+        ``"<child_object_type>_count"``.
+        '''
+        logger.info('perform aggregation')
+        parent_type_name = payload['chosen_object_type']
+        feature_names = payload['selected_features']
+        child_type_name = payload['options']['child_object_type']
+        statistics = payload['options'].get('statistics', ['mean'])
+
+        for s in statistics:
+            if s not in self.__options__['statistics']:
+                raise ValueError('Unknown statistic "%s".' % s)
+        if parent_type_name == child_type_name:
+            raise ValueError(
+                'Parent and child object types must be different.'
+            )
+
+        with tm.utils.ExperimentConnection(self.experiment_id) as conn:
+            feature_records = self._get_feature_records(
+                conn, child_type_name, feature_names
+            )
+
+        with tm.utils.ExperimentSession(self.experiment_id) as session:
+            parent_type = session.query(tm.MapobjectType).\
+                filter_by(name=parent_type_name).\
+                one()
+            child_type = session.query(tm.MapobjectType).\
+                filter_by(name=child_type_name).\
+                one()
+            parent_type_id = parent_type.id
+            child_type_id = child_type.id
+            partition_keys = [s.id for s in session.query(tm.Site.id)]
+
+            if parent_type.ref_type in {'Well', 'Plate'}:
+                if 'median' in statistics:
+                    raise ValueError(
+                        'Statistic "median" is not supported for parent '
+                        'objects of type "%s".' % parent_type_name
+                    )
+                parent_lut = self._map_sites_to_static_mapobjects(
+                    session, parent_type
+                )
+                layers = None
+            else:
+                parent_lut = None
+                layers = self._pair_segmentation_layers(
+                    session, parent_type_id, child_type_id
+                )
+
+            logger.info('create aggregate features')
+            feature_ids = dict()
+            for s in statistics:
+                if s == 'count':
+                    names = [(s, None, '%s_count' % child_type_name)]
+                else:
+                    names = [
+                        (s, name, '%s_%s_%s' % (child_type_name, name, s))
+                        for name in feature_names
+                    ]
+                for key, name, aggregate_name in names:
+                    feature = session.get_or_create(
+                        tm.Feature, name=aggregate_name,
+                        mapobject_type_id=parent_type_id, is_aggregate=True
+                    )
+                    feature_ids[(key, name)] = feature.id
+
+        logger.info(
+            'aggregate features of "%s" objects for %d partitions',
+            child_type_name, len(partition_keys)
+        )
+        value_expressions = self._get_feature_value_expressions(
+            feature_records
+        )
+        with_median = 'median' in statistics
+
+        def aggregate(partition_keys):
+            partials = list()
+            with tm.utils.ExperimentConnection(self.experiment_id) as conn:
+                for key in partition_keys:
+                    if layers is None:
+                        partials.extend(self.aggregate_partition_by_site(
+                            conn, key, child_type_id, value_expressions,
+                            parent_lut[key]
+                        ))
+                    else:
+                        partials.extend(self.aggregate_partition_by_location(
+                            conn, key, layers, value_expressions,
+                            with_median
+                        ))
+            return partials
+
+        partials = tm.utils.parallelize_query(aggregate, partition_keys)
+        if len(partials) == 0:
+            logger.warn('no parent objects found')
+            return
+
+        stats = self._combine_partial_statistics(partials, len(feature_names))
+
+        logger.info('save aggregate feature values')
+        columns = list()
+        for (s, name), feature_id in sorted(feature_ids.iteritems()):
+            if s == 'count':
+                values = stats['count']
+            else:
+                values = stats[s][:, feature_names.index(name)]
+            columns.append(np.char.add(
+                '%d=>' % feature_id, np.round(values, 6).astype(str)
+            ))
+        values = reduce(
+            lambda a, b: np.char.add(np.char.add(a, ','), b), columns
+        )
+        self._upsert_values(
+            tm.FeatureValues, stats['partition_key'], stats['mapobject_id'],
+            stats['tpoint'], values
+        )
+        FeatureValueCache(self.experiment_id).invalidate(parent_type_id)
+        # Feature values cached for heatmaps are outdated.
+        with tm.utils.ExperimentConnection(self.experiment_id) as connection:
+            connection.execute('''
+                UPDATE tool_results SET revision = coalesce(revision, 0) + 1
+                WHERE mapobject_type_id = %(mapobject_type_id)s
+                AND type = 'HeatmapToolResult'
+            ''', {
+                'mapobject_type_id': parent_type_id
+            })
+
+    @staticmethod
+    def _map_sites_to_static_mapobjects(session, mapobject_type):
+        # Static mapobjects of type "Wells" or "Plates" are partitioned by
+        # the ID of the well or plate, respectively.
+        mapobjects = session.query(tm.Mapobject.id, tm.Mapobject.partition_key).\
+            filter_by(mapobject_type_id=mapobject_type.id).\
+            all()
+        mapobject_lut = {m.partition_key: m for m in mapobjects}
+        if mapobject_type.ref_type == 'Well':
+            sites = session.query(tm.Site.id, tm.Site.well_id.label('ref_id'))
+        else:
+            sites = session.query(tm.Site.id, tm.Well.plate_id.label('ref_id')).\
+                join(tm.Well)
+        sites = sites.all()
+        missing_ref_ids = {
+            s.ref_id for s in sites if s.ref_id not in mapobject_lut
+        }
+        if missing_ref_ids:
+            raise WorkflowError(
+                'Mapobjects of type "%s" are missing for %s IDs: %s. '
+                'Static mapobjects are created in the "collect" phase of the '
+                '"illuminati" step, which must be (re-)run.' % (
+                    mapobject_type.name, mapobject_type.ref_type.lower(),
+                    ', '.join(map(str, sorted(missing_ref_ids)))
+                )
+            )
+        return {
+            s.id: (
+                mapobject_lut[s.ref_id].id,
+                mapobject_lut[s.ref_id].partition_key
+            )
+            for s in sites
+        }
+
+    @staticmethod
+    def _pair_segmentation_layers(session, parent_type_id, child_type_id):
+        # Each child layer is paired with the parent layer of the same time
+        # point and z-plane or with the parent layer that is not time
+        # point specific (static mapobject types). Values are aggregated
+        # only once per time point.
+        parent_layers = session.query(tm.SegmentationLayer).\
+            filter_by(mapobject_type_id=parent_type_id).\
+            all()
+        child_layers = session.query(tm.SegmentationLayer).\
+            filter_by(mapobject_type_id=child_type_id).\
+            order_by(tm.SegmentationLayer.zplane).\
+            all()
+        parent_lut = {(l.tpoint, l.zplane): l.id for l in parent_layers}
+        pairs = dict()
+        for l in child_layers:
+            tpoint = l.tpoint if l.tpoint is not None else 0
+            if tpoint in pairs:
+                continue
+            parent_layer_id = parent_lut.get(
+                (l.tpoint, l.zplane), parent_lut.get((None, None))
+            )
+            if parent_layer_id is not None:
+                pairs[tpoint] = (parent_layer_id, l.id)
+        if len(pairs) == 0:
+            raise ValueError(
+                'No matching segmentation layers found for parent and child '
+                'objects.'
+            )
+        return [(p, c, t) for t, (p, c) in pairs.iteritems()]
+
+    @staticmethod
+    def _build_aggregates(value_expressions, with_median=False):
+        values = [
+            'NULLIF(%s, \'NaN\')::double precision' % e
+            for e in value_expressions
+        ]
+        aggregates = [
+            ('n', 'count({v})'), ('sum', 'sum({v})'),
+            ('sumsq', 'sum({v} * {v})'), ('min', 'min({v})'),
+            ('max', 'max({v})')
+        ]
+        if with_median:
+            aggregates.append(
+                ('median', 'percentile_cont(0.5) WITHIN GROUP (ORDER BY {v})')
+            )
+        return ', '.join([
+            'ARRAY[%s]::double precision[] AS %s' % (
+                ', '.join([a.format(v=v) for v in values]), name
+            )
+            for name, a in aggregates
+        ])
+
+    @classmethod
+    def aggregate_partition_by_location(cls, connection, partition_key,
+            layers, value_expressions, with_median=False):
+        '''Computes statistics of feature values of child objects whose
+        centroid lies within the polygon of a parent object for all parents
+        of a given partition.
+
+        Parameters
+        ----------
+        connection: tmlib.models.utils.ExperimentConnection
+            experiment-specific database connection
+        partition_key: int
+            partition key (site ID) of parent and child objects
+        layers: List[Tuple[int]]
+            ID of parent and child
+            :class:`SegmentationLayer <tmlib.models.layer.SegmentationLayer>`
+            and the corresponding time point
+        value_expressions: List[str]
+            SQL expression for each child feature that selects a value from
+            the "feature_values" table aliased as "v"
+        with_median: bool, optional
+            whether the median should be computed (default: ``False``)
+
+        Returns
+        -------
+        List[tuple]
+            partition key, mapobject ID and time point of each parent object
+            and partial statistics, i.e. count of children as well as
+            number of non-NaN values, sum, sum of squares, minimum, maximum
+            and optionally median for each feature
+        '''
+        sql = '''
+            SELECT
+                p.partition_key, p.mapobject_id, %(tpoint)s AS tpoint,
+                count(c.mapobject_id) AS count, {aggregates}
+            FROM mapobject_segmentations AS p
+            LEFT OUTER JOIN (
+                mapobject_segmentations AS c
+                JOIN feature_values AS v
+                ON v.mapobject_id = c.mapobject_id
+                AND v.partition_key = c.partition_key
+                AND v.tpoint = %(tpoint)s
+            )
+            ON c.partition_key = p.partition_key
+            AND c.segmentation_layer_id = %(child_layer_id)s
+            AND ST_Contains(p.geom_polygon, c.geom_centroid)
+            WHERE p.partition_key = %(partition_key)s
+            AND p.segmentation_layer_id = %(parent_layer_id)s
+            GROUP BY p.partition_key, p.mapobject_id
+        '''.format(
+            aggregates=cls._build_aggregates(value_expressions, with_median)
+        )
+        partials = list()
+        for parent_layer_id, child_layer_id, tpoint in layers:
+            connection.execute(sql, {
+                'partition_key': partition_key,
+                'parent_layer_id': parent_layer_id,
+                'child_layer_id': child_layer_id,
+                'tpoint': tpoint
+            })
+            partials.extend(connection.fetchall())
+        return partials
+
+    @classmethod
+    def aggregate_partition_by_site(cls, connection, partition_key,
+            mapobject_type_id, value_expressions, parent):
+        '''Computes statistics of feature values of all child objects of a
+        given partition, which are all assigned to the same parent object.
+
+        Parameters
+        ----------
+        connection: tmlib.models.utils.ExperimentConnection
+            experiment-specific database connection
+        partition_key: int
+            partition key (site ID) of child objects
+        mapobject_type_id: int
+            ID of the child
+            :class:`MapobjectType <tmlib.models.mapobject.MapobjectType>`
+        value_expressions: List[str]
+            SQL expression for each child feature that selects a value from
+            the "feature_values" table aliased as "v"
+        parent: Tuple[int]
+            ID and partition key of the parent object
+
+        Returns
+        -------
+        List[tuple]
+            partial statistics per time point
+
+        See also
+        --------
+        :meth:`aggregate_partition_by_location <tmlib.tools.aggregation.Aggregation.aggregate_partition_by_location>`
+        '''
+        connection.execute('''
+            SELECT
+                %(parent_partition_key)s AS partition_key,
+                %(parent_id)s AS mapobject_id, v.tpoint,
+                count(*) AS count, {aggregates}
+            FROM feature_values AS v
+            JOIN mapobjects AS m
+            ON m.id = v.mapobject_id AND m.partition_key = v.partition_key
+            WHERE m.partition_key = %(partition_key)s
+            AND v.partition_key = %(partition_key)s
+            AND m.mapobject_type_id = %(mapobject_type_id)s
+            GROUP BY v.tpoint
+        '''.format(aggregates=cls._build_aggregates(value_expressions)), {
+            'partition_key': partition_key,
+            'mapobject_type_id': mapobject_type_id,
+            'parent_id': parent[0],
+            'parent_partition_key': parent[1]
+        })
+        return connection.fetchall()
+
+    @staticmethod
+    def _combine_partial_statistics(partials, n_features):
+        df = pd.DataFrame(partials, columns=partials[0]._fields)
+        keys = np.ascontiguousarray(
+            df[['partition_key', 'mapobject_id', 'tpoint']].values,
+            dtype=np.int64
+        )
+        unique_keys, inverse = np.unique(
+            keys.view([('', keys.dtype)] * 3).ravel(), return_inverse=True
+        )
+        n_parents = len(unique_keys)
+
+        def stack(name):
+            # NULL elements (e.g. minimum of no values) are converted to NaN.
+            return np.array(
+                df[name].tolist(), dtype=np.float64
+            ).reshape(len(df), n_features)
+
+        # Partial statistics of a parent object computed for different
+        # partitions (sites) are merged.
+        count = np.zeros((n_parents, ), dtype=np.int64)
+        np.add.at(count, inverse, df['count'].values)
+        n = np.zeros((n_parents, n_features))
+        np.add.at(n, inverse, stack('n'))
+        total = np.zeros((n_parents, n_features))
+        np.add.at(total, inverse, np.nan_to_num(stack('sum')))
+        sumsq = np.zeros((n_parents, n_features))
+        np.add.at(sumsq, inverse, np.nan_to_num(stack('sumsq')))
+        lower = np.full((n_parents, n_features), np.nan)
+        np.fmin.at(lower, inverse, stack('min'))
+        upper = np.full((n_parents, n_features), np.nan)
+        np.fmax.at(upper, inverse, stack('max'))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = total / n
+            std = np.sqrt(np.maximum(sumsq / n - mean ** 2, 0))
+        total[n == 0] = np.nan
+
+        unique_keys = unique_keys.view(keys.dtype).reshape(n_parents, 3)
+        stats = {
+            'partition_key': unique_keys[:, 0],
+            'mapobject_id': unique_keys[:, 1],
+            'tpoint': unique_keys[:, 2],
+            'count': count,
+            'mean': mean,
+            'std': std,
+            'min': lower,
+            'max': upper,
+            'sum': total
+        }
+        if 'median' in df.columns:
+            # Parents are not split across partitions when medians are
+            # computed, hence there is nothing to merge.
+            median = np.empty((n_parents, n_features))
+            median[inverse] = stack('median')
+            stats['median'] = median
+        return stats
@@ -22,27 +22,33 @@ import simplejson
 import numpy as np
 import pandas as pd
 import collections
+import csv
+import Queue
+import threading
+from cStringIO import StringIO
 from abc import ABCMeta
 from abc import abstractmethod
 from abc import abstractproperty
 from sqlalchemy import func
 from sqlalchemy.dialects.postgresql import FLOAT
-from psycopg2.extras import execute_values
 from psycopg2.sql import SQL, Identifier
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.linear_model import SGDClassifier
 from sklearn.svm import SVC
 from sklearn.preprocessing import RobustScaler
 from sklearn.model_selection import GridSearchCV, KFold
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.decomposition import IncrementalPCA
+from sklearn.pipeline import make_pipeline
+from sklearn.base import clone
 
 
 from tmlib import cfg
 import tmlib.models as tm
 from tmlib.config import DEFAULT_LIB, IMPLEMENTED_LIBS
+from tmlib.tools.cache import FeatureValueCache
 from tmlib.utils import (
-    same_docstring_as, autocreate_directory_property, assert_type,
-    create_partitions
+    same_docstring_as, autocreate_directory_property, assert_type
 )
 
 logger = logging.getLogger(__name__)
@@ -95,14 +101,20 @@ class Tool(object):
 
     __abstract__ = True
 
-    def __init__(self, experiment_id):
+    def __init__(self, experiment_id, n_cores=1):
         '''
         Parameters
         ----------
         experiment_id: int
             ID of the experiment for which the tool request is made
+        n_cores: int, optional
+            number of CPU cores the tool may use for processing the request
+            (default: ``1``)
         '''
         self.experiment_id = experiment_id
+        if n_cores < 1:
+            raise ValueError('Argument "n_cores" must be positive.')
+        self.n_cores = n_cores
 
     def load_feature_values(self, mapobject_type_name, feature_names,
             mapobject_ids=None):
@@ -139,51 +151,51 @@ class Tool(object):
             logger.debug('load values for all objects')
         # FIXME: Use ExperimentSession
         with tm.utils.ExperimentConnection(self.experiment_id) as conn:
-            conn.execute('''
-                SELECT t.id AS mapobject_type_id, f.id AS feature_id, f.name
-                FROM features AS f
-                JOIN mapobject_types AS t ON t.id = f.mapobject_type_id
-                WHERE f.name = ANY(%(feature_names)s)
-                AND t.name = %(mapobject_type_name)s;
-            ''', {
-                'feature_names': feature_names,
-                'mapobject_type_name': mapobject_type_name
-            })
-            records = conn.fetchall()
+            records = self._get_feature_records(
+                conn, mapobject_type_name, feature_names
+            )
             mapobject_type_id = records[0].mapobject_type_id
-            feature_map = {str(r.feature_id): r.name for r in records}
-            sql = '''
-                SELECT
-                    v.mapobject_id, v.tpoint,
-                    slice(v.values, %(feature_ids)s) AS values
-                FROM feature_values AS v
-                JOIN mapobjects AS m
-                ON m.id = v.mapobject_id AND m.partition_key = v.partition_key
-                WHERE m.mapobject_type_id = %(mapobject_type_id)s
-            '''
-            if mapobject_ids is not None:
-                sql += '''
-                AND m.id = ANY(%(mapobject_ids)s)
-                '''
-            conn.execute(sql, {
-                'feature_ids': feature_map.keys(),
-                'mapobject_type_id': mapobject_type_id,
-                'mapobject_ids': mapobject_ids
-            })
-            records = conn.fetchall()
-            values = list()
-            index = list()
-            for r in records:
-                values.append(r.values)
-                index.append((r.mapobject_id, r.tpoint))
-            index = pd.MultiIndex.from_tuples(
-                index, names=['mapobject_id', 'tpoint']
+            cached = self._get_cached_feature_values(
+                records, build=mapobject_ids is None
             )
-
-        # TODO: This probably creates a copy in memory. Can we avoid this?
-        df = pd.DataFrame(values, index=index).astype(float)
-        column_map = {i: name for i, name in feature_map.iteritems()}
-        df.rename(columns=column_map, inplace=True)
+            if cached is not None:
+                ids, tpoints, values = cached
+                if mapobject_ids is not None:
+                    is_selected = np.in1d(ids, mapobject_ids)
+                    ids = ids[is_selected]
+                    tpoints = tpoints[is_selected]
+                    values = values[is_selected, :]
+                index = pd.MultiIndex.from_arrays(
+                    [ids, tpoints], names=['mapobject_id', 'tpoint']
+                )
+                df = pd.DataFrame(
+                    values, index=index, columns=[r.name for r in records],
+                    copy=False
+                )
+            elif any([r.column_index is not None for r in records]):
+                logger.debug('load feature values stored in columnar format')
+                batches = list(self._stream_feature_values(
+                    records, 10**5, mapobject_ids
+                ))
+                if len(batches) > 0:
+                    ids, tpoints, values = [
+                        np.concatenate(arrays) for arrays in zip(*batches)
+                    ]
+                else:
+                    ids = np.array([], dtype=np.int64)
+                    tpoints = np.array([], dtype=np.int64)
+                    values = np.empty((0, len(records)), dtype=np.float32)
+                index = pd.MultiIndex.from_arrays(
+                    [ids, tpoints], names=['mapobject_id', 'tpoint']
+                )
+                df = pd.DataFrame(
+                    values, index=index, columns=[r.name for r in records],
+                    copy=False
+                )
+            else:
+                df = self._load_feature_values_from_hstore(
+                    conn, mapobject_type_id, records, mapobject_ids
+                )
 
         # TODO: How shall we deal with NaN values? Ideally we would expose
         # the option to users to either filter rows (mapobjects) or columns
@@ -195,6 +207,288 @@ class Tool(object):
 
         return df
 
+    def iterate_feature_values(self, mapobject_type_name, feature_names,
+            mapobject_ids=None, batch_size=10**5, as_array=False,
+            mapobject_id_range=None):
+        '''Loads values for each given feature of the given mapobject type
+        in batches. In contrast to
+        :meth:`load_feature_values <tmlib.tools.base.Tool.load_feature_values>`
+        only one batch of values is held in memory at a time, such that
+        feature values of arbitrarily many mapobjects can be processed.
+
+        Parameters
+        ----------
+        mapobject_type_name: str
+            name of the selected
+            :class:`MapobjectType <tmlib.models.mapobject.MapobjectType>`
+        feature_names: List[str]
+            name of each selected
+            :class:`Feature <tmlib.models.feature.Feature>`
+        mapobject_ids: List[int], optional
+            ID of each :class:`Mapobject <tmlib.models.mapobject.Mapobject>`
+            for which values should be selected; if ``None`` values for
+            all objects will be loaded (default: ``None``)
+        batch_size: int, optional
+            maximal number of rows (mapobjects) per batch
+            (default: ``100000``)
+        as_array: bool, optional
+            whether batches should be provided as arrays rather than
+            dataframes (default: ``False``)
+        mapobject_id_range: Tuple[int], optional
+            lower and upper bound (inclusive) of IDs of mapobjects
+            for which values should be selected (default: ``None``)
+
+        Returns
+        -------
+        Generator[Union[pandas.DataFrame, Tuple[numpy.ndarray]]]
+            dataframes where columns are features and rows are mapobjects
+            indexable by their ID and time point or, in case `as_array` is
+            ``True``, mapobject IDs, time points and values, where columns of
+            the two-dimensional array of values are features in the order of
+            `feature_names`
+
+        Note
+        ----
+        Records are fetched via a server-side cursor and written into
+        preallocated arrays of type ``numpy.float32``.
+        Missing values are represented as ``NaN``.
+        When the :class:`FeatureValueCache <tmlib.tools.cache.FeatureValueCache>`
+        is enabled and values of all mapobjects are requested, the values are
+        cached upon first request and subsequently read from the cache.
+        '''
+        logger.info(
+            'iterate over feature values for objects of type "%s" in '
+            'batches of size %d', mapobject_type_name, batch_size
+        )
+        logger.debug(
+            'load values for features: "%s"',  '", "'.join(feature_names)
+        )
+        if batch_size < 1:
+            raise ValueError('Argument "batch_size" must be positive.')
+        with tm.utils.ExperimentConnection(self.experiment_id) as conn:
+            records = self._get_feature_records(
+                conn, mapobject_type_name, feature_names
+            )
+        cached = None
+        if mapobject_ids is None:
+            cached = self._get_cached_feature_values(records, build=True)
+        if cached is not None:
+            batches = self._slice_cached_feature_values(
+                cached, batch_size, mapobject_id_range
+            )
+        else:
+            batches = self._stream_feature_values(
+                records, batch_size, mapobject_ids, mapobject_id_range
+            )
+
+        null_counts = np.zeros((len(feature_names), ), dtype=np.int64)
+        for ids, tpoints, values in batches:
+            null_counts += np.isnan(values).sum(axis=0)
+            logger.debug('loaded batch of %d mapobjects', len(ids))
+            if as_array:
+                yield (ids, tpoints, values)
+            else:
+                index = pd.MultiIndex.from_arrays(
+                    [ids, tpoints], names=['mapobject_id', 'tpoint']
+                )
+                yield pd.DataFrame(
+                    values, index=index, columns=feature_names, copy=False
+                )
+
+        for name, count in zip(feature_names, null_counts):
+            if count > 0:
+                logger.warn('feature "%s" contains %d null values', name, count)
+
+    def _stream_feature_values(self, feature_records, batch_size,
+            mapobject_ids=None, mapobject_id_range=None, ordered=False):
+        mapobject_type_id = feature_records[0].mapobject_type_id
+        elements = self._get_feature_value_expressions(feature_records)
+        sql = '''
+            SELECT
+                v.mapobject_id, v.tpoint,
+                ARRAY[{elements}] AS value_array
+            FROM feature_values AS v
+            JOIN mapobjects AS m
+            ON m.id = v.mapobject_id AND m.partition_key = v.partition_key
+            WHERE m.mapobject_type_id = %(mapobject_type_id)s
+        '''.format(elements=', '.join([
+            'COALESCE(%s, \'NaN\')' % e for e in elements
+        ]))
+        if mapobject_ids is not None:
+            sql += '''
+            AND m.id = ANY(%(mapobject_ids)s)
+            '''
+        if mapobject_id_range is not None:
+            sql += '''
+            AND m.id BETWEEN %(lower)s AND %(upper)s
+            AND v.mapobject_id BETWEEN %(lower)s AND %(upper)s
+            '''
+        else:
+            mapobject_id_range = (None, None)
+        if ordered:
+            sql += '''
+            ORDER BY v.mapobject_id, v.tpoint
+            '''
+        n_features = len(feature_records)
+        with tm.utils.ExperimentConnection(
+                self.experiment_id, transaction=True) as conn:
+            cursor = conn.create_server_side_cursor('feature_values')
+            try:
+                cursor.execute(sql, {
+                    'mapobject_type_id': mapobject_type_id,
+                    'mapobject_ids': mapobject_ids,
+                    'lower': mapobject_id_range[0],
+                    'upper': mapobject_id_range[1]
+                })
+                while True:
+                    values = np.empty(
+                        (batch_size, n_features), dtype=np.float32
+                    )
+                    ids = np.empty((batch_size, ), dtype=np.int64)
+                    tpoints = np.empty((batch_size, ), dtype=np.int64)
+                    n = 0
+                    for r in cursor.fetchmany(batch_size):
+                        ids[n] = r.mapobject_id
+                        tpoints[n] = r.tpoint
+                        values[n, :] = r.value_array
+                        n += 1
+                    if n == 0:
+                        break
+                    if n < batch_size:
+                        values = values[:n, :]
+                        ids = ids[:n]
+                        tpoints = tpoints[:n]
+                    yield (ids, tpoints, values)
+            finally:
+                cursor.close()
+
+    def _get_cached_feature_values(self, feature_records, build=False):
+        cache = FeatureValueCache(self.experiment_id)
+        if not cache.is_enabled:
+            return None
+        mapobject_type_id = feature_records[0].mapobject_type_id
+        feature_ids = [r.feature_id for r in feature_records]
+        cached = cache.get(mapobject_type_id, feature_ids)
+        if cached is not None or not build:
+            return cached
+        with tm.utils.ExperimentConnection(self.experiment_id) as conn:
+            conn.execute('''
+                SELECT count(*) FROM feature_values AS v
+                JOIN mapobjects AS m
+                ON m.id = v.mapobject_id AND m.partition_key = v.partition_key
+                WHERE m.mapobject_type_id = %(mapobject_type_id)s
+            ''', {
+                'mapobject_type_id': mapobject_type_id
+            })
+            n = conn.fetchone().count
+        if n == 0:
+            return None
+        batches = self._stream_feature_values(
+            feature_records, 10**5, ordered=True
+        )
+        return cache.put(mapobject_type_id, feature_ids, batches, n)
+
+    @staticmethod
+    def _slice_cached_feature_values(cached, batch_size,
+            mapobject_id_range=None):
+        # Cached values are sorted by mapobject ID, such that ranges can be
+        # selected via binary search. Batches are views of the memory-mapped
+        # arrays.
+        ids, tpoints, values = cached
+        if mapobject_id_range is not None:
+            start = np.searchsorted(ids, mapobject_id_range[0], side='left')
+            end = np.searchsorted(ids, mapobject_id_range[1], side='right')
+        else:
+            start, end = 0, len(ids)
+        for i in xrange(start, end, batch_size):
+            j = min(i + batch_size, end)
+            yield (ids[i:j], tpoints[i:j], values[i:j, :])
+
+    @staticmethod
+    def _get_feature_value_expressions(feature_records):
+        # Builds an SQL expression of type REAL for each feature, which
+        # selects the value from the "feature_values" table aliased as "v".
+        expressions = list()
+        for r in feature_records:
+            hstore_expression = '(v.values -> \'%d\')::real' % r.feature_id
+            if r.column_index is None:
+                expressions.append(hstore_expression)
+            else:
+                # Values of a feature with a column index may nevertheless be
+                # stored only in hstore format for individual rows (e.g. when
+                # they were written while columnar storage was disabled).
+                # The array (element) is NULL in this case.
+                # NOTE: Arrays are one-based in PostgreSQL.
+                expressions.append(
+                    'COALESCE(v.value_array[%d], %s)' % (
+                        r.column_index + 1, hstore_expression
+                    )
+                )
+        return expressions
+
+    def _get_feature_records(self, conn, mapobject_type_name, feature_names):
+        conn.execute('''
+            SELECT
+                t.id AS mapobject_type_id, f.id AS feature_id, f.name,
+                f.column_index
+            FROM features AS f
+            JOIN mapobject_types AS t ON t.id = f.mapobject_type_id
+            WHERE f.name = ANY(%(feature_names)s)
+            AND t.name = %(mapobject_type_name)s;
+        ''', {
+            'feature_names': feature_names,
+            'mapobject_type_name': mapobject_type_name
+        })
+        records = conn.fetchall()
+        if len(records) != len(set(feature_names)):
+            missing = set(feature_names) - {r.name for r in records}
+            raise ValueError(
+                'Features of mapobject type "%s" do not exist: "%s"' % (
+                    mapobject_type_name, '", "'.join(missing)
+                )
+            )
+        # Order records according to the requested features, such that
+        # columns of loaded values are consistent across calls.
+        feature_lut = {r.name: r for r in records}
+        return [feature_lut[name] for name in feature_names]
+
+    def _load_feature_values_from_hstore(self, conn, mapobject_type_id,
+            feature_records, mapobject_ids):
+        feature_map = {str(r.feature_id): r.name for r in feature_records}
+        sql = '''
+            SELECT
+                v.mapobject_id, v.tpoint,
+                slice(v.values, %(feature_ids)s) AS values
+            FROM feature_values AS v
+            JOIN mapobjects AS m
+            ON m.id = v.mapobject_id AND m.partition_key = v.partition_key
+            WHERE m.mapobject_type_id = %(mapobject_type_id)s
+        '''
+        if mapobject_ids is not None:
+            sql += '''
+            AND m.id = ANY(%(mapobject_ids)s)
+            '''
+        conn.execute(sql, {
+            'feature_ids': feature_map.keys(),
+            'mapobject_type_id': mapobject_type_id,
+            'mapobject_ids': mapobject_ids
+        })
+        records = conn.fetchall()
+        values = list()
+        index = list()
+        for r in records:
+            values.append(r.values)
+            index.append((r.mapobject_id, r.tpoint))
+        index = pd.MultiIndex.from_tuples(
+            index, names=['mapobject_id', 'tpoint']
+        )
+
+        # TODO: This probably creates a copy in memory. Can we avoid this?
+        df = pd.DataFrame(values, index=index).astype(float)
+        column_map = {i: name for i, name in feature_map.iteritems()}
+        df.rename(columns=column_map, inplace=True)
+        return df.reindex(columns=[r.name for r in feature_records])
+
     def calculate_extrema(self, mapobject_type_name, feature_name):
         '''Calculates minimum and maximum values of a given feature and
         mapobject type.
@@ -212,33 +506,57 @@ class Tool(object):
         -------
         Tuple[float]
             min and max
+
+        Note
+        ----
+        Extrema are looked up in
+        :class:`FeatureStatistics <tmlib.models.feature.FeatureStatistics>`
+        if available and only calculated from feature values otherwise.
         '''
-        logger.info(
-            'calculate min/max for objects of type "%s" and feature "%s"',
-            mapobject_type_name, feature_name
-        )
         with tm.utils.ExperimentSession(self.experiment_id) as session:
             mapobject_type = session.query(tm.MapobjectType.id).\
                 filter_by(name=mapobject_type_name).\
                 one()
-            feature = session.query(tm.Feature.id).\
+            feature = session.query(tm.Feature.id, tm.Feature.column_index).\
                 filter_by(
                     name=feature_name, mapobject_type_id=mapobject_type.id
                 ).\
                 one()
 
-            lower, upper = session.query(
-                    func.min(
-                        tm.FeatureValues.values[str(feature.id)].cast(FLOAT)
-                    ),
-                    func.max(
-                        tm.FeatureValues.values[str(feature.id)].cast(FLOAT)
-                    )
+            n_tpoints, lower, upper = session.query(
+                    func.count(tm.FeatureStatistics.id),
+                    func.min(tm.FeatureStatistics.min),
+                    func.max(tm.FeatureStatistics.max)
+                ).\
+                filter(
+                    tm.FeatureStatistics.feature_id == feature.id,
+                    tm.FeatureStatistics.count > 0
                 ).\
+                one()
+            if n_tpoints > 0:
+                logger.info(
+                    'use statistics of objects of type "%s" and feature "%s"',
+                    mapobject_type_name, feature_name
+                )
+                return (lower, upper)
+
+            logger.info(
+                'calculate min/max for objects of type "%s" and feature "%s"',
+                mapobject_type_name, feature_name
+            )
+            value = tm.FeatureValues.values[str(feature.id)].cast(FLOAT)
+            if feature.column_index is not None:
+                # Rows without values in columnar format fall back to hstore.
+                # NOTE: Arrays are one-based in PostgreSQL.
+                value = func.coalesce(
+                    tm.FeatureValues.value_array[feature.column_index + 1],
+                    value
+                )
+            lower, upper = session.query(func.min(value), func.max(value)).\
                 join(tm.Mapobject).\
                 filter(
                     tm.Mapobject.mapobject_type_id == mapobject_type.id,
-                    tm.FeatureValues.values[str(feature.id)] != 'nan'
+                    value != float('nan')
                 ).\
                 one()
 
@@ -257,22 +575,135 @@ class Tool(object):
 
         Returns
         -------
-        Tuple[int]
+        List[int]
             IDs of selected mapobject
+
+        See also
+        --------
+        :meth:`tmlib.tools.base.Tool._sample_mapobject_ids`
         '''
-        with tm.utils.ExperimentSession(self.experiment_id) as session:
-            mapobject_type = session.query(tm.MapobjectType.id).\
-                filter_by(name=mapobject_type_name).\
-                one()
-            mapobjects = session.query(tm.Mapobject.id).\
-                filter_by(mapobject_type_id=mapobject_type.id).\
-                order_by(func.random()).\
-                limit(n).\
-                all()
-            return [m.id for m in mapobjects]
+        with tm.utils.ExperimentConnection(self.experiment_id) as conn:
+            mapobject_type_id = self._get_mapobject_type_id(
+                conn, mapobject_type_name
+            )
+            conn.execute('''
+                SELECT count(*) FROM mapobjects
+                WHERE mapobject_type_id = %(mapobject_type_id)s
+            ''', {
+                'mapobject_type_id': mapobject_type_id
+            })
+            count = conn.fetchone().count
+        mapobject_ids = self._sample_mapobject_ids(mapobject_type_id, count, n)
+        np.random.shuffle(mapobject_ids)
+        return mapobject_ids.tolist()
+
+    @staticmethod
+    def _get_mapobject_type_id(conn, mapobject_type_name):
+        conn.execute('''
+            SELECT id FROM mapobject_types
+            WHERE name = %(mapobject_type_name)s
+        ''', {
+            'mapobject_type_name': mapobject_type_name
+        })
+        record = conn.fetchone()
+        if record is None:
+            raise ValueError(
+                'Mapobject type "%s" does not exist.' % mapobject_type_name
+            )
+        return record.id
+
+    def _sample_mapobject_ids(self, mapobject_type_id, count, n):
+        '''Selects IDs of `n` mapobjects at random.
+
+        Parameters
+        ----------
+        mapobject_type_id: int
+            ID of the :class:`MapobjectType <tmlib.models.mapobject.MapobjectType>`
+        count: int
+            total number of mapobjects of the type
+        n: int
+            number of mapobjects that should be selected
+
+        Returns
+        -------
+        numpy.ndarray[numpy.int64]
+            IDs of at most `n` mapobjects in arbitrary order
+
+        Note
+        ----
+        Mapobjects are first sampled via ``TABLESAMPLE SYSTEM``, which selects
+        random table blocks rather than sorting the entire table.
+        When this yields fewer than `n` objects (which can happen, since the
+        number of selected rows varies with the number of rows per block), IDs
+        get streamed from the database and sampled via reservoir sampling
+        instead. In both cases, memory consumption only depends on `n`.
+        '''
+        if count == 0 or n == 0:
+            return np.array([], dtype=np.int64)
+        if n < count:
+            # Oversample to reduce the risk of having to fall back to
+            # reservoir sampling.
+            percent = min(100.0, 150.0 * n / count)
+            logger.debug('sample %.3f%% of mapobjects', percent)
+            with tm.utils.ExperimentConnection(self.experiment_id) as conn:
+                conn.execute('''
+                    SELECT m.id FROM mapobjects AS m
+                    TABLESAMPLE SYSTEM (%(percent)s)
+                    WHERE m.mapobject_type_id = %(mapobject_type_id)s
+                ''', {
+                    'percent': percent,
+                    'mapobject_type_id': mapobject_type_id
+                })
+                mapobject_ids = np.array(
+                    [r.id for r in conn.fetchall()], dtype=np.int64
+                )
+            if len(mapobject_ids) >= n:
+                np.random.shuffle(mapobject_ids)
+                return mapobject_ids[:n]
+            logger.debug(
+                'table sample contains only %d mapobjects, fall back to '
+                'reservoir sampling', len(mapobject_ids)
+            )
+
+        reservoir = np.empty((min(n, count), ), dtype=np.int64)
+        i = 0
+        with tm.utils.ExperimentConnection(
+                self.experiment_id, transaction=True) as conn:
+            cursor = conn.create_server_side_cursor('mapobject_ids')
+            try:
+                cursor.execute('''
+                    SELECT id FROM mapobjects
+                    WHERE mapobject_type_id = %(mapobject_type_id)s
+                ''', {
+                    'mapobject_type_id': mapobject_type_id
+                })
+                while True:
+                    records = cursor.fetchmany(10**5)
+                    if not records:
+                        break
+                    ids = np.array([r.id for r in records], dtype=np.int64)
+                    # Fill the reservoir with the first n objects.
+                    m = max(0, min(len(ids), n - i))
+                    reservoir[i:i + m] = ids[:m]
+                    # Replace elements of the reservoir with decreasing
+                    # probability n / (position + 1) (Algorithm R). When an
+                    # index is drawn repeatedly, the later object wins.
+                    positions = np.arange(i + m, i + len(ids))
+                    if len(positions) > 0:
+                        j = (
+                            np.random.random_sample(len(positions)) *
+                            (positions + 1)
+                        ).astype(np.int64)
+                        is_selected = j < n
+                        reservoir[j[is_selected]] = ids[m:][is_selected]
+                    i += len(ids)
+            finally:
+                cursor.close()
+        return reservoir[:min(i, len(reservoir))]
 
     def partition_mapobjects(self, mapobject_type_name, n):
-        '''Splits mapobjects into partitions of size `n`.
+        '''Splits mapobjects into ranges of consecutive IDs, such that each
+        range contains approximately `n` mapobjects.
 
         Parameters
         ----------
@@ -280,26 +711,62 @@ class Tool(object):
             name of the selected
             :class:`MapobjectType <tmlib.models.mapobject.MapobjectType>`
         n: int
-            number of mapobjects per partition
+            number of mapobjects per range
 
         Returns
         -------
-        List[List[int]]
-            mapobject IDs
+        Generator[Tuple[int]]
+            lower and upper bound (inclusive) of mapobject IDs
 
         Note
         ----
-        Mapobjects are ordered by ID.
+        Boundaries of ranges are percentiles of a random sample of mapobject
+        IDs (see :meth:`tmlib.tools.base.Tool._sample_mapobject_ids`), such
+        that only the sample needs to be transferred from the database server
+        rather than IDs of all mapobjects. Each range can be selected
+        efficiently via an index range scan. The number of mapobjects per
+        range deviates from `n` by the sampling error.
         '''
-        with tm.utils.ExperimentSession(self.experiment_id) as session:
-            mapobject_type = session.query(tm.MapobjectType.id).\
-                filter_by(name=mapobject_type_name).\
-                one()
-            mapobjects = session.query(tm.Mapobject.id).\
-                filter_by(mapobject_type_id=mapobject_type.id).\
-                order_by(tm.Mapobject.id).\
-                all()
-            return create_partitions([m.id for m in mapobjects], n)
+        if n < 1:
+            raise ValueError('Argument "n" must be positive.')
+        with tm.utils.ExperimentConnection(self.experiment_id) as conn:
+            mapobject_type_id = self._get_mapobject_type_id(
+                conn, mapobject_type_name
+            )
+            conn.execute('''
+                SELECT count(*), min(id) AS lower, max(id) AS upper
+                FROM mapobjects
+                WHERE mapobject_type_id = %(mapobject_type_id)s
+            ''', {
+                'mapobject_type_id': mapobject_type_id
+            })
+            record = conn.fetchone()
+        if record.count == 0:
+            return
+        n_ranges = int(np.ceil(record.count / float(n)))
+        if n_ranges > 1:
+            # About 100 samples per range keep the relative deviation of the
+            # size of ranges at around 10%.
+            sample = self._sample_mapobject_ids(
+                mapobject_type_id, record.count, 100 * n_ranges
+            )
+            boundaries = np.unique(np.percentile(
+                sample, np.linspace(0, 100, n_ranges + 1)[1:-1],
+                interpolation='lower'
+            ).astype(np.int64))
+            boundaries = boundaries[
+                (boundaries > record.lower) & (boundaries <= record.upper)
+            ]
+        else:
+            boundaries = np.array([], dtype=np.int64)
+        lower_bounds = np.concatenate([[record.lower], boundaries])
+        upper_bounds = np.concatenate([boundaries - 1, [record.upper]])
+        logger.debug(
+            'partition %d mapobjects into %d ranges',
+            record.count, len(lower_bounds)
+        )
+        for lower, upper in zip(lower_bounds, upper_bounds):
+            yield (int(lower), int(upper))
 
     def identify_features_with_null_values(self, feature_data):
         '''Identifies features with NULL values (including NaNs).
@@ -338,8 +805,8 @@ class Tool(object):
         :class:`tmlib.models.result.LabelValues`
         '''
         logger.info('save label values for result %d', result_id)
-        mapobject_ids = data.index.levels[0].tolist()
-        tpoints = data.index.levels[1]
+        mapobject_ids = data.index.get_level_values(0).values
+        tpoints = data.index.get_level_values(1).values
         with tm.utils.ExperimentConnection(self.experiment_id) as connection:
             connection.execute('''
                 SELECT id FROM mapobject_types
@@ -350,64 +817,153 @@ class Tool(object):
             results = connection.fetchall()
             mapobject_type_id = results[0][0]
             connection.execute('''
-                SELECT partition_key, array_agg(id) AS mapobject_ids
-                FROM mapobjects AS m
+                SELECT id, partition_key FROM mapobjects AS m
                 WHERE m.mapobject_type_id = %(mapobject_type_id)s
                 AND m.id = ANY(%(mapobject_ids)s)
-                GROUP BY partition_key
+                ORDER BY id
             ''', {
                 'mapobject_type_id': mapobject_type_id,
-                'mapobject_ids': mapobject_ids
+                'mapobject_ids': np.unique(mapobject_ids).tolist()
             })
             records = connection.fetchall()
+            known_ids = np.array([r.id for r in records], dtype=np.int64)
+            known_keys = np.array(
+                [r.partition_key for r in records], dtype=np.int64
+            )
 
-        # Grouping mapobject IDs per partition_key allows us
-        # to target individual shards of the label_values table directly
-        # on the worker nodes with full SQL support, including multi-row
-        # insert/update statements.
-        for tpoint in tpoints:
-            for partition_key, mapobject_ids in records:
-                with tm.utils.ExperimentConnection(self.experiment_id) as conn:
-                    host, port, shard_id = conn.locate_partition(
-                        tm.LabelValues, partition_key
-                    )
-                worker_connection = tm.utils.ExperimentWorkerConnection(
-                    self.experiment_id, host, port
-                )
-                with worker_connection as connection:
+        if len(known_ids) == 0:
+            logger.warn('no mapobjects found for label values')
+            return
+        # Look up the partition key of each value and drop values of
+        # mapobjects that don't belong to the given type.
+        index = np.searchsorted(known_ids, mapobject_ids)
+        index[index == len(known_ids)] = 0
+        is_known = known_ids[index] == mapobject_ids
+        if not np.all(is_known):
+            logger.warn(
+                'skip %d values of unknown mapobjects',
+                np.count_nonzero(~is_known)
+            )
+        partition_keys = known_keys[index[is_known]]
+        mapobject_ids = mapobject_ids[is_known]
+        tpoints = tpoints[is_known]
+        values = np.round(data.values[is_known].astype(np.float64), 6)
+
+        self._upsert_values(
+            tm.LabelValues, partition_keys, mapobject_ids, tpoints,
+            np.char.add('%d=>' % result_id, values.astype(str))
+        )
+        # Label values cached for the result are outdated.
+        with tm.utils.ExperimentConnection(self.experiment_id) as connection:
+            connection.execute('''
+                UPDATE tool_results SET revision = coalesce(revision, 0) + 1
+                WHERE id = %(result_id)s
+            ''', {
+                'result_id': result_id
+            })
+
+    def _upsert_values(self, model, partition_keys, mapobject_ids, tpoints,
+            values):
+        '''Inserts or updates entries of a distributed table with a "values"
+        column of type ``HSTORE``, merging values of existing entries.
+
+        Parameters
+        ----------
+        model: class
+            :class:`LabelValues <tmlib.models.result.LabelValues>` or
+            :class:`FeatureValues <tmlib.models.feature.FeatureValues>`
+        partition_keys: numpy.ndarray[int]
+            partition key of each entry
+        mapobject_ids: numpy.ndarray[int]
+            ID of the parent mapobject of each entry
+        tpoints: numpy.ndarray[int]
+            time point of each entry
+        values: numpy.ndarray[str]
+            values of each entry in text representation of ``HSTORE``,
+            e.g. ``"1=>0.5,2=>1.0"``
+        '''
+        with tm.utils.ExperimentConnection(self.experiment_id) as connection:
+            placements = connection.locate_partitions(
+                model, np.unique(partition_keys).tolist()
+            )
+
+        # Grouping values per shard allows us to target individual shards of
+        # the table directly on the worker nodes with full SQL support.
+        # Shards on the same node are processed sequentially, different nodes
+        # in parallel.
+        shard_lut = {k: p[2] for k, p in placements.iteritems()}
+        shard_ids = np.array(
+            [shard_lut[k] for k in partition_keys], dtype=np.int64
+        )
+        order = np.argsort(shard_ids, kind='mergesort')
+        unique_shard_ids, offsets = np.unique(
+            shard_ids[order], return_index=True
+        )
+        node_lut = {p[2]: (p[0], p[1]) for p in placements.itervalues()}
+        nodes = collections.defaultdict(list)
+        for shard_id, indices in zip(
+                unique_shard_ids, np.split(order, offsets[1:])):
+            nodes[node_lut[shard_id]].append((shard_id, indices))
+
+        def upsert(node_batches):
+            for (host, port), shards in node_batches:
+                for shard_id, indices in shards:
                     logger.debug(
-                        'upsert label values for partition %d', partition_key
+                        'upsert %d entries of table "%s" for shard %d',
+                        len(indices), model.__table__.name, shard_id
                     )
-                    sql = '''
-                        INSERT INTO label_values_{shard} AS v (
-                            partition_key, mapobject_id, values, tpoint
-                        )
-                        VALUES %s
-                        ON CONFLICT ON CONSTRAINT label_values_pkey_{shard}
-                        DO UPDATE
-                        SET values = v.values || EXCLUDED.values
-                    '''.format(shard=shard_id)
-                    template = '''
-                        (
-                            %(partition_key)s, %(mapobject_id)s,
-                            %(values)s, %(tpoint)s
-                        )
-                    '''
-                    args = [
-                        {
-                            'values': {
-                                str(result_id):
-                                    str(np.round(data.ix[(mid, tpoint)], 6))
-                            },
-                            'mapobject_id': mid,
-                            'partition_key': partition_key,
-                            'tpoint': tpoint
-                        }
-                        for mid in mapobject_ids
-                    ]
-                    execute_values(
-                        connection, sql, args, template=template, page_size=500
+                    # Each shard is upserted in a separate transaction, such
+                    # that the staging table gets dropped even upon failure
+                    # and doesn't persist on the pooled connection.
+                    worker_connection = tm.utils.ExperimentWorkerConnection(
+                        self.experiment_id, host, port, transaction=True
                     )
+                    with worker_connection as connection:
+                        self._upsert_shard_values(
+                            connection, model.__table__.name, shard_id,
+                            partition_keys[indices], mapobject_ids[indices],
+                            tpoints[indices], values[indices]
+                        )
+            return list()
+
+        tm.utils.parallelize_query(upsert, nodes.items())
+
+    @staticmethod
+    def _upsert_shard_values(connection, table, shard_id, partition_keys,
+            mapobject_ids, tpoints, values):
+        f = StringIO()
+        w = csv.writer(f, delimiter=';')
+        w.writerows(zip(
+            partition_keys.tolist(), mapobject_ids.tolist(), tpoints.tolist(),
+            values.tolist()
+        ))
+        f.seek(0)
+        staging_table = '{table}_staging_{shard}'.format(
+            table=table, shard=shard_id
+        )
+        connection.execute('''
+            CREATE TEMP TABLE {staging_table} (
+                partition_key integer, mapobject_id bigint, tpoint integer,
+                values hstore
+            ) ON COMMIT DROP
+        '''.format(staging_table=staging_table))
+        connection.copy_from(
+            f, staging_table, sep=';',
+            columns=('partition_key', 'mapobject_id', 'tpoint', 'values')
+        )
+        f.close()
+        connection.execute('''
+            INSERT INTO {table}_{shard} AS v (
+                partition_key, mapobject_id, values, tpoint
+            )
+            SELECT s.partition_key, s.mapobject_id, s.values, s.tpoint
+            FROM {staging_table} AS s
+            ON CONFLICT ON CONSTRAINT {table}_pkey_{shard}
+            DO UPDATE
+            SET values = v.values || EXCLUDED.values
+        '''.format(
+            table=table, shard=shard_id, staging_table=staging_table
+        ))
 
     def register_result(self, submission_id, mapobject_type_name,
             result_type, **result_attributes):
@@ -496,8 +1052,8 @@ class Classifier(Tool):
     __abstract__ = True
 
     @same_docstring_as(Tool.__init__)
-    def __init__(self, experiment_id):
-        super(Classifier, self).__init__(experiment_id)
+    def __init__(self, experiment_id, n_cores=1):
+        super(Classifier, self).__init__(experiment_id, n_cores)
 
     def train_supervised(self, feature_data, labels, method, n_fold_cv):
         '''Trains a classifier for mapobjects based on `feature_data` and
@@ -523,7 +1079,6 @@ class Classifier(Tool):
 
         classifiers = {
             'randomforest': {
-                # NOTE: RF could be parallelized.
                 'cls': RandomForestClassifier(n_jobs=1),
                 # No scaling required for decision trees.
                 'scaler': None,
@@ -579,7 +1134,20 @@ class Classifier(Tool):
         clf = classifiers[method]['cls']
         folds = KFold(n_splits=n_fold_cv)
         # TODO: Second, finer grid search
-        model = GridSearchCV(clf, classifiers[method]['search_space'], cv=folds)
+        # NOTE: Candidate parameter sets are evaluated in parallel, while
+        # each individual fit is serial to prevent oversubscription of cores.
+        logger.debug('perform grid search using %d cores', self.n_cores)
+        search = GridSearchCV(
+            clf, classifiers[method]['search_space'], cv=folds,
+            n_jobs=self.n_cores, refit=False
+        )
+        search.fit(X, y)
+        logger.debug('best parameters: %r', search.best_params_)
+        model = clone(clf).set_params(**search.best_params_)
+        if 'n_jobs' in model.get_params():
+            # The final model can make use of all cores for fitting and
+            # prediction, e.g. by building trees of a forest in parallel.
+            model.set_params(n_jobs=self.n_cores)
         model.fit(X, y)
         return (model, scaler)
 
@@ -614,10 +1182,173 @@ class Classifier(Tool):
             scaler.fit(X)
             X = scaler.transform(X)
         clf = classifiers[method]['cls']
-        model = clf(n_clusters=k)
+        model = clf(n_clusters=k, n_jobs=self.n_cores)
         model.fit(X)
         return (model, scaler)
 
+    def train_unsupervised_incrementally(self, feature_data, batches, k,
+            method, n_components=None):
+        '''Trains a classifier that groups mapobjects into `k` classes
+        incrementally on batches of feature values, such that the entire
+        dataset never needs to be held in memory.
+
+        Parameters
+        ----------
+        feature_data: pandas.DataFrame
+            feature values of a random subset of mapobjects that should be
+            used to fit the scaler and to initialize the classifier
+        batches: function
+            function without arguments that returns an iterable of
+            :class:`pandas.DataFrame` with feature values of all mapobjects
+        k: int
+            number of classes
+        method: str
+            model to use for clustering
+        n_components: int, optional
+            number of principal components that should be used for training
+            instead of the features; if ``None`` features are used directly
+            (default: ``None``)
+
+        Returns
+        -------
+        Tuple[sklearn.base.BaseEstimator]
+            trained unsupervised classifier and scaler
+
+        Note
+        ----
+        Batches are iterated once for fitting the principal components (if
+        requested) and once for fitting the classifier.
+        '''
+        classifiers = {
+            'minibatch_kmeans': {
+                'cls': MiniBatchKMeans,
+                'scaler': RobustScaler(quantile_range=(1.0, 99.0), copy=False)
+            }
+        }
+        logger.info(
+            'train "%s" classifier for %d classes incrementally', method, k
+        )
+        scaler = classifiers[method]['scaler']
+        if scaler:
+            scaler.fit(feature_data)
+            transform = scaler.transform
+        else:
+            transform = lambda X: X
+        pca = None
+        if n_components is not None:
+            logger.info('fit %d principal components', n_components)
+            pca = IncrementalPCA(n_components=n_components)
+            for X in batches():
+                # Each batch must have at least as many samples as
+                # components.
+                if X.shape[0] < n_components:
+                    continue
+                pca.partial_fit(transform(X))
+            transform = lambda X, t=transform: pca.transform(t(X))
+        clf = classifiers[method]['cls']
+        model = clf(n_clusters=k)
+        # Centers get initialized based on the random subset. Subsequent
+        # batches are ordered by mapobject ID and are thus not random.
+        model.partial_fit(transform(feature_data))
+        for i, X in enumerate(batches()):
+            logger.debug('fit classifier on batch #%d', i)
+            model.partial_fit(transform(X))
+        if pca is not None:
+            model = make_pipeline(pca, model)
+        return (model, scaler)
+
+    def predict_and_save(self, mapobject_type_name, result_id, batches,
+            model, scaler=None):
+        '''Predicts class labels for batches of mapobjects and saves them.
+        Loading of the next batch, prediction of the current batch and saving
+        of the previous batch are performed concurrently.
+
+        Parameters
+        ----------
+        mapobject_type_name: str
+            name of the selected
+            :class:`MapobjectType <tmlib.models.mapobject.MapobjectType>`
+        result_id: int
+            ID of a registerd
+            :class:`ToolResult <tmlib.models.result.ToolResult>`
+        batches: Iterable[pandas.DataFrame]
+            feature values based on which labels should be predicted
+        model: sklearn.base.BaseEstimator
+            model fitted on training data
+        scaler: sklearn.preprocessing.data.RobustScaler, optional
+            scaler fitted on training data to rescale feature values the same
+            way
+
+        See also
+        --------
+        :meth:`predict <tmlib.tools.base.Classifier.predict>`
+        :meth:`save_result_values <tmlib.tools.base.Tool.save_result_values>`
+        '''
+        # Queues hold at most one batch, such that not more than three
+        # batches are held in memory at a time.
+        loaded = Queue.Queue(maxsize=1)
+        predicted = Queue.Queue(maxsize=1)
+        errors = list()
+        stop = object()
+
+        def load():
+            try:
+                for batch in batches:
+                    loaded.put(batch)
+                    if errors:
+                        break
+            except Exception as error:
+                logger.error('loading of batch failed: %s', error)
+                errors.append(error)
+            finally:
+                loaded.put(stop)
+
+        def save():
+            while True:
+                labels = predicted.get()
+                if labels is stop:
+                    break
+                if errors:
+                    continue
+                try:
+                    self.save_result_values(
+                        mapobject_type_name, result_id, labels
+                    )
+                except Exception as error:
+                    logger.error('saving of batch failed: %s', error)
+                    errors.append(error)
+
+        loader = threading.Thread(target=load)
+        saver = threading.Thread(target=save)
+        loader.start()
+        saver.start()
+        i = 0
+        try:
+            while True:
+                batch = loaded.get()
+                if batch is stop:
+                    break
+                if errors:
+                    continue
+                logger.info('predict labels for batch #%d', i)
+                predicted.put(self.predict(batch, model, scaler))
+                i += 1
+        except Exception as error:
+            errors.append(error)
+            # Unblock the loader, which may wait for the queue.
+            while loader.is_alive():
+                try:
+                    loaded.get(timeout=1)
+                except Queue.Empty:
+                    pass
+            raise
+        finally:
+            predicted.put(stop)
+            loader.join()
+            saver.join()
+        if errors:
+            raise errors[0]
+
     def predict(self, feature_data, model, scaler=None):
         '''Predicts class labels for mapobjects based on `feature_values` using
         pre-trained `model`.
@@ -0,0 +1,259 @@
+# TmLibrary - TissueMAPS library for distibuted image analysis routines.
+# Copyright (C) 2016  Markus D. Herrmann, University of Zurich and Robin Hafen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''On-disk cache of feature values for data analysis tools.'''
+import os
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import numpy as np
+
+from tmlib import cfg
+
+logger = logging.getLogger(__name__)
+
+
+class FeatureValueCache(object):
+
+    '''Cache of feature values of all mapobjects of a given type for a given
+    set of features, stored as uncompressed NumPy arrays in the filesystem.
+
+    Arrays are memory-mapped upon loading, such that values don't need to be
+    read into memory at once and can be shared between processes.
+    Entries of all experiments share a common size limit. When the limit is
+    exceeded, least recently used entries get deleted.
+
+    See also
+    --------
+    :attr:`tmlib.config.LibraryConfig.feature_cache_location`
+    :attr:`tmlib.config.LibraryConfig.feature_cache_size`
+    '''
+
+    def __init__(self, experiment_id):
+        '''
+        Parameters
+        ----------
+        experiment_id: int
+            ID of the experiment for which values should be cached
+        '''
+        self.experiment_id = experiment_id
+        self.location = cfg.feature_cache_location
+        self.max_size = cfg.feature_cache_size * 1024 ** 3
+
+    @property
+    def is_enabled(self):
+        '''bool: whether the cache is enabled'''
+        return self.max_size > 0
+
+    def _get_mapobject_type_location(self, mapobject_type_id):
+        return os.path.join(
+            self.location, 'experiment_%d' % self.experiment_id,
+            'mapobject_type_%d' % mapobject_type_id
+        )
+
+    def _get_entry_location(self, mapobject_type_id, feature_ids):
+        key = hashlib.sha1(','.join([str(i) for i in feature_ids]))
+        return os.path.join(
+            self._get_mapobject_type_location(mapobject_type_id),
+            key.hexdigest()
+        )
+
+    def get(self, mapobject_type_id, feature_ids):
+        '''Gets cached feature values.
+
+        Parameters
+        ----------
+        mapobject_type_id: int
+            ID of the parent
+            :class:`MapobjectType <tmlib.models.mapobject.MapobjectType>`
+        feature_ids: List[int]
+            ID of each :class:`Feature <tmlib.models.feature.Feature>`
+
+        Returns
+        -------
+        Union[Tuple[numpy.memmap], None]
+            mapobject IDs, time points and values sorted by mapobject ID,
+            where columns of the two-dimensional array of values are features
+            in the order of `feature_ids`, or ``None`` if values are not
+            cached
+
+        Note
+        ----
+        Arrays are mapped in copy-on-write mode, i.e. they can be modified
+        in memory without affecting the cache.
+        '''
+        location = self._get_entry_location(mapobject_type_id, feature_ids)
+        try:
+            mapobject_ids = np.load(
+                os.path.join(location, 'mapobject_ids.npy'), mmap_mode='c'
+            )
+            tpoints = np.load(
+                os.path.join(location, 'tpoints.npy'), mmap_mode='c'
+            )
+            values = np.load(
+                os.path.join(location, 'values.npy'), mmap_mode='c'
+            )
+        except IOError:
+            return None
+        logger.debug('use cached feature values: %s', location)
+        try:
+            # The modification time tracks usage of the entry.
+            os.utime(location, None)
+        except OSError:
+            pass
+        return (mapobject_ids, tpoints, values)
+
+    def put(self, mapobject_type_id, feature_ids, batches, n):
+        '''Writes feature values into the cache.
+
+        Parameters
+        ----------
+        mapobject_type_id: int
+            ID of the parent
+            :class:`MapobjectType <tmlib.models.mapobject.MapobjectType>`
+        feature_ids: List[int]
+            ID of each :class:`Feature <tmlib.models.feature.Feature>`
+        batches: Iterable[Tuple[numpy.ndarray]]
+            mapobject IDs, time points and values sorted by mapobject ID
+        n: int
+            total number of rows of all batches
+
+        Returns
+        -------
+        Union[Tuple[numpy.memmap], None]
+            cached feature values or ``None`` if values could not be cached,
+            because the number of rows didn't match `n`
+
+        See also
+        --------
+        :meth:`get <tmlib.tools.cache.FeatureValueCache.get>`
+        '''
+        location = self._get_entry_location(mapobject_type_id, feature_ids)
+        parent_location = os.path.dirname(location)
+        if not os.path.exists(parent_location):
+            try:
+                os.makedirs(parent_location)
+            except OSError:
+                # Directory may have been created by another process.
+                pass
+        # Arrays are written into a temporary directory, which is renamed
+        # once complete, such that readers never see partial entries.
+        tmp_location = tempfile.mkdtemp(prefix='.tmp', dir=parent_location)
+        logger.info('cache feature values of %d mapobjects', n)
+        try:
+            mapobject_ids = np.lib.format.open_memmap(
+                os.path.join(tmp_location, 'mapobject_ids.npy'), mode='w+',
+                dtype=np.int64, shape=(n, )
+            )
+            tpoints = np.lib.format.open_memmap(
+                os.path.join(tmp_location, 'tpoints.npy'), mode='w+',
+                dtype=np.int64, shape=(n, )
+            )
+            values = np.lib.format.open_memmap(
+                os.path.join(tmp_location, 'values.npy'), mode='w+',
+                dtype=np.float32, shape=(n, len(feature_ids))
+            )
+            i = 0
+            for ids, tps, vals in batches:
+                m = len(ids)
+                if i + m > n:
+                    i += m
+                    break
+                mapobject_ids[i:i + m] = ids
+                tpoints[i:i + m] = tps
+                values[i:i + m, :] = vals
+                i += m
+            if i != n:
+                logger.warn(
+                    'number of mapobjects changed while caching feature values'
+                )
+                return None
+            for array in (mapobject_ids, tpoints, values):
+                array.flush()
+            del mapobject_ids, tpoints, values
+            try:
+                os.rename(tmp_location, location)
+            except OSError:
+                # Entry may have been created by another process.
+                logger.debug('feature values are already cached')
+        finally:
+            if os.path.exists(tmp_location):
+                shutil.rmtree(tmp_location, ignore_errors=True)
+        self.evict()
+        return self.get(mapobject_type_id, feature_ids)
+
+    def invalidate(self, mapobject_type_id=None):
+        '''Deletes cached feature values of the experiment.
+
+        Parameters
+        ----------
+        mapobject_type_id: int, optional
+            ID of a :class:`MapobjectType <tmlib.models.mapobject.MapobjectType>`
+            for which values should be deleted; if ``None`` values of all
+            types will be deleted (default: ``None``)
+        '''
+        if mapobject_type_id is None:
+            location = os.path.join(
+                self.location, 'experiment_%d' % self.experiment_id
+            )
+        else:
+            location = self._get_mapobject_type_location(mapobject_type_id)
+        if os.path.exists(location):
+            logger.info('invalidate cached feature values')
+            shutil.rmtree(location, ignore_errors=True)
+
+    def evict(self):
+        '''Deletes least recently used entries of all experiments until the
+        total size of the cache falls below the limit.
+        '''
+        entries = list()
+        if not os.path.exists(self.location):
+            return
+        for experiment_dir in os.listdir(self.location):
+            experiment_location = os.path.join(self.location, experiment_dir)
+            if not os.path.isdir(experiment_location):
+                continue
+            for type_dir in os.listdir(experiment_location):
+                type_location = os.path.join(experiment_location, type_dir)
+                if not os.path.isdir(type_location):
+                    continue
+                for key in os.listdir(type_location):
+                    if key.startswith('.'):
+                        # Entry is still being written.
+                        continue
+                    location = os.path.join(type_location, key)
+                    try:
+                        size = sum([
+                            os.path.getsize(os.path.join(location, f))
+                            for f in os.listdir(location)
+                        ])
+                        entries.append(
+                            (os.path.getmtime(location), size, location)
+                        )
+                    except OSError:
+                        # Entry may have been deleted by another process.
+                        continue
+        total_size = sum([e[1] for e in entries])
+        for last_used, size, location in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            logger.info(
+                'evict cached feature values (last used %s): %s',
+                time.ctime(last_used), location
+            )
+            shutil.rmtree(location, ignore_errors=True)
+            total_size -= size
@@ -39,8 +39,8 @@ class Classification(Classifier):
     __options__ = {'method': ['randomforest', 'svm'], 'n_fold_cv': 10}
 
     @same_docstring_as(Tool.__init__)
-    def __init__(self, experiment_id):
-        super(Classification, self).__init__(experiment_id)
+    def __init__(self, experiment_id, n_cores=1):
+        super(Classification, self).__init__(experiment_id, n_cores)
 
     def process_request(self, submission_id, payload):
         '''Processes a client tool request and inserts the generated result
@@ -104,13 +104,9 @@ class Classification(Classifier):
 
         n_test = 10**5
         logger.debug('set batch size to %d', n_test)
-        batches = self.partition_mapobjects(mapobject_type_name, n_test)
-        for i, mapobject_ids in enumerate(batches):
-            logger.info('predict labels for batch #%d', i)
-            test_set = self.load_feature_values(
-                mapobject_type_name, feature_names, mapobject_ids
-            )
-            predicted_labels = self.predict(test_set, model, scaler)
-            self.save_result_values(
-                mapobject_type_name, result_id, predicted_labels
-            )
+        batches = self.iterate_feature_values(
+            mapobject_type_name, feature_names, batch_size=n_test
+        )
+        self.predict_and_save(
+            mapobject_type_name, result_id, batches, model, scaler
+        )
@@ -31,11 +31,11 @@ class Clustering(Classifier):
 
     __description__ = 'Clusters mapobjects based on a set of selected features.'
 
-    __options__ = {'method': ['kmeans'] }
+    __options__ = {'method': ['kmeans', 'minibatch_kmeans'] }
 
     @same_docstring_as(Tool.__init__)
-    def __init__(self, experiment_id):
-        super(Clustering, self).__init__(experiment_id)
+    def __init__(self, experiment_id, n_cores=1):
+        super(Clustering, self).__init__(experiment_id, n_cores)
 
     def process_request(self, submission_id, payload):
         '''Processes a client tool request and inserts the generated result
@@ -47,7 +47,8 @@ class Clustering(Classifier):
                 "selected_features": [str, ...],
                 "options": {
                     "method": str,
-                    "k": int
+                    "k": int,
+                    "n_components": int
                 }
             }
 
@@ -57,6 +58,13 @@ class Clustering(Classifier):
             ID of the corresponding job submission
         payload: dict
             description of the tool job
+
+        Note
+        ----
+        Method "minibatch_kmeans" trains the classifier out-of-core on all
+        mapobjects, optionally on the first "n_components" principal
+        components, while method "kmeans" only uses a random subset of
+        mapobjects for training.
         '''
         logger.info('perform unsupervised classification')
         mapobject_type_name = payload['chosen_object_type']
@@ -81,19 +89,28 @@ class Clustering(Classifier):
         training_set = self.load_feature_values(
             mapobject_type_name, feature_names, mapobject_ids
         )
-        model, scaler = self.train_unsupervised(training_set, k, method)
 
         n_test = 10**5
         logger.debug('set batch size to %d', n_test)
-        batches = self.partition_mapobjects(mapobject_type_name, n_test)
-        counter = 0
-        for mapobject_ids in batches:
-            logger.info('predict labels for batch #%d', counter)
-            counter += 1
-            test_set = self.load_feature_values(
-                mapobject_type_name, feature_names, mapobject_ids
-            )
-            predicted_labels = self.predict(test_set, model, scaler)
-            self.save_result_values(
-                mapobject_type_name, result_id, predicted_labels
+
+        def iterate_batches():
+            ranges = self.partition_mapobjects(mapobject_type_name, n_test)
+            for mapobject_id_range in ranges:
+                batches = self.iterate_feature_values(
+                    mapobject_type_name, feature_names, batch_size=n_test,
+                    mapobject_id_range=mapobject_id_range
+                )
+                for batch in batches:
+                    yield batch
+
+        if method == 'minibatch_kmeans':
+            model, scaler = self.train_unsupervised_incrementally(
+                training_set, iterate_batches, k, method,
+                payload['options'].get('n_components')
             )
+        else:
+            model, scaler = self.train_unsupervised(training_set, k, method)
+
+        self.predict_and_save(
+            mapobject_type_name, result_id, iterate_batches(), model, scaler
+        )
@@ -35,8 +35,8 @@ class Heatmap(Tool):
     '''
 
     @same_docstring_as(Tool.__init__)
-    def __init__(self, experiment_id):
-        super(Heatmap, self).__init__(experiment_id)
+    def __init__(self, experiment_id, n_cores=1):
+        super(Heatmap, self).__init__(experiment_id, n_cores)
 
     def _get_feature_id(self, mapobject_type_name, feature_name):
         '''Gets the ID of a feature.
@@ -18,7 +18,6 @@ import logging
 import numpy as np
 import collections
 import itertools
-import shapely.geometry
 import psycopg2
 import sqlalchemy.orm
 from sqlalchemy import func
@@ -31,8 +30,12 @@ from tmlib.utils import flatten, notimplemented, create_partitions
 from tmlib.image import PyramidTile
 from tmlib.image import Image
 from tmlib.errors import DataIntegrityError
+from tmlib.errors import JobDescriptionError
 from tmlib.errors import WorkflowError
 from tmlib.models.utils import delete_location
+from tmlib.models.layout import (
+    ExperimentLayout, ImageIndex, calculate_morton_code
+)
 from tmlib.workflow.api import WorkflowStepAPI
 from tmlib.workflow.jobs import RunJob
 from tmlib.workflow.jobs import SingleRunPhase
@@ -68,6 +71,15 @@ class PyramidBuilder(WorkflowStepAPI):
         generator
             job descriptions
         '''
+        if args.fuse_levels < 0:
+            raise JobDescriptionError(
+                'Number of fused levels must be a non-negative integer.'
+            )
+        if args.threads < 1:
+            raise JobDescriptionError(
+                'Number of threads must be a positive integer.'
+            )
+
         logger.info('performing data integrity tests')
         with tm.utils.ExperimentSession(self.experiment_id) as session:
             n_images_per_site = session.query(
@@ -94,6 +106,7 @@ class PyramidBuilder(WorkflowStepAPI):
         job_count = 0
         with tm.utils.ExperimentSession(self.experiment_id) as session:
             experiment = session.query(tm.Experiment).one()
+            layout = ExperimentLayout.load(session)
             count = 0
             for channel in session.query(tm.Channel.id).distinct():
                 logger.info('create layers for channel %d', channel.id)
@@ -107,15 +120,23 @@ class PyramidBuilder(WorkflowStepAPI):
                 tpoints = [r.tpoint for r in results]
                 for t, z in itertools.product(tpoints, zplanes):
                     logger.info('create layer for tpoint %d, zplane %d', t, z)
-                    image_files = session.query(tm.ChannelImageFile.id).\
+                    image_files = session.query(
+                            tm.ChannelImageFile.id, tm.ChannelImageFile.site_id
+                        ).\
                         filter_by(channel_id=channel.id, tpoint=t, zplane=z).\
                         order_by(tm.ChannelImageFile.site_id).\
                         all()
-                    image_file_ids = [f.id for f in image_files]
                     layer = session.get_or_create(
                         tm.ChannelLayer, channel_id=channel.id,
                         tpoint=t, zplane=z
                     )
+                    # Images are ordered spatially, such that neighbouring
+                    # images, which share tiles, end up in the same batch.
+                    site_ids = [f.site_id for f in image_files]
+                    order = layout.sort_sites(site_ids)
+                    image_file_ids = np.array(
+                        [f.id for f in image_files], dtype=np.int64
+                    )[order].tolist()
 
                     if args.clip:
                         logger.info('clip intensities')
@@ -176,29 +197,75 @@ class PyramidBuilder(WorkflowStepAPI):
                     count += 1
                     n_levels = experiment.pyramid_depth
                     max_zoomlevel_index = n_levels - 1
-                    for index, level in enumerate(reversed(range(n_levels))):
-                        logger.info('create batches for pyramid level %d', level)
+                    zoom_factor = experiment.zoom_factor
+                    # Each phase builds one or more pyramid levels.
+                    # Optionally, the levels directly above the base level
+                    # are built together in memory, such that tiles don't
+                    # have to be written to and read back from the database
+                    # (and encoded and decoded) for each of these levels.
+                    n_fused = min(args.fuse_levels, max_zoomlevel_index)
+                    phases = [[max_zoomlevel_index]]
+                    if n_fused > 0:
+                        phases.append(range(
+                            max_zoomlevel_index - 1,
+                            max_zoomlevel_index - n_fused - 1, -1
+                        ))
+                    phases.extend([
+                        [l] for l in
+                        reversed(range(max_zoomlevel_index - n_fused))
+                    ])
+                    for index, levels in enumerate(phases):
                         # The layer "level" increases from top to bottom.
                         # We build the layer bottom-up, therefore, the "index"
                         # decreases from top to bottom.
+                        level = levels[-1]
+                        logger.info(
+                            'create batches for pyramid levels %s',
+                            ', '.join(map(str, levels))
+                        )
                         if level == max_zoomlevel_index:
                             # For the base level, batches are composed of
                             # image files, which will get chopped into tiles.
-                            batch_size = args.batch_size
                             batches = self._create_batches(
-                                image_file_ids, batch_size
+                                image_file_ids, args.batch_size
+                            )
+                            image_index = ImageIndex(
+                                layout, site_ids, [f.id for f in image_files],
+                                layer.tile_size
+                            )
+                            logger.info(
+                                'number of image reads for layer %d: %d '
+                                '(%d when ordered by site ID)', layer.id,
+                                self._count_image_reads(image_index, batches),
+                                self._count_image_reads(
+                                    image_index, self._create_batches(
+                                        [f.id for f in image_files],
+                                        args.batch_size
+                                    )
+                                )
                             )
                         else:
                             # For the subsequent levels, batches are composed of
                             # tiles of the previous, next higher level.
-                            # Therefore, the batch size needs to be adjusted.
-                            if index == 1:
-                                batch_size *= 25
-                            else:
-                                batch_size /= 4
-                            batches = self._create_batches(
-                                np.arange(np.prod(layer.dimensions[level])),
-                                batch_size
+                            # Batches represent aligned square blocks of tiles,
+                            # whose size decreases by the zoom factor from
+                            # level to level, such that the inputs of each job
+                            # are the outputs of a single job of the previous
+                            # level.
+                            # Blocks at the level directly above the base level
+                            # comprise about 25 times as many tiles as there
+                            # are images per batch.
+                            top_block_size = zoom_factor ** int(round(
+                                np.log(np.sqrt(args.batch_size * 25)) /
+                                np.log(zoom_factor)
+                            ))
+                            block_size = max(
+                                1, top_block_size / zoom_factor ** (
+                                    max_zoomlevel_index - 1 - level
+                                )
+                            )
+                            batches = self._create_tile_batches(
+                                layer.dimensions[level], block_size
                             )
 
                         for batch in batches:
@@ -206,7 +273,8 @@ class PyramidBuilder(WorkflowStepAPI):
                             # For the highest resolution level, the inputs
                             # are channel image files. For all other levels,
                             # the inputs are the tiles of the next higher
-                            # resolution level.
+                            # resolution level or, in case several levels are
+                            # built together, the tiles of the base level.
                             if level == max_zoomlevel_index:
                                 yield {
                                     'id': job_count,
@@ -216,22 +284,83 @@ class PyramidBuilder(WorkflowStepAPI):
                                     'index': index,
                                     'image_file_ids': batch,
                                     'align': args.align,
-                                    'illumcorr': args.illumcorr
+                                    'illumcorr': args.illumcorr,
+                                    'threads': args.threads
+                                }
+                            elif len(levels) > 1:
+                                yield {
+                                    'id': job_count,
+                                    'layer_id': layer.id,
+                                    'level': level,
+                                    'index': index,
+                                    'coordinates': batch,
+                                    'fused_levels': len(levels),
+                                    'threads': args.threads
                                 }
                             else:
-                                rows = np.arange(layer.dimensions[level][0])
-                                cols = np.arange(layer.dimensions[level][1])
-                                coordinates = np.array(
-                                    list(itertools.product(rows, cols))
-                                )[batch].tolist()
                                 yield {
                                     'id': job_count,
                                     'layer_id': layer.id,
                                     'level': level,
                                     'index': index,
-                                    'coordinates': coordinates
+                                    'coordinates': batch,
+                                    'threads': args.threads
                                 }
 
+    @staticmethod
+    def _create_tile_batches(dimensions, block_size):
+        '''Partitions the tiles of a pyramid level into aligned square
+        blocks, which are ordered along the Z-order curve.
+
+        Parameters
+        ----------
+        dimensions: Tuple[int]
+            number of tiles along the vertical and horizontal axis
+        block_size: int
+            number of tiles along each axis of a block
+
+        Returns
+        -------
+        List[List[List[int]]]
+            row and column coordinates of the tiles of each block
+        '''
+        rows, cols = np.meshgrid(
+            np.arange(dimensions[0]), np.arange(dimensions[1]), indexing='ij'
+        )
+        rows = rows.ravel()
+        cols = cols.ravel()
+        blocks = calculate_morton_code(rows // block_size, cols // block_size)
+        order = np.lexsort((cols, rows, blocks))
+        boundaries = np.where(np.diff(blocks[order]))[0] + 1
+        return [
+            np.column_stack([rows[i], cols[i]]).tolist()
+            for i in np.split(order, boundaries)
+        ]
+
+    @staticmethod
+    def _count_image_reads(index, batches):
+        '''Counts the number of images that need to be read for creating
+        the tiles of the base level of a pyramid, given that each job reads
+        each image only once.
+
+        Parameters
+        ----------
+        index: tmlib.models.layout.ImageIndex
+            spatial index of the images of the layer
+        batches: List[List[int]]
+            IDs of images per job
+
+        Returns
+        -------
+        int
+            total number of image reads
+        '''
+        count = 0
+        for batch in batches:
+            neighbours = index.get_overlapping_neighbours(batch)
+            count += len(np.union1d(batch, neighbours[neighbours > 0]))
+        return count
+
     def delete_previous_job_output(self):
         '''Deletes all instances of
         :class:`ChannelLayer <tmlib.models.layer.ChannelLayer>` and
@@ -246,6 +375,8 @@ class PyramidBuilder(WorkflowStepAPI):
         '''
         with tm.utils.ExperimentSession(self.experiment_id, False) as session:
             logger.info('delete existing channel layers')
+            for layer in session.query(tm.ChannelLayer):
+                delete_location(layer.tiles_location)
             session.query(tm.ChannelLayerTile).delete()
             session.query(tm.ChannelLayer).delete()
             logger.info('delete existing static mapobject types')
@@ -387,25 +518,105 @@ class PyramidBuilder(WorkflowStepAPI):
 
             clip_min = layer.min_intensity
             clip_max = layer.max_intensity
-
+            layout = layer.layout
+
+            # Images are kept in memory as long as they are required for
+            # the creation of tiles of subsequent images of the batch, such
+            # that each image is read and preprocessed only once per batch.
+            files = dict()
+            tile_mappings = dict()
+            references = collections.Counter()
             for fid in batch['image_file_ids']:
                 file = session.query(tm.ChannelImageFile).get(fid)
-                logger.info('process image %d', file.id)
                 tiles = layer.map_image_to_base_tiles(file)
-                image_store = dict()
-                image = file.get()
-                if batch['illumcorr']:
-                    logger.debug('correct image')
-                    image = image.correct(stats)
-                if batch['align']:
-                    logger.debug('align image')
-                    image = image.align(crop=False)
+                extra_file_map = layer.map_base_tile_to_images(file.site)
+                required_file_ids = {fid}
+                for t in tiles:
+                    required_file_ids.update(extra_file_map[t['y'], t['x']])
+                references.update(required_file_ids)
+                files[fid] = file
+                tile_mappings[fid] = (tiles, extra_file_map, required_file_ids)
+            logger.info(
+                'read %d images for %d image files',
+                len(references), len(batch['image_file_ids'])
+            )
+
+            image_store = dict()
+
+            def load_image(fid):
+                if fid not in image_store:
+                    logger.debug('load image %d', fid)
+                    image = session.query(tm.ChannelImageFile).get(fid).get()
+                    if batch['illumcorr']:
+                        logger.debug('correct image')
+                        image = image.correct(
+                            stats, n_threads=batch['threads']
+                        )
+                    if batch['align']:
+                        logger.debug('align image')
+                        image = image.align(crop=False)
+                    if not image.is_uint8:
+                        image = image.clip(clip_min, clip_max, scale=True)
+                    image_store[fid] = image
+                return image_store[fid]
+
+            # Margins of images that are not part of the batch, hashable by
+            # image file ID and axis (0: bottom rows, 1: right columns)
+            strip_store = dict()
+
+            def load_strip(fid, axis, start):
+                # A strip is read once per image and only read again in case
+                # a wider margin is required for a subsequent tile.
+                key = (fid, axis)
+                if key not in strip_store or strip_store[key][0] > start:
+                    logger.debug('load margin of image %d', fid)
+                    file = session.query(tm.ChannelImageFile).get(fid)
+                    height, width = layout.image_sizes[
+                        layout.get_site_index(file.site_id)
+                    ]
+                    if axis == 0:
+                        region = (start, height - start, 0, width)
+                    else:
+                        region = (0, height, start, width - start)
+                    image = file.get(region=region, align=batch['align'])
+                    if not image.is_uint8:
+                        image = image.clip(clip_min, clip_max, scale=True)
+                    strip_store[key] = (start, image)
+                return strip_store[key]
+
+            def load_pixels(fid, y, height, x, width):
+                # Images that are not part of the batch only contribute
+                # pixels along their bottom or right margins to tiles of the
+                # batch, such that only the margins are read from the file.
+                # Illumination correction requires the entire image, however.
+                if fid in image_store or fid in files or batch['illumcorr']:
+                    return load_image(fid).extract(y, height, x, width)
+                file = session.query(tm.ChannelImageFile).get(fid)
+                image_size = layout.image_sizes[
+                    layout.get_site_index(file.site_id)
+                ]
+                if y + height == image_size[0]:
+                    start, strip = load_strip(fid, 0, y)
+                    return strip.extract(y - start, height, x, width)
+                if x + width == image_size[1]:
+                    start, strip = load_strip(fid, 1, x)
+                    return strip.extract(y, height, x - start, width)
+                logger.debug('load region of image %d', fid)
+                image = file.get(
+                    region=(y, height, x, width), align=batch['align']
+                )
                 if not image.is_uint8:
-                    image = image.clip(clip_min, clip_max)
-                    image = image.scale(clip_min, clip_max)
-                image_store[file.id] = image
+                    image = image.clip(clip_min, clip_max, scale=True)
+                return image
 
-                extra_file_map = layer.map_base_tile_to_images(file.site)
+            for fid in batch['image_file_ids']:
+                file = files[fid]
+                logger.info('process image %d', file.id)
+                tiles, extra_file_map, required_file_ids = tile_mappings[fid]
+                image = load_image(file.id)
+                site_index = layout.get_site_index(file.site_id)
+                site_image_size = layout.image_sizes[site_index]
+                level_tiles = dict()
                 for t in tiles:
                     level = batch['level']
                     row = t['y']
@@ -414,51 +625,37 @@ class PyramidBuilder(WorkflowStepAPI):
                         'create tile: z=%d, y=%d, x=%d', level, row, column
                     )
                     tile = layer.extract_tile_from_image(
-                        image_store[file.id], t['y_offset'], t['x_offset']
+                        image, t['y_offset'], t['x_offset']
                     )
 
                     # Determine files that contain overlapping pixels,
                     # i.e. pixels falling into the currently processed tile
                     # that are not contained by the file.
-                    file_coordinate = np.array((file.site.y, file.site.x))
+                    file_coordinate = layout.coordinates[site_index]
                     extra_file_ids = extra_file_map[row, column]
                     if len(extra_file_ids) > 0:
                         logger.debug('tile overlaps multiple images')
                     for efid in extra_file_ids:
                         extra_file = session.query(tm.ChannelImageFile).\
                             get(efid)
-                        if extra_file.id not in image_store:
-                            image = extra_file.get()
-                            if batch['illumcorr']:
-                                logger.debug('correct image')
-                                image = image.correct(stats)
-                            if batch['align']:
-                                logger.debug('align image')
-                                image = image.align(crop=False)
-                            if not image.is_uint8:
-                                image = image.clip(clip_min, clip_max)
-                                image = image.scale(clip_min, clip_max)
-                            image_store[extra_file.id] = image
-
-                        extra_file_coordinate = np.array((
-                            extra_file.site.y, extra_file.site.x
-                        ))
+                        extra_file_coordinate = layout.coordinates[
+                            layout.get_site_index(extra_file.site_id)
+                        ]
 
                         condition = file_coordinate > extra_file_coordinate
-                        pixels = image_store[extra_file.id]
                         if all(condition):
                             logger.debug('insert pixels from top left image')
-                            y = file.site.image_size[0] - abs(t['y_offset'])
-                            x = file.site.image_size[1] - abs(t['x_offset'])
+                            y = site_image_size[0] - abs(t['y_offset'])
+                            x = site_image_size[1] - abs(t['x_offset'])
                             height = abs(t['y_offset'])
                             width = abs(t['x_offset'])
                             subtile = PyramidTile(
-                                pixels.extract(y, height, x, width).array
+                                load_pixels(efid, y, height, x, width).array
                             )
                             tile.insert(subtile, 0, 0)
                         elif condition[0] and not condition[1]:
                             logger.debug('insert pixels from top image')
-                            y = file.site.image_size[0] - abs(t['y_offset'])
+                            y = site_image_size[0] - abs(t['y_offset'])
                             height = abs(t['y_offset'])
                             if t['x_offset'] < 0:
                                 x = 0
@@ -469,12 +666,12 @@ class PyramidBuilder(WorkflowStepAPI):
                                 width = tile.dimensions[1]
                                 x_offset = 0
                             subtile = PyramidTile(
-                                pixels.extract(y, height, x, width).array
+                                load_pixels(efid, y, height, x, width).array
                             )
                             tile.insert(subtile, 0, x_offset)
                         elif not condition[0] and condition[1]:
                             logger.debug('insert pixels from left image')
-                            x = file.site.image_size[1] - abs(t['x_offset'])
+                            x = site_image_size[1] - abs(t['x_offset'])
                             width = abs(t['x_offset'])
                             if t['y_offset'] < 0:
                                 y = 0
@@ -485,7 +682,7 @@ class PyramidBuilder(WorkflowStepAPI):
                                 height = tile.dimensions[0]
                                 y_offset = 0
                             subtile = PyramidTile(
-                                pixels.extract(y, height, x, width).array
+                                load_pixels(efid, y, height, x, width).array
                             )
                             tile.insert(subtile, y_offset, 0)
                         else:
@@ -493,12 +690,19 @@ class PyramidBuilder(WorkflowStepAPI):
                                 'Tile shouldn\'t be in this batch!'
                             )
 
-                    channel_layer_tile = tm.ChannelLayerTile(
-                        channel_layer_id=layer.id,
-                        z=level, y=row, x=column, pixels=tile
-                    )
-                    session.add(channel_layer_tile)
+                    level_tiles[(row, column)] = tile
+
+                layer.tile_store.put_tiles(
+                    batch['level'], level_tiles, batch['threads']
+                )
 
+                # Release images that are not required for subsequent images.
+                for rfid in required_file_ids:
+                    references[rfid] -= 1
+                    if references[rfid] == 0:
+                        image_store.pop(rfid, None)
+                        strip_store.pop((rfid, 0), None)
+                        strip_store.pop((rfid, 1), None)
 
     def _create_lower_zoom_level_tiles(self, batch, assume_clean_state):
         exp_id = self.experiment_id
@@ -507,70 +711,145 @@ class PyramidBuilder(WorkflowStepAPI):
             logger.info('processing layer for channel %s', layer.channel.name)
             level = batch['level']
             logger.info('creating tiles at zoom level %d', batch['level'])
-            layer_id = layer.id
             zoom_factor = layer.zoom_factor
+            tile_store = layer.tile_store
+
+            # Tiles are processed in chunks, such that the tiles of the next
+            # higher level can be decoded and the created tiles can be
+            # encoded in parallel, while only a limited number of tiles is
+            # held in memory.
+            chunk_size = 64 * batch['threads']
+            for k in xrange(0, len(batch['coordinates']), chunk_size):
+                chunk = batch['coordinates'][k:k + chunk_size]
+                pre_coordinate_map = {
+                    (row, column):
+                        layer.calc_coordinates_of_next_higher_level(
+                            level, row, column
+                        )
+                    for row, column in chunk
+                }
+                # Load required higher level tiles (created in a previous
+                # run) of all tiles of the chunk at once
+                pre_tiles = tile_store.get_tiles(
+                    level + 1,
+                    list(set(flatten(pre_coordinate_map.values()))),
+                    batch['threads']
+                )
+                tiles = dict()
+                for row, column in chunk:
+                    pre_coordinates = pre_coordinate_map[(row, column)]
+                    logger.debug(
+                        'creating tile: z=%d, y=%d, x=%d', level, row, column
+                    )
+                    # Build the mosaic by stitching the required higher level
+                    # tiles together
+                    pre_rows = np.unique([c[0] for c in pre_coordinates])
+                    pre_cols = np.unique([c[1] for c in pre_coordinates])
+                    for i, r in enumerate(pre_rows):
+                        for j, c in enumerate(pre_cols):
+                            pre_tile = pre_tiles.get((r, c))
+                            if pre_tile is None:
+                                # Tiles at maxzoom level might not exist in
+                                # case they did not fall into a region of
+                                # the map occupied by an image and background
+                                # tiles are not stored in the database at any
+                                # zoom level.
+                                logger.debug(
+                                    'tile "%d-%d-%d" missing',
+                                     batch['level']+1, r, c
+                                )
+                                pre_tile = PyramidTile.create_as_background()
+                            # We have to temporally treat it as an "image",
+                            # since a tile can per definition not be larger
+                            # than 256x256 pixels.
+                            # FIXME: This can be done more efficiently using
+                            # a predefined array instead of these loops.
+                            img = Image(pre_tile.array)
+                            if j == 0:
+                                row_img = img
+                            else:
+                                row_img = row_img.join(img, 'x')
+                        if i == 0:
+                            mosaic_img = row_img
+                        else:
+                            mosaic_img = mosaic_img.join(row_img, 'y')
+                    # Create the tile at the current level by downsampling
+                    # the mosaic image, which is composed of the 4 tiles
+                    # of the next higher zoom level
+                    tiles[(row, column)] = PyramidTile(
+                        mosaic_img.shrink(zoom_factor).array
+                    )
+                tile_store.put_tiles(level, tiles, batch['threads'])
+
+    def _create_fused_zoom_level_tiles(self, batch, assume_clean_state):
+        exp_id = self.experiment_id
+        with tm.utils.ExperimentSession(exp_id, transaction=False) as session:
+            layer = session.query(tm.ChannelLayer).get(batch['layer_id'])
+            logger.info('processing layer for channel %s', layer.channel.name)
+            level = batch['level']
+            base_level = level + batch['fused_levels']
+            logger.info(
+                'creating tiles at zoom levels %d-%d', level, base_level - 1
+            )
+            zoom_factor = layer.zoom_factor
+            tile_size = layer.tile_size
+            tile_store = layer.tile_store
+            # Number of base tiles along each axis that are represented by a
+            # tile at the current level
+            block_size = zoom_factor ** batch['fused_levels']
+            n_rows, n_cols = layer.dimensions[base_level]
 
             for coordinates in batch['coordinates']:
                 row = coordinates[0]
                 column = coordinates[1]
-                pre_coordinates = layer.calc_coordinates_of_next_higher_level(
-                    level, row, column
-                )
+                y_start = row * block_size
+                y_end = min(y_start + block_size, n_rows)
+                x_start = column * block_size
+                x_end = min(x_start + block_size, n_cols)
                 logger.debug(
-                    'creating tile: z=%d, y=%d, x=%d', level, row, column
+                    'creating tiles for block of base tiles: y=%d-%d, x=%d-%d',
+                    y_start, y_end - 1, x_start, x_end - 1
                 )
-                # Build the mosaic by loading required higher level tiles
-                # (created in a previous run) and stitching them together
-                pre_rows = np.unique([c[0] for c in pre_coordinates])
-                pre_cols = np.unique([c[1] for c in pre_coordinates])
-                for i, r in enumerate(pre_rows):
-                    for j, c in enumerate(pre_cols):
-                        pre_tile = session.query(tm.ChannelLayerTile).\
-                            filter_by(
-                                channel_layer_id=layer_id, z=level+1, y=r, x=c
-                            ).\
-                            one_or_none()
-                        if pre_tile is not None:
-                            pre_tile = pre_tile.pixels
-                        else:
-                            # Tiles at maxzoom level might not exist in
-                            # case they did not fall into a region of
-                            # the map occupied by an image.
-                            # They must exist at the lower zoom levels,
-                            # though, for subsampling.
-                            if batch['index'] > 1:
-                                raise ValueError(
-                                    'Tile "%d-%d-%d" was not created.'
-                                    % (level+1, r, c)
-                                )
+                # Build the mosaic of base tiles, which are decoded only once.
+                # Tiles at maxzoom level might not exist in case they did not
+                # fall into a region of the map occupied by an image. These
+                # are represented by background pixels.
+                mosaic = np.zeros(
+                    ((y_end - y_start) * tile_size,
+                     (x_end - x_start) * tile_size),
+                    dtype=np.uint8
+                )
+                base_tiles = tile_store.get_tiles(
+                    base_level,
+                    list(itertools.product(
+                        range(y_start, y_end), range(x_start, x_end)
+                    )),
+                    batch['threads']
+                )
+                for (r, c), base_tile in base_tiles.iteritems():
+                    pixels = base_tile.array
+                    y = (r - y_start) * tile_size
+                    x = (c - x_start) * tile_size
+                    mosaic[
+                        y:y + pixels.shape[0], x:x + pixels.shape[1]
+                    ] = pixels
+                # Create the tiles of all levels by repeatedly downsampling
+                # the 8-bit mosaic in memory.
+                for z in reversed(range(level, base_level)):
+                    mosaic = Image(mosaic).shrink(zoom_factor).array
+                    factor = zoom_factor ** (base_level - z)
+                    level_tiles = dict()
+                    for i in xrange(0, mosaic.shape[0], tile_size):
+                        for j in xrange(0, mosaic.shape[1], tile_size):
+                            y = y_start / factor + i / tile_size
+                            x = x_start / factor + j / tile_size
                             logger.debug(
-                                'tile "%d-%d-%d" missing',
-                                 batch['level']+1, r, c
+                                'creating tile: z=%d, y=%d, x=%d', z, y, x
                             )
-                            pre_tile = PyramidTile.create_as_background()
-                        # We have to temporally treat it as an "image",
-                        # since a tile can per definition not be larger
-                        # than 256x256 pixels.
-                        # FIXME: This can be done more efficiently using
-                        # a predefined array instead of these loops.
-                        img = Image(pre_tile.array)
-                        if j == 0:
-                            row_img = img
-                        else:
-                            row_img = row_img.join(img, 'x')
-                    if i == 0:
-                        mosaic_img = row_img
-                    else:
-                        mosaic_img = mosaic_img.join(row_img, 'y')
-                # Create the tile at the current level by downsampling
-                # the mosaic image, which is composed of the 4 tiles
-                # of the next higher zoom level
-                tile = PyramidTile(mosaic_img.shrink(zoom_factor).array)
-                channel_layer_tile = tm.ChannelLayerTile(
-                    channel_layer_id=layer_id,
-                    z=level, y=row, x=column, pixels=tile
-                )
-                session.add(channel_layer_tile)
+                            level_tiles[(y, x)] = PyramidTile(
+                                mosaic[i:i + tile_size, j:j + tile_size]
+                            )
+                    tile_store.put_tiles(z, level_tiles, batch['threads'])
 
     def run_job(self, batch, assume_clean_state=False):
         '''Creates 8-bit grayscale JPEG layer tiles.
@@ -584,6 +863,8 @@ class PyramidBuilder(WorkflowStepAPI):
         '''
         if batch['index'] == 0:
             self._create_maxzoom_level_tiles(batch, assume_clean_state)
+        elif 'fused_levels' in batch:
+            self._create_fused_zoom_level_tiles(batch, assume_clean_state)
         else:
             self._create_lower_zoom_level_tiles(batch, assume_clean_state)
 
@@ -603,10 +884,25 @@ class PyramidBuilder(WorkflowStepAPI):
         batch: dict
             job description
         '''
+        with tm.utils.ExperimentSession(self.experiment_id) as session:
+            layout = ExperimentLayout.load(session)
         mapobject_mappings = {
-            'Plates': tm.Plate, 'Wells': tm.Well, 'Sites': tm.Site
+            'Plates': (
+                tm.Plate, layout.plate_ids,
+                layout.plate_offsets, layout.plate_image_sizes
+            ),
+            'Wells': (
+                tm.Well, layout.well_ids,
+                layout.well_offsets, layout.well_image_sizes
+            ),
+            # We need to account for the "multiplexing" edge case.
+            'Sites': (
+                tm.Site, layout.site_ids,
+                layout.aligned_offsets, layout.aligned_image_sizes
+            )
         }
-        for name, cls in mapobject_mappings.iteritems():
+        for name, mapping in mapobject_mappings.iteritems():
+            cls, ref_ids, offsets, image_sizes = mapping
             with tm.utils.ExperimentSession(self.experiment_id, transaction=False) as session:
                 logger.info(
                     'create static mapobject type "%s" for reference type "%s"',
@@ -621,53 +917,81 @@ class PyramidBuilder(WorkflowStepAPI):
                     tm.SegmentationLayer, mapobject_type_id=mapobject_type_id
                 )
 
-                logger.info('create individual mapobjects of type "%s"', name)
-                segmentations = dict()
-                for obj in session.query(cls):
-                    logger.debug(
-                        'create mapobject for reference object #%d', obj.id
-                    )
-                    if name == 'Sites':
-                        # We need to account for the "multiplexing" edge case.
-                        offset = obj.aligned_offset
-                        image_size = obj.aligned_image_size
-                    else:
-                        offset = obj.offset
-                        image_size = obj.image_size
-                    # First element: x axis
-                    # Second element: inverted (!) y axis
-                    # We further subtract one pixel such that the polygon
-                    # defines the exact boundary of the objects. This is
-                    # crucial for testing whether other objects intersect with
-                    # the border.
-                    ul = (offset[1] + 1, -1 * (offset[0] + 1))
-                    ll = (ul[0], ul[1] - (image_size[0] - 3))
-                    ur = (ul[0] + image_size[1] - 3, ul[1])
-                    lr = (ll[0] + image_size[1] - 3, ll[1])
-                    # Closed circle with coordinates sorted counter-clockwise
-                    contour = np.array([ur, ul, ll, lr, ur])
-                    polygon = shapely.geometry.Polygon(contour)
-                    segmentations[obj.id] = {
-                        'segmentation_layer_id': segmentation_layer.id,
-                        'polygon': polygon
-                    }
-
                 logger.debug('delete existing mapobjects of type "%s"', name)
                 session.query(tm.Mapobject).\
                     filter_by(mapobject_type_id=mapobject_type_id).\
                     delete()
-                logger.debug('add new mapobjects of type "%s"', name)
-                for key, value in segmentations.iteritems():
-                    mapobject = tm.Mapobject(
+
+                logger.info(
+                    'create %d mapobjects of type "%s"', len(ref_ids), name
+                )
+                polygons, centroids = self._create_static_outlines(
+                    offsets, image_sizes
+                )
+                mapobjects = [
+                    tm.Mapobject(
                         partition_key=key, mapobject_type_id=mapobject_type_id
                     )
-                    session.add(mapobject)
-                    session.flush()
-                    logger.debug('add mapobject #%d', mapobject.id)
-                    mapobject_segmentation = tm.MapobjectSegmentation(
-                        partition_key=key, mapobject_id=mapobject.id,
-                        geom_polygon=value['polygon'],
-                        geom_centroid=value['polygon'].centroid,
-                        segmentation_layer_id=value['segmentation_layer_id'],
+                    for key in ref_ids.tolist()
+                ]
+                # IDs of all mapobjects are reserved at once and assigned to
+                # the instances upon ingestion.
+                session.bulk_ingest(mapobjects)
+                session.bulk_ingest([
+                    tm.MapobjectSegmentation(
+                        partition_key=mapobject.partition_key,
+                        mapobject_id=mapobject.id,
+                        geom_polygon=polygon, geom_centroid=centroid,
+                        segmentation_layer_id=segmentation_layer.id
                     )
-                    session.add(mapobject_segmentation)
+                    for mapobject, polygon, centroid
+                    in zip(mapobjects, polygons, centroids)
+                ])
+
+    @staticmethod
+    def _create_static_outlines(offsets, image_sizes):
+        '''Creates the outlines of static mapobjects, which represent
+        rectangular regions of the layer overview at the maximum zoom level,
+        such as plates, wells or sites.
+
+        Parameters
+        ----------
+        offsets: numpy.ndarray[numpy.int64]
+            *y*, *x* coordinate of the top, left corner of each region
+        image_sizes: numpy.ndarray[numpy.int64]
+            number of pixels along the vertical and horizontal axis of each
+            region
+
+        Returns
+        -------
+        Tuple[List[str]]
+            WKT representations of the polygon and the centroid of each region
+        '''
+        # First element: x axis
+        # Second element: inverted (!) y axis
+        # We further subtract one pixel such that the polygon
+        # defines the exact boundary of the objects. This is
+        # crucial for testing whether other objects intersect with
+        # the border.
+        left = offsets[:, 1] + 1
+        top = -1 * (offsets[:, 0] + 1)
+        right = left + image_sizes[:, 1] - 3
+        bottom = top - (image_sizes[:, 0] - 3)
+        # Closed circle with coordinates sorted counter-clockwise, starting
+        # at the upper right corner
+        polygons = [
+            'POLYGON((%d %d,%d %d,%d %d,%d %d,%d %d))' % (
+                x1, y0, x0, y0, x0, y1, x1, y1, x1, y0
+            )
+            for x0, y0, x1, y1 in zip(
+                left.tolist(), top.tolist(), right.tolist(), bottom.tolist()
+            )
+        ]
+        centroids = [
+            'POINT(%r %r)' % (x, y)
+            for x, y in zip(
+                ((left + right) / 2.0).tolist(),
+                ((top + bottom) / 2.0).tolist()
+            )
+        ]
+        return (polygons, centroids)
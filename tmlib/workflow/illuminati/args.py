@@ -57,6 +57,22 @@ class IlluminatiBatchArguments(BatchArguments):
         '''
     )
 
+    fuse_levels = Argument(
+        type=int, default=0, flag='fuse-levels',
+        help='''number of pyramid levels above the base level that should be
+            built in memory by a single job per block of base tiles; memory
+            requirements grow with the zoom factor to the power of twice this
+            number (``0`` creates each level in a separate phase)
+        '''
+    )
+
+    threads = Argument(
+        type=int, default=1,
+        help='''number of threads per job for encoding and decoding tiles;
+            should not exceed the number of cores allocated per job
+        '''
+    )
+
 @register_step_submission_args('illuminati')
 class IlluminatiSubmissionArguments(SubmissionArguments):
 
@@ -0,0 +1,73 @@
+import numpy as np
+
+from tmlib.metadata import ChannelImageMetadata
+from tmlib.models.file import ChannelImageFile
+from tmlib.writers import DatasetWriter
+
+REGIONS = [
+    (0, 100, 0, 120),
+    (10, 20, 30, 40),
+    (0, 5, 0, 6),
+    (97, 3, 0, 120),
+    (0, 100, 117, 3),
+    (90, 20, 100, 30)
+]
+
+
+def create_metadata(y_shift, x_shift):
+    metadata = ChannelImageMetadata(
+        channel_id=1, site_id=1, cycle_id=1, tpoint=0, zplane=0
+    )
+    metadata.top_residue = 3
+    metadata.bottom_residue = 2
+    metadata.left_residue = 4
+    metadata.right_residue = 1
+    metadata.y_shift = y_shift
+    metadata.x_shift = x_shift
+    return metadata
+
+
+def create_image_file(tmpdir):
+    location = str(tmpdir.join('image.h5'))
+    array = np.random.randint(1, 2**16, (100, 120)).astype(np.uint16)
+    with DatasetWriter(location, truncate=True) as f:
+        f.write('array', array, chunks=(32, 32))
+    return location
+
+
+def assert_region_matches_aligned_image(location, y_shift, x_shift):
+    image = ChannelImageFile.load(location, create_metadata(y_shift, x_shift))
+    image.align(crop=False)
+    for region in REGIONS:
+        expected = image.extract(*region)
+        loaded = ChannelImageFile.load(
+            location, create_metadata(y_shift, x_shift), region, align=True
+        )
+        assert loaded.dimensions == expected.dimensions
+        assert np.all(loaded.array == expected.array)
+
+
+def test_load_region_of_image(tmpdir):
+    location = create_image_file(tmpdir)
+    image = ChannelImageFile.load(location, create_metadata(3, 4))
+    for region in REGIONS:
+        expected = image.extract(*region)
+        loaded = ChannelImageFile.load(
+            location, create_metadata(3, 4), region
+        )
+        assert np.all(loaded.array == expected.array)
+
+
+def test_load_region_of_image_with_positive_shifts(tmpdir):
+    location = create_image_file(tmpdir)
+    assert_region_matches_aligned_image(location, 3, 4)
+
+
+def test_load_region_of_image_with_negative_shifts(tmpdir):
+    location = create_image_file(tmpdir)
+    assert_region_matches_aligned_image(location, -2, -1)
+
+
+def test_load_region_of_image_with_mixed_shifts(tmpdir):
+    location = create_image_file(tmpdir)
+    assert_region_matches_aligned_image(location, 3, -1)
@@ -0,0 +1,93 @@
+import numpy as np
+
+from tmlib.image import ChannelImage
+from tmlib.metadata import ChannelImageMetadata
+
+
+def correct_illumination_reference(img, mean, std):
+    # Previous implementation with computations in double precision
+    img_type = img.dtype
+    img = img.astype(np.float64)
+    img[img == 0] = 10**-10
+    img = np.log10(img)
+    img[img == 0] = 0
+    img = (img - mean) / std
+    img = (img * np.mean(std)) + np.mean(mean)
+    img = 10 ** img
+    return img.astype(img_type)
+
+
+def create_illumination_data(height=300, width=500):
+    np.random.seed(0)
+    img = np.random.randint(0, 5000, (height, width)).astype(np.uint16)
+    mean = 3.0 + np.random.uniform(-0.2, 0.2, (height, width))
+    std = 0.3 + np.random.uniform(-0.05, 0.05, (height, width))
+    return (img, mean, std)
+
+
+def test_correct_illumination_matches_double_precision():
+    img, mean, std = create_illumination_data()
+    expected = correct_illumination_reference(img, mean, std)
+    corrected = ChannelImage._correct_illumination(img, mean, std)
+    assert corrected.dtype == np.uint16
+    diff = corrected.astype(np.int64) - expected.astype(np.int64)
+    assert np.all(np.abs(diff) <= 1)
+
+
+def test_correct_illumination_in_threads():
+    img, mean, std = create_illumination_data()
+    expected = ChannelImage._correct_illumination(img, mean, std)
+    for _ in range(2):
+        corrected = ChannelImage._correct_illumination(
+            img, mean, std, n_threads=4
+        )
+        assert np.all(corrected == expected)
+
+
+def test_correct_illumination_in_place():
+    img, mean, std = create_illumination_data()
+    expected = ChannelImage._correct_illumination(img, mean, std)
+    corrected = ChannelImage._correct_illumination(img, mean, std, out=img)
+    assert corrected is img
+    assert np.all(img == expected)
+
+
+def create_image(array):
+    metadata = ChannelImageMetadata(
+        channel_id=1, site_id=1, cycle_id=1, tpoint=0, zplane=0
+    )
+    return ChannelImage(array, metadata)
+
+
+def map_to_uint8_reference(img, lower_bound, upper_bound):
+    # Previous implementation creating the lookup table for each image
+    lut = np.concatenate([
+        np.zeros(lower_bound, dtype=np.uint16),
+        np.linspace(0, 255, upper_bound - lower_bound).astype(np.uint16),
+        np.ones(2**16 - upper_bound, dtype=np.uint16) * 255
+    ])
+    return lut[img].astype(np.uint8)
+
+
+def test_scale_matches_reference():
+    img = np.arange(2**16, dtype=np.uint16).reshape(256, 256)
+    for lower, upper in [(0, 65535), (0, 1), (100, 5000), (65534, 65535)]:
+        expected = map_to_uint8_reference(img, lower, upper)
+        image = create_image(img.copy()).scale(lower, upper, inplace=False)
+        assert image.array.dtype == np.uint8
+        assert np.all(image.array == expected)
+
+
+def test_scale_into_buffer():
+    img = np.random.randint(0, 2**16, (100, 120)).astype(np.uint16)
+    buf = np.empty(img.shape, dtype=np.uint8)
+    image = create_image(img).scale(200, 3000, inplace=False, out=buf)
+    assert image.array is buf
+    assert np.all(buf == map_to_uint8_reference(img, 200, 3000))
+
+
+def test_clip_and_scale_matches_reference():
+    img = np.random.randint(0, 2**16, (100, 120)).astype(np.uint16)
+    expected = map_to_uint8_reference(np.clip(img, 200, 3000), 200, 3000)
+    image = create_image(img).clip(200, 3000, inplace=False, scale=True)
+    assert np.all(image.array == expected)
@@ -0,0 +1,114 @@
+import numpy as np
+
+from tmlib.models.experiment import Experiment
+from tmlib.models.plate import Plate
+from tmlib.models.well import Well
+from tmlib.models.site import Site
+from tmlib.models.layout import ExperimentLayout, calculate_morton_code
+
+# Names of imaged wells and number of sites along each axis of a well per
+# plate; rows and columns without any imaged well are skipped.
+WELLS = [
+    [('A01', (2, 3)), ('A03', (1, 2)), ('C02', (2, 2))],
+    [('B05', (3, 1))],
+    [('A01', (1, 1)), ('P24', (2, 2))],
+    [('D04', (2, 3)), ('D07', (2, 3)), ('H04', (1, 1))],
+    [('C03', (1, 2)), ('E03', (2, 1))]
+]
+
+
+def create_experiment():
+    experiment = Experiment(
+        id=1, microscope_type='cellvoyager', plate_format=384,
+        plate_acquisition_mode='basic', location='/tmp',
+        well_spacer_size=100, vertical_site_displacement=10,
+        horizontal_site_displacement=20
+    )
+    plates = list()
+    wells = list()
+    sites = list()
+    for p, plate_wells in enumerate(WELLS):
+        plate = Plate(name='plate%02d' % p, experiment_id=experiment.id)
+        plate.id = p + 1
+        plate.experiment = experiment
+        plates.append(plate)
+        for name, dimensions in plate_wells:
+            well = Well(name=name, plate_id=plate.id)
+            well.id = len(wells) + 1
+            well.plate = plate
+            wells.append(well)
+            for y in range(dimensions[0]):
+                for x in range(dimensions[1]):
+                    site = Site(
+                        y=y, x=x, height=30, width=40, well_id=well.id
+                    )
+                    site.id = len(sites) + 1
+                    site.well = well
+                    sites.append(site)
+    layout = ExperimentLayout(experiment, plates, wells, sites)
+    return (experiment, plates, wells, sites, layout)
+
+
+def test_site_offsets():
+    experiment, plates, wells, sites, layout = create_experiment()
+    assert np.all(layout.site_ids == [s.id for s in sites])
+    assert np.all(layout.offsets == [s.offset for s in sites])
+    assert np.all(layout.image_sizes == [s.image_size for s in sites])
+
+
+def test_well_offsets_and_sizes():
+    experiment, plates, wells, sites, layout = create_experiment()
+    assert np.all(layout.well_ids == [w.id for w in wells])
+    assert np.all(layout.well_offsets == [w.offset for w in wells])
+    assert np.all(layout.well_image_sizes == [w.image_size for w in wells])
+
+
+def test_plate_offsets_and_sizes():
+    experiment, plates, wells, sites, layout = create_experiment()
+    assert np.all(layout.plate_ids == [p.id for p in plates])
+    assert np.all(layout.plate_offsets == [p.offset for p in plates])
+    assert np.all(layout.plate_image_sizes == [p.image_size for p in plates])
+
+
+def test_plate_grid():
+    experiment, plates, wells, sites, layout = create_experiment()
+    assert layout.plate_grid_shape == experiment.plate_grid.shape
+    # Plates are arranged column-wise in order of their IDs.
+    grid = np.zeros(layout.plate_grid_shape, dtype=int)
+    for i, plate_id in enumerate(layout.plate_ids):
+        grid[i % grid.shape[0], i // grid.shape[0]] = plate_id
+    assert np.all(grid == experiment.plate_grid)
+
+
+def calculate_morton_code_reference(y, x):
+    code = 0
+    for bit in range(32):
+        code |= ((x >> bit) & 1) << (2 * bit)
+        code |= ((y >> bit) & 1) << (2 * bit + 1)
+    return code
+
+
+def test_calculate_morton_code():
+    rows, cols = np.meshgrid(np.arange(8), np.arange(8), indexing='ij')
+    codes = calculate_morton_code(rows.ravel(), cols.ravel())
+    assert codes.dtype == np.uint64
+    expected = [
+        calculate_morton_code_reference(int(y), int(x))
+        for y, x in zip(rows.ravel(), cols.ravel())
+    ]
+    assert codes.tolist() == expected
+    # Coordinates of aligned square blocks are contiguous along the curve.
+    order = np.argsort(codes)
+    assert rows.ravel()[order][:4].tolist() == [0, 0, 1, 1]
+    assert cols.ravel()[order][:4].tolist() == [0, 1, 0, 1]
+    assert sorted(codes.tolist()) == range(64)
+
+
+def test_calculate_morton_code_of_large_coordinates():
+    y = np.array([2**32 - 1, 0, 12345678])
+    x = np.array([0, 2**32 - 1, 87654321])
+    codes = calculate_morton_code(y, x)
+    expected = [
+        calculate_morton_code_reference(int(a), int(b)) for a, b in zip(y, x)
+    ]
+    assert codes.tolist() == expected
@@ -0,0 +1,167 @@
+import os
+import numpy as np
+
+from tmlib.image import PyramidTile
+from tmlib.models.tile import ChannelLayerTile
+from tmlib.models.tile import encode_tile
+from tmlib.models.tile import decode_tile
+from tmlib.models.tile import is_uniform_tile
+from tmlib.models.tile import is_background_tile
+from tmlib.models.tile import get_jpeg_encoded_tile
+from tmlib.models.tile import FileTileStore
+from tmlib.models.tile import DatabaseTileStore
+
+TILE_SIZE = PyramidTile.TILE_SIZE
+
+
+def create_uniform_tile(value, height=TILE_SIZE, width=TILE_SIZE):
+    array = np.empty((height, width), np.uint8)
+    array.fill(value)
+    return PyramidTile(array)
+
+
+def create_random_tile():
+    array = np.random.randint(0, 256, (TILE_SIZE, TILE_SIZE))
+    return PyramidTile(array.astype(np.uint8))
+
+
+def is_jpeg(buf):
+    return np.frombuffer(buf, np.uint8)[:2].tostring() == '\xff\xd8'
+
+
+def test_encode_uniform_tile_as_placeholder():
+    buf = encode_tile(create_uniform_tile(7, 100, 200))
+    assert is_uniform_tile(buf)
+    tile = decode_tile(buf)
+    assert tile.dimensions == (100, 200)
+    assert np.all(tile.array == 7)
+
+
+def test_encode_non_uniform_tile_as_jpeg():
+    buf = encode_tile(create_random_tile())
+    assert not is_uniform_tile(buf)
+    assert is_jpeg(buf)
+
+
+def test_get_jpeg_encoded_tile_of_placeholder():
+    buf = get_jpeg_encoded_tile(encode_tile(create_uniform_tile(7)))
+    assert is_jpeg(buf)
+    array = PyramidTile.create_from_buffer(buf).array
+    assert np.all(np.abs(array.astype(int) - 7) <= 1)
+
+
+def test_is_background_tile():
+    assert is_background_tile(encode_tile(create_uniform_tile(0)))
+    assert not is_background_tile(encode_tile(create_uniform_tile(7)))
+    assert not is_background_tile(encode_tile(create_uniform_tile(0, 100)))
+    assert not is_background_tile(encode_tile(create_random_tile()))
+
+
+def test_channel_layer_tile_stores_uniform_tile_as_jpeg():
+    tile = ChannelLayerTile(
+        z=0, y=0, x=0, channel_layer_id=1, pixels=create_uniform_tile(7)
+    )
+    assert is_jpeg(tile._pixels)
+    array = tile.pixels.array
+    assert array.shape == (TILE_SIZE, TILE_SIZE)
+    assert np.all(np.abs(array.astype(int) - 7) <= 1)
+
+
+def test_file_tile_store_put_and_get_tiles(tmpdir):
+    store = FileTileStore(1, str(tmpdir.join('tiles')), [(1, 1), (2, 3)])
+    random_tile = create_random_tile()
+    store.put_tiles(1, {
+        (0, 0): random_tile,
+        (0, 1): create_uniform_tile(7),
+        (1, 2): create_uniform_tile(7)
+    })
+    coordinates = [(0, 0), (0, 1), (1, 1), (1, 2)]
+    tiles = store.get_tiles(1, coordinates)
+    assert sorted(tiles.keys()) == [(0, 0), (0, 1), (1, 2)]
+    expected = PyramidTile.create_from_buffer(random_tile.jpeg_encode())
+    assert np.all(tiles[(0, 0)].array == expected.array)
+    assert np.all(tiles[(0, 1)].array == 7)
+    assert np.all(tiles[(1, 2)].array == 7)
+    assert tiles[(1, 2)].metadata.z == 1
+    assert tiles[(1, 2)].metadata.y == 1
+    assert tiles[(1, 2)].metadata.x == 2
+    encoded_tiles = store.get_encoded_tiles(1, coordinates)
+    assert all([is_jpeg(buf) for buf in encoded_tiles.values()])
+    assert store.get_tiles(0, [(0, 0)]) == {}
+
+
+def test_file_tile_store_replace_tiles(tmpdir):
+    location = str(tmpdir.join('tiles'))
+    reader = FileTileStore(1, location, [(2, 2)])
+    writer = FileTileStore(1, location, [(2, 2)])
+    writer.put_tiles(0, {(0, 0): create_uniform_tile(7)})
+    assert np.all(reader.get_tile(0, 0, 0).array == 7)
+    # Tiles written after the file was mapped by the reader must be visible.
+    writer.put_tiles(0, {
+        (0, 0): create_uniform_tile(9), (1, 1): create_random_tile()
+    })
+    assert np.all(reader.get_tile(0, 0, 0).array == 9)
+    assert reader.get_tile(0, 1, 1) is not None
+    assert reader.get_tile(0, 1, 0) is None
+
+
+def test_file_tile_store_clear(tmpdir):
+    location = str(tmpdir.join('tiles'))
+    store = FileTileStore(1, location, [(1, 1)])
+    store.put_tiles(0, {(0, 0): create_random_tile()})
+    assert os.path.exists(location)
+    store.clear()
+    assert not os.path.exists(location)
+    assert store.get_tile(0, 0, 0) is None
+
+
+class InMemoryTileStore(DatabaseTileStore):
+
+    # Keeps the rows of the table in a dictionary instead of the database.
+
+    def __init__(self, dimensions):
+        super(InMemoryTileStore, self).__init__(None, 1, dimensions)
+        self.rows = dict()
+
+    def _select_tiles(self, z, coordinates):
+        return {
+            (y, x): np.frombuffer(self.rows[(z, y, x)], np.uint8)
+            for y, x in coordinates if (z, y, x) in self.rows
+        }
+
+    def _insert_tiles(self, instances):
+        for t in instances:
+            self.rows[(t.z, t.y, t.x)] = t._pixels
+
+    def _delete_tiles(self, z, coordinates):
+        for y, xs in coordinates.iteritems():
+            for x in xs:
+                self.rows.pop((z, y, x), None)
+
+
+def test_database_tile_store_does_not_store_background_tiles():
+    store = InMemoryTileStore([(1, 1), (2, 3)])
+    store.put_tiles(1, {
+        (0, 0): create_random_tile(),
+        (0, 1): create_uniform_tile(0),
+        (1, 2): create_uniform_tile(0, 100, 200)
+    })
+    assert sorted(store.rows.keys()) == [(1, 0, 0), (1, 1, 2)]
+    assert all([is_jpeg(buf) for buf in store.rows.values()])
+    # Missing tiles within the bounds of the layer are background tiles.
+    coordinates = [(0, 1), (1, 1), (1, 3), (2, 0)]
+    tiles = store.get_tiles(1, coordinates)
+    assert sorted(tiles.keys()) == [(0, 1), (1, 1)]
+    assert tiles[(1, 1)].dimensions == (TILE_SIZE, TILE_SIZE)
+    assert np.all(tiles[(1, 1)].array == 0)
+    assert tiles[(1, 1)].metadata.y == 1
+    assert is_jpeg(store.get_encoded_tile(1, 0, 1))
+    assert store.get_encoded_tile(1, 2, 0) is None
+
+
+def test_database_tile_store_replace_tile_by_background():
+    store = InMemoryTileStore([(2, 2)])
+    store.put_tiles(0, {(0, 0): create_random_tile()})
+    store.put_tiles(0, {(0, 0): create_uniform_tile(0)})
+    assert store.rows == {}
+    assert np.all(store.get_tile(0, 0, 0).array == 0)
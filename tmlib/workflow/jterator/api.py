@@ -18,14 +18,15 @@ import re
 import sys
 import shutil
 import logging
+import threading
 import subprocess
+import multiprocessing
 import numpy as np
 import pandas as pd
 import collections
 import shapely.geometry
 import shapely.ops
 from cached_property import cached_property
-from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.sql import func
 from sqlalchemy.dialects.postgresql import FLOAT
 from psycopg2 import ProgrammingError
@@ -39,6 +40,8 @@ from tmlib.readers import TextReader
 from tmlib.readers import ImageReader
 from tmlib.writers import TextWriter
 from tmlib.models.types import ST_GeomFromText
+from tmlib.models.layout import ExperimentLayout
+from tmlib.metadata import ChannelImageMetadata
 from tmlib.workflow.api import WorkflowStepAPI
 from tmlib.errors import PipelineDescriptionError
 from tmlib.errors import JobDescriptionError
@@ -47,11 +50,37 @@ from tmlib.workflow.jterator.module import ImageAnalysisModule
 from tmlib.workflow.jterator.handles import SegmentedObjects
 from tmlib.workflow.jobs import SingleRunPhase
 from tmlib.workflow.jterator.jobs import DebugRunJob
+from tmlib.tools.cache import FeatureValueCache
 from tmlib.workflow import register_step_api
 from tmlib import cfg
 
 logger = logging.getLogger(__name__)
 
+#: Tuple[Union[tmlib.workflow.jterator.api.ImageAnalysisPipelineEngine, bool, dict]]:
+#: pipeline engine and processing arguments of the current worker process
+_WORKER_CONTEXT = None
+
+
+def _initialize_worker(engine, plot, assume_clean_state, plan):
+    # NOTE: The arguments get inherited by the forked worker process and
+    # therefore don't need to be pickled.
+    global _WORKER_CONTEXT
+    logger.debug('initialize worker process %d', os.getpid())
+    tm.utils.set_pool_size(1)
+    engine.start_engines()
+    _WORKER_CONTEXT = (engine, plot, assume_clean_state, plan)
+
+
+def _process_site_in_worker(site_id):
+    engine, plot, assume_clean_state, plan = _WORKER_CONTEXT
+    try:
+        return engine._process_site(site_id, plot, assume_clean_state, plan)
+    except Exception:
+        # The traceback would otherwise get lost upon transfer of the
+        # exception to the parent process.
+        logger.exception('processing of site %d failed', site_id)
+        raise
+
 
 @register_step_api('jterator')
 class ImageAnalysisPipelineEngine(WorkflowStepAPI):
@@ -199,6 +228,14 @@ class ImageAnalysisPipelineEngine(WorkflowStepAPI):
             raise JobDescriptionError(
                 'Batch size must be 1 when plotting is active.'
             )
+        if args.n_processes < 1:
+            raise JobDescriptionError(
+                'Number of processes must be a positive integer.'
+            )
+        if args.plot and args.n_processes != 1:
+            raise JobDescriptionError(
+                'Number of processes must be 1 when plotting is active.'
+            )
 
         with tm.utils.ExperimentSession(self.experiment_id) as session:
             # Distribute sites randomly. Thereby we achieve a certain level
@@ -218,7 +255,8 @@ class ImageAnalysisPipelineEngine(WorkflowStepAPI):
                 yield {
                     'id': j + 1,  # job IDs are one-based!
                     'site_ids': batch,
-                    'plot': args.plot
+                    'plot': args.plot,
+                    'n_processes': min(args.n_processes, len(batch))
                 }
 
     def delete_previous_job_output(self):
@@ -240,13 +278,148 @@ class ImageAnalysisPipelineEngine(WorkflowStepAPI):
             session.query(tm.MapobjectType).\
                 filter(tm.MapobjectType.id.in_(mapobject_type_ids)).\
                 delete()
+        FeatureValueCache(self.experiment_id).invalidate()
 
-    def _load_pipeline_input(self, site_id):
+    def _plan_pipeline_input(self, site_ids):
+        '''Determines the input of the pipeline for all given sites upfront
+        using a few set-based queries, such that the database doesn't have to
+        be queried repeatedly for each individual site and image.
+        Illumination statistics are loaded only once for each channel.
+
+        Parameters
+        ----------
+        site_ids: List[int]
+            IDs of the sites that should be processed
+
+        Returns
+        -------
+        dict
+            input description with keys "channels" (mapping of channel name to
+            ID and bit depth), "illumstats" (mapping of channel name to
+            illumination statistics of channels that should be corrected)
+            and "sites" (mapping of site ID to dimensions, offsets, residues,
+            shifts, time points, z-planes and image files of the site)
+
+        Raises
+        ------
+        tmlib.errors.PipelineDescriptionError
+            when a channel or the illumination statistics of a channel that
+            should be corrected don't exist
+        '''
+        logger.info('plan pipeline inputs for %d sites', len(site_ids))
+        channel_input = self.project.pipe.description.input.channels
+        channel_names = [ch.name for ch in channel_input]
+        plan = {'channels': dict(), 'illumstats': dict(), 'sites': dict()}
+        with tm.utils.ExperimentSession(self.experiment_id) as session:
+            channels = session.query(tm.Channel).\
+                filter(tm.Channel.name.in_(channel_names)).\
+                all()
+            channel_lut = {c.id: c for c in channels}
+            for channel in channels:
+                plan['channels'][channel.name] = {
+                    'id': channel.id, 'bit_depth': channel.bit_depth
+                }
+            for name in channel_names:
+                if name not in plan['channels']:
+                    raise PipelineDescriptionError(
+                        'Channel "%s" does not exist.' % name
+                    )
+
+            corrected_channel_names = [
+                ch.name for ch in channel_input if ch.correct
+            ]
+            if corrected_channel_names:
+                stats_files = session.query(tm.IllumstatsFile).\
+                    join(tm.Channel).\
+                    filter(tm.Channel.name.in_(corrected_channel_names)).\
+                    all()
+                stats_files = {f.channel.name: f for f in stats_files}
+                for name in corrected_channel_names:
+                    if name not in stats_files:
+                        raise PipelineDescriptionError(
+                            'No illumination statistics file found for '
+                            'channel "%s"' % name
+                        )
+                    logger.info(
+                        'load illumination statistics for channel "%s"', name
+                    )
+                    plan['illumstats'][name] = stats_files[name].get()
+
+            # Offsets of sites are calculated for all sites at once rather
+            # than via the relationships of each individual site.
+            layout = ExperimentLayout.load(session)
+            site_index = layout.get_site_index(site_ids)
+            offsets = layout.aligned_offsets[site_index]
+            sizes = layout.aligned_image_sizes[site_index]
+            residues = layout.residues[site_index]
+            for i, site_id in enumerate(site_ids):
+                top, bottom, left, right = residues[i].tolist()
+                plan['sites'][site_id] = {
+                    'y_offset': int(offsets[i, 0]),
+                    'x_offset': int(offsets[i, 1]),
+                    'height': int(sizes[i, 0]),
+                    'width': int(sizes[i, 1]),
+                    'residues': {
+                        'bottom': bottom,
+                        'top': top,
+                        'left': left,
+                        'right': right
+                    },
+                    'shifts': dict(),
+                    'tpoints': set(),
+                    'zplanes': set(),
+                    'image_files': collections.defaultdict(list)
+                }
+
+            shifts = session.query(
+                    tm.SiteShift.site_id, tm.SiteShift.cycle_id,
+                    tm.SiteShift.y, tm.SiteShift.x
+                ).\
+                filter(tm.SiteShift.site_id.in_(site_ids)).\
+                all()
+            for s in shifts:
+                plan['sites'][s.site_id]['shifts'][s.cycle_id] = (s.y, s.x)
+
+            image_files = session.query(
+                    tm.ChannelImageFile.id,
+                    tm.ChannelImageFile._location.label('location'),
+                    tm.ChannelImageFile.tpoint, tm.ChannelImageFile.zplane,
+                    tm.ChannelImageFile.site_id, tm.ChannelImageFile.cycle_id,
+                    tm.ChannelImageFile.channel_id
+                ).\
+                filter(tm.ChannelImageFile.site_id.in_(site_ids)).\
+                all()
+            for f in image_files:
+                site = plan['sites'][f.site_id]
+                site['tpoints'].add(f.tpoint)
+                site['zplanes'].add(f.zplane)
+                if f.channel_id not in channel_lut:
+                    continue
+                channel = channel_lut[f.channel_id]
+                location = f.location
+                if location is None:
+                    location = os.path.join(
+                        channel.get_image_file_location(f.id),
+                        tm.ChannelImageFile.FILENAME_FORMAT.format(id=f.id)
+                    )
+                site['image_files'][channel.name].append({
+                    'id': f.id, 'location': location,
+                    'tpoint': f.tpoint, 'zplane': f.zplane,
+                    'cycle_id': f.cycle_id
+                })
+
+        return plan
+
+    def _load_pipeline_input(self, site_id, plan=None):
         logger.info('load pipeline inputs')
+        if plan is None:
+            plan = self._plan_pipeline_input([site_id])
+        site = plan['sites'][site_id]
         # Use an in-memory store for pipeline data and only insert outputs
         # into the database once the whole pipeline has completed successfully.
         store = {
             'site_id': site_id,
+            'offset': (site['y_offset'], site['x_offset']),
             'pipe': dict(),
             'current_figure': list(),
             'objects': dict(),
@@ -259,91 +432,77 @@ class ImageAnalysisPipelineEngine(WorkflowStepAPI):
         # desired behavior.
         channel_input = self.project.pipe.description.input.channels
         objects_input = self.project.pipe.description.input.objects
-        with tm.utils.ExperimentSession(self.experiment_id) as session:
-            site = session.query(tm.Site).get(site_id)
-
-            records = session.query(tm.ChannelImageFile.tpoint).\
-                filter_by(site_id=site.id).\
-                distinct()
-            tpoints = [r.tpoint for r in records]
-            n_tpoints = len(tpoints)
-            records = session.query(tm.ChannelImageFile.zplane).\
-                filter_by(site_id=site.id).\
-                distinct()
-            zplanes = [r.zplane for r in records]
-            n_zplanes = len(zplanes)
-
-            y_offset, x_offset = site.aligned_offset
-            height = site.aligned_height
-            width = site.aligned_width
-
-            for ch in channel_input:
-                channel = session.query(
-                        tm.Channel.bit_depth, tm.Channel.id
-                    ).\
-                    filter_by(name=ch.name).\
-                    one()
-                if channel.bit_depth == 16:
-                    dtype = np.uint16
-                elif channel.bit_depth == 8:
-                    dtype = np.uint8
-                image_array = np.zeros(
-                    (height, width, n_zplanes, n_tpoints), dtype
+        tpoints = site['tpoints']
+        n_tpoints = len(tpoints)
+        zplanes = site['zplanes']
+        n_zplanes = len(zplanes)
+
+        y_offset = site['y_offset']
+        x_offset = site['x_offset']
+        height = site['height']
+        width = site['width']
+
+        for ch in channel_input:
+            channel = plan['channels'][ch.name]
+            if channel['bit_depth'] == 16:
+                dtype = np.uint16
+            elif channel['bit_depth'] == 8:
+                dtype = np.uint8
+            image_array = np.zeros(
+                (height, width, n_zplanes, n_tpoints), dtype
+            )
+            if ch.correct:
+                stats = plan['illumstats'][ch.name]
+            else:
+                stats = None
+
+            logger.info('load images for channel "%s"', ch.name)
+            for f in site['image_files'][ch.name]:
+                logger.info('load image %d', f['id'])
+                metadata = ChannelImageMetadata(
+                    channel_id=channel['id'], site_id=site_id,
+                    tpoint=f['tpoint'], zplane=f['zplane'],
+                    cycle_id=f['cycle_id']
                 )
+                metadata.bottom_residue = site['residues']['bottom']
+                metadata.top_residue = site['residues']['top']
+                metadata.left_residue = site['residues']['left']
+                metadata.right_residue = site['residues']['right']
+                shift = site['shifts'].get(f['cycle_id'])
+                if shift is not None:
+                    metadata.y_shift, metadata.x_shift = shift
+                img = tm.ChannelImageFile.load(f['location'], metadata)
                 if ch.correct:
-                    logger.info(
-                        'load illumination statistics for channel "%s"', ch.name
-                    )
-                    try:
-                        stats_file = session.query(tm.IllumstatsFile).\
-                            join(tm.Channel).\
-                            filter(tm.Channel.name == ch.name).\
-                            one()
-                    except NoResultFound:
-                        raise PipelineDescriptionError(
-                            'No illumination statistics file found for '
-                            'channel "%s"' % ch.name
-                        )
-                    stats = stats_file.get()
-                else:
-                    stats = None
+                    logger.info('correct image %d', f['id'])
+                    img = img.correct(stats)
+                logger.debug('align image %d', f['id'])
+                img = img.align()  # shifted and cropped!
+                image_array[:, :, f['zplane'], f['tpoint']] = img.array
+            store['pipe'][ch.name] = image_array
 
-                logger.info('load images for channel "%s"', ch.name)
-                image_files = session.query(tm.ChannelImageFile).\
-                    filter_by(site_id=site.id, channel_id=channel.id).\
-                    all()
-                for f in image_files:
-                    logger.info('load image %d', f.id)
-                    img = f.get()
-                    if ch.correct:
-                        logger.info('correct image %d', f.id)
-                        img = img.correct(stats)
-                    logger.debug('align image %d', f.id)
-                    img = img.align()  # shifted and cropped!
-                    image_array[:, :, f.zplane, f.tpoint] = img.array
-                store['pipe'][ch.name] = image_array
-
-            for obj in objects_input:
-                mapobject_type = session.query(tm.MapobjectType).\
-                    filter_by(name=obj.name).\
-                    one()
-                polygons = list()
-                for t in sorted(tpoints):
-                    zpolys = list()
-                    for z in sorted(zplanes):
-                        zpolys.append(
-                            mapobject_type.get_segmentations_per_site(
-                                site_id=site.id, tpoint=t, zplane=z
+        if objects_input:
+            with tm.utils.ExperimentSession(self.experiment_id) as session:
+                for obj in objects_input:
+                    mapobject_type = session.query(tm.MapobjectType).\
+                        filter_by(name=obj.name).\
+                        one()
+                    polygons = list()
+                    for t in sorted(tpoints):
+                        zpolys = list()
+                        for z in sorted(zplanes):
+                            zpolys.append(
+                                mapobject_type.get_segmentations_per_site(
+                                    site_id=site_id, tpoint=t, zplane=z
+                                )
                             )
-                        )
-                    polygons.append(zpolys)
+                        polygons.append(zpolys)
 
-                segm_obj = SegmentedObjects(obj.name, obj.name)
-                segm_obj.add_polygons(
-                    polygons, y_offset, x_offset, (height, width)
-                )
-                store['objects'][segm_obj.name] = segm_obj
-                store['pipe'][segm_obj.name] = segm_obj.value
+                    segm_obj = SegmentedObjects(obj.name, obj.name)
+                    segm_obj.add_polygons(
+                        polygons, y_offset, x_offset, (height, width)
+                    )
+                    store['objects'][segm_obj.name] = segm_obj
+                    store['pipe'][segm_obj.name] = segm_obj.value
 
         # Remove single-dimensions from image arrays.
         # NOTE: It would be more consistent to preserve shape, but most people
@@ -402,6 +561,7 @@ class ImageAnalysisPipelineEngine(WorkflowStepAPI):
             segmentation_layer_ids = dict()
             objects_to_save = dict()
             feature_ids = collections.defaultdict(dict)
+            column_indices = collections.defaultdict(dict)
             for obj_name, segm_objs in store['objects'].iteritems():
                 if segm_objs.save:
                     logger.info('objects of type "%s" are saved', obj_name)
@@ -418,14 +578,23 @@ class ImageAnalysisPipelineEngine(WorkflowStepAPI):
                 # Create a feature values entry for each segmented object at
                 # each time point.
                 logger.info('add features for objects of type "%s"', obj_name)
-                for feature_name in segm_objs.measurements[0].columns:
+                columns = segm_objs.measurements[0].columns
+                for i, feature_name in enumerate(columns):
                     logger.debug('add feature "%s"', feature_name)
                     feature = session.get_or_create(
                         tm.Feature, name=feature_name,
                         mapobject_type_id=mapobject_type_ids[obj_name],
                         is_aggregate=False
                     )
+                    if (cfg.columnar_feature_values and
+                            feature.column_index is None):
+                        # Since all jobs run the same pipeline, features are
+                        # always measured in the same order.
+                        feature.column_index = i
+                        session.flush()
                     feature_ids[obj_name][feature_name] = feature.id
+                    column_indices[obj_name][feature_name] = \
+                        feature.column_index
 
                 for (t, z), plane in segm_objs.iter_planes():
                     segmentation_layer = session.get_or_create(
@@ -437,8 +606,7 @@ class ImageAnalysisPipelineEngine(WorkflowStepAPI):
                     segmentation_layer_ids[(obj_name, t, z)] = \
                         segmentation_layer.id
 
-            site = session.query(tm.Site).get(store['site_id'])
-            y_offset, x_offset = site.aligned_offset
+            y_offset, x_offset = store['offset']
 
             mapobject_ids = dict()
             for obj_name, segm_objs in objects_to_save.iteritems():
@@ -541,6 +709,7 @@ class ImageAnalysisPipelineEngine(WorkflowStepAPI):
                 )
                 logger.debug('round feature values to 6 decimals')
                 feature_values = list()
+                feature_statistics = list()
                 for t, data in enumerate(segm_objs.measurements):
                     data = data.round(6)  # single!
                     if data.empty:
@@ -553,7 +722,37 @@ class ImageAnalysisPipelineEngine(WorkflowStepAPI):
                         # Not sure this could happen.
                         logger.error('too many feature values')
                     column_lut = feature_ids[obj_name]
-                    for label, c in data.rename(columns=column_lut).iterrows():
+                    # Partial statistics of the site get merged in the
+                    # collect phase.
+                    stats = tm.FeatureStatistics.calculate(data.values)
+                    for j, name in enumerate(data.columns):
+                        feature_statistics.append(
+                            tm.SiteFeatureStatistics(
+                                feature_id=column_lut[name],
+                                site_id=store['site_id'], tpoint=t,
+                                **{k: v[j] for k, v in stats.iteritems()}
+                            )
+                        )
+                    value_matrix = None
+                    if cfg.columnar_feature_values:
+                        indices = [
+                            column_indices[obj_name][name]
+                            for name in data.columns
+                        ]
+                        if None in indices:
+                            logger.warn(
+                                'feature values of objects of type "%s" '
+                                'cannot be stored in columnar format',
+                                obj_name
+                            )
+                        else:
+                            value_matrix = np.full(
+                                (data.shape[0], max(indices) + 1), np.nan,
+                                dtype=np.float32
+                            )
+                            value_matrix[:, indices] = data.values
+                    data = data.rename(columns=column_lut)
+                    for i, (label, c) in enumerate(data.iterrows()):
                         logger.debug(
                             'add values for mapobject #%d at time point %d',
                             label, t
@@ -561,16 +760,32 @@ class ImageAnalysisPipelineEngine(WorkflowStepAPI):
                         values = dict(
                             zip(c.index.astype(str), c.values.astype(str))
                         )
+                        if value_matrix is not None:
+                            value_array = value_matrix[i, :]
+                        else:
+                            value_array = None
                         feature_values.append(
                             tm.FeatureValues(
                                 partition_key=store['site_id'],
                                 mapobject_id=mapobject_ids[label],
-                                tpoint=t, values=values
+                                tpoint=t, values=values,
+                                value_array=value_array
                             )
                         )
                 logger.debug('insert feature values into db table')
                 session.bulk_ingest(feature_values)
 
+                logger.debug('insert feature statistics into db table')
+                session.query(tm.SiteFeatureStatistics).\
+                    filter(
+                        tm.SiteFeatureStatistics.site_id == store['site_id'],
+                        tm.SiteFeatureStatistics.feature_id.in_(
+                            feature_ids[obj_name].values()
+                        )
+                    ).\
+                    delete()
+                session.add_all(feature_statistics)
+
     def create_debug_run_phase(self, submission_id):
         '''Creates a job collection for the debug "run" phase of the step.
 
@@ -667,23 +882,94 @@ class ImageAnalysisPipelineEngine(WorkflowStepAPI):
             job description
         assume_clean_state: bool, optional
             assume that output of previous runs has already been cleaned up
+
+        Note
+        ----
+        When the job description specifies more than one process via
+        "n_processes", sites get processed in parallel by a pool of worker
+        processes.
         '''
         logger.info('handle pipeline input')
 
-        self.start_engines()
+        # Determine the input of all sites upfront to avoid repeated queries.
+        plan = self._plan_pipeline_input(batch['site_ids'])
 
-        # Enable debugging of pipelines by providing the full path to images.
-        # This requires a work around for "plot" and "job_id" arguments.
-        for site_id in batch['site_ids']:
-            logger.info('process site %d', site_id)
-            store = self._load_pipeline_input(site_id)
-            store = self._run_pipeline(store, site_id, batch['plot'])
-            self._save_pipeline_outputs(store, assume_clean_state)
+        n_processes = batch.get('n_processes', 1)
+        if n_processes > 1:
+            self._run_sites_in_parallel(
+                batch, assume_clean_state, plan, n_processes
+            )
+        else:
+            self.start_engines()
+
+            # Enable debugging of pipelines by providing the full path to
+            # images. This requires a work around for "plot" and "job_id"
+            # arguments.
+            for site_id in batch['site_ids']:
+                self._process_site(
+                    site_id, batch['plot'], assume_clean_state, plan
+                )
+
+        # Feature values cached by data analysis tools are outdated.
+        FeatureValueCache(self.experiment_id).invalidate()
+
+    def _process_site(self, site_id, plot, assume_clean_state, plan):
+        logger.info('process site %d', site_id)
+        store = self._load_pipeline_input(site_id, plan)
+        store = self._run_pipeline(store, site_id, plot)
+        # Outputs of a site are only saved once the whole pipeline completed
+        # successfully, independent of the processing of other sites.
+        self._save_pipeline_outputs(store, assume_clean_state)
+        return site_id
+
+    def _run_sites_in_parallel(self, batch, assume_clean_state, plan,
+            n_processes):
+        '''Distributes the sites of a job across a pool of worker processes.
+        Each worker starts its own engines for non-Python modules and uses
+        only a single database connection.
+
+        Parameters
+        ----------
+        batch: dict
+            job description
+        assume_clean_state: bool
+            assume that output of previous runs has already been cleaned up
+        plan: dict
+            input description of all sites of the job
+            (see :meth:`_plan_pipeline_input`)
+        n_processes: int
+            number of worker processes
+        '''
+        logger.info(
+            'process %d sites in %d parallel processes',
+            len(batch['site_ids']), n_processes
+        )
+        # Database connections must not be shared with forked processes.
+        tm.utils.dispose_db_engines()
+        pool = multiprocessing.Pool(
+            n_processes, initializer=_initialize_worker,
+            initargs=(self, batch['plot'], assume_clean_state, plan)
+        )
+        try:
+            # Submit sites one by one, such that sites get distributed evenly
+            # even if processing times differ between sites.
+            results = pool.imap_unordered(
+                _process_site_in_worker, batch['site_ids'], chunksize=1
+            )
+            for site_id in results:
+                logger.info('completed processing of site %d', site_id)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
 
     def collect_job_output(self, batch):
         '''Computes the optimal representation of each
         :class:`SegmentationLayer <tmlib.models.layer.SegmentationLayer>` on the
-        map for zoomable visualization.
+        map for zoomable visualization and cleans up mapobjects with invalid
+        or missing segmentations or missing feature values.
 
         Parameters
         ----------
@@ -701,6 +987,7 @@ class ImageAnalysisPipelineEngine(WorkflowStepAPI):
                 for o in self.project.pipe.description.output.objects
             }
             segmented_mapobject_types = list()
+            polygon_layers = list()
             for layer in segmentation_layers:
                 mapobject_type_name = layer.mapobject_type.name
                 as_polygons = polygon_representation_lut.get(
@@ -713,45 +1000,179 @@ class ImageAnalysisPipelineEngine(WorkflowStepAPI):
                 if (layer.tpoint is not None and
                         layer.zplane is not None):
                     segmented_mapobject_types.append(layer.mapobject_type)
+                    if pt <= maxzoom:
+                        polygon_layers.append((layer.id, pt))
 
-            logger.info(
-                'clean-up mapobjects with invalid or missing segmentations '
-                'or missing feature values'
-            )
-            # DELETE queries with complex WHERE clauses are not supported
-            # for distributed tables. We therefore need to determine the ids
-            # of mapobjects first and then use a simple WHERE clause with ANY.
-            for mapobject_type in segmented_mapobject_types:
-                mapobjects = session.query(tm.Mapobject.id).\
-                    outerjoin(tm.MapobjectSegmentation).\
-                    filter(
-                        tm.MapobjectSegmentation.mapobject_id == None,
-                        tm.Mapobject.mapobject_type_id == mapobject_type.id
-                    ).\
-                    all()
-                mapobjects += session.query(tm.Mapobject.id).\
-                    outerjoin(tm.MapobjectSegmentation).\
-                    filter(
-                        ~tm.MapobjectSegmentation.geom_polygon.ST_IsValid(),
-                        tm.Mapobject.mapobject_type_id == mapobject_type.id
-                    ).\
-                    all()
-                # When checking for objects with  missing feature values, we
-                # need to make sure that the mapobject type has any features
-                # at all, otherwise all mapobjects would get deleted when
-                # applying this logic.
-                if len(mapobject_type.features) > 0:
-                    mapobjects += session.query(tm.Mapobject.id).\
-                        outerjoin(tm.FeatureValues).\
-                        filter(
-                            tm.FeatureValues.mapobject_id == None,
-                            tm.Mapobject.mapobject_type_id == mapobject_type.id
-                        ).\
-                        all()
-                mapobject_ids = [m.id for m in mapobjects]
-                session.query(tm.Mapobject).\
-                    filter(tm.Mapobject.id.in_(mapobject_ids)).\
-                    delete()
+            # When checking for objects with missing feature values, we
+            # need to make sure that the mapobject type has any features
+            # at all, otherwise all mapobjects would get deleted.
+            mapobject_types = {
+                t.id: len(t.features) > 0 for t in segmented_mapobject_types
+            }.items()
+            sites = session.query(tm.Site.id).all()
+            partition_keys = [s.id for s in sites]
+
+        logger.info(
+            'clean-up mapobjects with invalid or missing segmentations '
+            'or missing feature values'
+        )
+        # The collect phase runs as a single job, such that we can afford to
+        # use more than one database connection to target different shards
+        # in parallel.
+        tm.utils.dispose_db_engines()
+        tm.utils.set_pool_size(2 * cfg.db_nodes)
+        n_deleted = self._delete_invalid_mapobjects(
+            partition_keys, mapobject_types
+        )
+        logger.info('deleted %d invalid mapobjects', n_deleted)
+        FeatureValueCache(self.experiment_id).invalidate()
+
+        logger.info('simplify polygons of mapobjects for each zoom level')
+        n_simplified = self._simplify_segmentations(
+            partition_keys, polygon_layers, maxzoom
+        )
+        logger.info('created %d simplified polygons', n_simplified)
+        with tm.utils.ExperimentConnection(self.experiment_id) as conn:
+            # Invalidate representations of layers cached by the server.
+            conn.execute('''
+                UPDATE segmentation_layers
+                SET revision = coalesce(revision, 0) + 1,
+                    has_simplified_polygons = id = ANY(%(layer_ids)s)
+            ''', {
+                'layer_ids': [layer_id for layer_id, _ in polygon_layers]
+            })
+
+        logger.info('merge feature statistics of sites')
+        self._merge_feature_statistics()
+
+    def _merge_feature_statistics(self):
+        '''Merges partial statistics of all sites into
+        :class:`FeatureStatistics <tmlib.models.feature.FeatureStatistics>`
+        for each feature that was measured by the pipeline.
+        '''
+        with tm.utils.ExperimentConnection(self.experiment_id) as conn:
+            conn.execute('''
+                SELECT DISTINCT feature_id FROM site_feature_statistics
+            ''')
+            feature_ids = [r.feature_id for r in conn.fetchall()]
+            for feature_id in feature_ids:
+                logger.debug('merge statistics of feature %d', feature_id)
+                tm.FeatureStatistics.update(conn, feature_id)
+
+    def _delete_invalid_mapobjects(self, partition_keys, mapobject_types):
+        '''Deletes mapobjects with missing or invalid segmentations or
+        missing feature values separately for each partition and updates
+        the feature statistics of partitions from which mapobjects were
+        deleted. Partitions are processed in parallel.
+
+        Parameters
+        ----------
+        partition_keys: List[int]
+            values of the distribution column, i.e. IDs of sites
+        mapobject_types: List[Tuple[int, bool]]
+            ID of each mapobject type and whether objects of the type should
+            have feature values
+
+        Returns
+        -------
+        int
+            total number of deleted mapobjects
+        '''
+        n_partitions = len(partition_keys)
+        progress = {'count': 0}
+        lock = threading.Lock()
+        report_interval = max(1, n_partitions / 20)
+
+        # Shards of colocated tables that hold the same partition reside on
+        # the same worker server.
+        models = [tm.Mapobject, tm.MapobjectSegmentation, tm.FeatureValues]
+        with tm.utils.ExperimentConnection(self.experiment_id) as conn:
+            placements = {
+                model.__table__.name: conn.locate_partitions(
+                    model, partition_keys
+                )
+                for model in models
+            }
+
+        def delete(partition_keys):
+            counts = list()
+            with tm.utils.ExperimentConnection(self.experiment_id) as conn:
+                for partition_key in partition_keys:
+                    host, port, _ = placements['mapobjects'][partition_key]
+                    shard_ids = {
+                        table: p[partition_key][2]
+                        for table, p in placements.iteritems()
+                    }
+                    worker_connection = tm.utils.ExperimentWorkerConnection(
+                        self.experiment_id, host, port
+                    )
+                    with worker_connection as worker_conn:
+                        for mapobject_type_id, has_features in mapobject_types:
+                            count = tm.Mapobject.delete_invalid_objects_per_partition(
+                                worker_conn, shard_ids, partition_key,
+                                mapobject_type_id,
+                                check_feature_values=has_features
+                            )
+                            counts.append(count)
+                            if count > 0 and has_features:
+                                # Statistics of the site were calculated
+                                # before invalid mapobjects were deleted.
+                                tm.SiteFeatureStatistics.update_per_partition(
+                                    conn, partition_key, mapobject_type_id
+                                )
+                    with lock:
+                        progress['count'] += 1
+                        n = progress['count']
+                    if n % report_interval == 0 or n == n_partitions:
+                        logger.info(
+                            'cleaned up %d of %d partitions (%d%%)',
+                            n, n_partitions, 100 * n / n_partitions
+                        )
+            return counts
+
+        return sum(tm.utils.parallelize_query(delete, partition_keys))
+
+    def _simplify_segmentations(self, partition_keys, layers, maxzoom):
+        '''Precomputes simplified polygons of mapobjects for each zoom level
+        at which they get visualized as polygons separately for each
+        partition. Partitions are processed in parallel.
+
+        Parameters
+        ----------
+        partition_keys: List[int]
+            values of the distribution column, i.e. IDs of sites
+        layers: List[Tuple[int]]
+            ID of each segmentation layer and the lowest zoom level at which
+            polygons are visualized
+        maxzoom: int
+            maximal zoom level of the pyramid
+
+        Returns
+        -------
+        int
+            total number of simplified polygons
+
+        See also
+        --------
+        :class:`tmlib.models.mapobject.SimplifiedMapobjectSegmentation`
+        '''
+        if not layers:
+            return 0
+
+        def simplify(partition_keys):
+            counts = list()
+            with tm.utils.ExperimentConnection(self.experiment_id) as conn:
+                for partition_key in partition_keys:
+                    for layer_id, min_zoom in layers:
+                        count = tm.SimplifiedMapobjectSegmentation.\
+                            create_per_partition(
+                                conn, partition_key, layer_id, min_zoom,
+                                maxzoom
+                            )
+                        counts.append(count)
+            return counts
+
+        return sum(tm.utils.parallelize_query(simplify, partition_keys))
 
     @staticmethod
     def _add_feature(conn, name, mapobject_type_id, is_aggregate):
@@ -33,6 +33,15 @@ class JteratorBatchArguments(BatchArguments):
         default=100, flag='batch-size', short_flag='b'
     )
 
+    n_processes = Argument(
+        type=int, default=1, flag='n-processes',
+        help='''
+            number of processes across which the sites of a job should be
+            distributed (should not exceed the number of cores allocated
+            to each job)
+        '''
+    )
+
 
 @register_step_submission_args('jterator')
 class JteratorSubmissionArguments(SubmissionArguments):
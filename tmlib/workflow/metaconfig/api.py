@@ -25,6 +25,7 @@ from tmlib.workflow.metaconfig import metadata_reader_factory
 from tmlib.workflow.metaconfig import get_microscope_type_regex
 from tmlib.workflow.api import WorkflowStepAPI
 from tmlib.errors import MetadataError
+from tmlib.models.utils import delete_location
 from tmlib.workflow import register_step_api
 
 logger = logging.getLogger(__name__)
@@ -98,6 +99,8 @@ class MetadataConfigurator(WorkflowStepAPI):
         # Distributed tables cannot be dropped within a transaction
         with tm.utils.ExperimentSession(self.experiment_id, False) as session:
             logger.info('delete existing channel layers')
+            for layer in session.query(tm.ChannelLayer):
+                delete_location(layer.tiles_location)
             session.query(tm.ChannelLayerTile).delete()
             session.query(tm.ChannelLayer).delete()
             logger.info('delete existing channels')
@@ -319,7 +319,7 @@ class DatasetWriter(Writer):
         else:
             return False
 
-    def write(self, path, data, compression=False):
+    def write(self, path, data, compression=False, chunks=None):
         '''Creates a dataset and writes data to it.
 
         Parameters
@@ -331,6 +331,11 @@ class DatasetWriter(Writer):
         compression: bool, optional
             whether zip compression filter should be applied
             (default: ``False``)
+        chunks: Tuple[int], optional
+            shape of chunks in which the dataset should be stored, such that
+            subsets can be read without reading the entire dataset; must not
+            exceed the dimensions of `data` (default: ``None``, chunk shape
+            is chosen automatically when `compression` is ``True``)
 
         Raises
         ------
@@ -383,10 +388,12 @@ class DatasetWriter(Writer):
             else:
                 if compression:
                     self._stream.create_dataset(
-                        path, data=data, compression='gzip'
+                        path, data=data, compression='gzip', chunks=chunks
                     )
                 else:
-                    self._stream.create_dataset(path, data=data)
+                    self._stream.create_dataset(
+                        path, data=data, chunks=chunks
+                    )
 
     def write_subset(self, path, data,
                      index=None, row_index=None, column_index=None):